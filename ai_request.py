@@ -1,19 +1,76 @@
 import os
-from openai import AsyncOpenAI
+import time
+import asyncio
 
 from dotenv import load_dotenv
 
-from api_settings import API_CLIENTS
+from api_settings import API_CLIENTS, LLM_HEDGING, HEDGE_OFF, TASK_HEDGE_POLICIES, LLM_CACHE_TTL
+from llm_clients import llm_clients
+from provider_health import provider_health
+from provider_limits import provider_limits, estimate_request_tokens, ProviderBusy
+from llm_cache import llm_cache, make_cache_key, LLM_CACHE_ENABLED
+from llm_ledger import llm_ledger, classify_error, OK, ERROR, CACHED
+from metrics_server import register_collector
+from crm_metrics import LatencyHistogram
 
 load_dotenv()
 
 
+class StreamStats:
+    """Время до первого текста (TTFC) и полное время потоковых ответов"""
+
+    def __init__(self):
+        self.ttfc = LatencyHistogram()
+        self.total = LatencyHistogram()
+        self.streams = 0
+        self.fallbacks = 0     # провайдеры не отдали поток - ответ получен обычным запросом
+        self.interrupted = 0   # поток оборвался после начала ответа
+
+    def snapshot(self):
+        return {
+            "streams": self.streams,
+            "fallbacks": self.fallbacks,
+            "interrupted": self.interrupted,
+            "ttfc_p50": self.ttfc.quantile(0.5),
+            "ttfc_p95": self.ttfc.quantile(0.95),
+            "total_p50": self.total.quantile(0.5),
+            "total_p95": self.total.quantile(0.95),
+        }
+
+
+stream_stats = StreamStats()
+
+register_collector("llm_health", provider_health.snapshot, provider_health.render_prometheus)
+register_collector("llm_cache", llm_cache.stats)
+register_collector("llm_stream", stream_stats.snapshot)
+register_collector("llm_limits", provider_limits.snapshot, provider_limits.render_prometheus)
+register_collector("llm_ledger", llm_ledger.stats)
+
+
+def get_hedge_policy(task_name):
+    """Политика хеджирования для задачи (см. TASK_HEDGE_POLICIES в api_settings.py)"""
+    if not LLM_HEDGING:
+        return HEDGE_OFF
+    return TASK_HEDGE_POLICIES.get(task_name, HEDGE_OFF)
+
+
+def _is_valid_response(response):
+    """Ответ считается корректным, если в нем есть непустой текст"""
+    try:
+        return bool(response.choices and response.choices[0].message.content)
+    except (AttributeError, IndexError):
+        return False
+
+
 async def make_api_request_with_fallback(
     priority_list,           # Список приоритетов
     messages,                # Сообщения для API
     max_tokens=None,         # Максимум токенов
     temperature=0.1,         # Температура
-    task_name="API запрос"  # Название задачи для логов
+    task_name="API запрос",  # Название задачи для логов
+    hedge_policy=None,       # Политика хеджирования (по умолчанию - из api_settings по task_name)
+    cache_ttl=None,          # Время жизни ответа в кэше (по умолчанию - из api_settings, 0 - не кэшировать)
+    cache_validator=None     # Проверка текста ответа перед записью в кэш: функция(текст) -> bool
 ):
     """
     Пытается выполнить запрос, перебирая клиенты по приоритету
@@ -21,12 +78,75 @@ async def make_api_request_with_fallback(
     Returns:
         tuple: (response, used_client, used_model) или (None, None, None)
     """
-    
+    ttl = LLM_CACHE_TTL.get(task_name, 0) if cache_ttl is None else cache_ttl
+    if not (LLM_CACHE_ENABLED and ttl):
+        return await _make_request(priority_list, messages, max_tokens, temperature, task_name, hedge_policy)
+
+    cache_key = make_cache_key(task_name, priority_list, messages, temperature, max_tokens)
+    cached = await llm_cache.get(cache_key, task_name)
+    if cached:
+        print(f"💾 {task_name}: Ответ из кэша ({cached.client} / {cached.model})")
+        llm_ledger.record(task_name, cached.client, cached.model, 0, 0.0, CACHED)
+        return cached, cached.client, cached.model
+
+    response, used_client, used_model = await _make_request(
+        priority_list, messages, max_tokens, temperature, task_name, hedge_policy
+    )
+    # Ответ, который вызывающий код отбросит, не кэшируется - иначе повтор получит тот же ответ
+    if response and _is_valid_response(response):
+        content = response.choices[0].message.content
+        if cache_validator is None or cache_validator(content):
+            await llm_cache.put(cache_key, task_name, content, used_client, used_model, ttl)
+        else:
+            print(f"⚠️ {task_name}: Ответ не прошел проверку и не сохранен в кэш")
+    return response, used_client, used_model
+
+
+async def _call_provider(client_name, model_type, client, model, messages, max_tokens, temperature,
+                         task_name, attempt):
+    """
+    Один запрос к провайдеру: в пределах лимитов, с учетом здоровья провайдера и записью в журнал
+    (задержка считается без ожидания в очереди)
+    """
+    timing = {}
+
+    async def request():
+        timing["started"] = time.monotonic()
+        return await provider_health.call(
+            (client_name, model_type),
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        )
+
+    try:
+        response = await provider_limits.run(client_name, estimate_request_tokens(messages, max_tokens), request)
+    except (Exception, asyncio.CancelledError) as e:
+        latency = time.monotonic() - timing["started"] if timing else 0.0
+        llm_ledger.record(task_name, client_name, model, attempt, latency, classify_error(e))
+        raise
+    llm_ledger.record(task_name, client_name, model, attempt, time.monotonic() - timing["started"], OK,
+                      usage=getattr(response, "usage", None))
+    return response
+
+
+async def _make_request(priority_list, messages, max_tokens, temperature, task_name, hedge_policy):
+    """Запрос к провайдерам без кэша: по очереди или гонкой (см. TASK_HEDGE_POLICIES)"""
+    # Провайдеры с разомкнутым выключателем пропускаются, быстрые идут раньше
+    priority_list = provider_health.order(priority_list)
+
+    policy = hedge_policy or get_hedge_policy(task_name)
+    if policy.get("mode", "off") != "off":
+        return await _make_hedged_request(priority_list, messages, max_tokens, temperature, task_name, policy)
+
+    attempt = 0
     for client_name, model_type in priority_list:
         try:
-            client_config = API_CLIENTS[client_name]
-            client = client_config["client"]
-            model = client_config["models"][model_type]
+            client = llm_clients.get(client_name)
+            model = API_CLIENTS[client_name]["models"][model_type]
             
             if not client:
                 print(f"⚠️ {task_name}: {client_name} не инициализирован, пропускаем")
@@ -41,11 +161,9 @@ async def make_api_request_with_fallback(
             #     continue
             
             # Выполняем запрос
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
+            attempt += 1
+            response = await _call_provider(
+                client_name, model_type, client, model, messages, max_tokens, temperature, task_name, attempt - 1
             )
             
             print(f"✅ {task_name}: Успешно через {client_name} ({model})")
@@ -57,4 +175,192 @@ async def make_api_request_with_fallback(
     
     # Все попытки провалились
     print(f"💥 {task_name}: ВСЕ API недоступны!")
-    return None, None, None
\ No newline at end of file
+    return None, None, None
+
+
+async def _make_hedged_request(priority_list, messages, max_tokens, temperature, task_name, policy):
+    """
+    Гонка провайдеров: запасной запрос стартует по таймеру (mode="delay") или сразу (mode="parallel"),
+    первый корректный ответ побеждает, остальные запросы отменяются.
+    Ошибка провайдера сразу запускает следующего по списку, как в обычном режиме.
+    """
+    mode = policy.get("mode", "delay")
+    delay = policy.get("delay", 3)
+    max_parallel = max(1, policy.get("max_parallel", 2))
+
+    candidates = []
+    for client_name, model_type in priority_list:
+        client = llm_clients.get(client_name)
+        if not client:
+            print(f"⚠️ {task_name}: {client_name} не инициализирован, пропускаем")
+            continue
+        candidates.append((client_name, model_type, client, API_CLIENTS[client_name]["models"][model_type]))
+
+    async def call(client_name, model_type, client, model, attempt):
+        print(f"🔄 {task_name}: Пробуем {client_name} ({model})")
+        return await _call_provider(
+            client_name, model_type, client, model, messages, max_tokens, temperature, task_name, attempt
+        )
+
+    pending = {}
+    launched = 0
+
+    def launch_next():
+        nonlocal launched
+        client_name, model_type, client, model = candidates.pop(0)
+        pending[asyncio.ensure_future(call(client_name, model_type, client, model, launched))] = (client_name, model)
+        launched += 1
+
+    try:
+        if candidates:
+            launch_next()
+        if mode == "parallel":
+            while candidates and len(pending) < max_parallel:
+                launch_next()
+
+        while pending:
+            can_hedge = mode == "delay" and candidates and len(pending) < max_parallel
+            done, _ = await asyncio.wait(
+                pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"⏱️ {task_name}: нет ответа за {delay} с, запускаем запасной запрос")
+                launch_next()
+                continue
+
+            for task in done:
+                client_name, model = pending.pop(task)
+                if task.exception() is not None:
+                    print(f"❌ {task_name}: Ошибка {client_name} - {task.exception()}")
+                    continue
+                response = task.result()
+                if not _is_valid_response(response):
+                    print(f"❌ {task_name}: Пустой ответ от {client_name}")
+                    continue
+                print(f"✅ {task_name}: Успешно через {client_name} ({model})"
+                      + (f", отменяем {len(pending)} запрос(а)" if pending else ""))
+                return response, client_name, model
+
+            # Упавшие запросы сразу заменяются следующими по приоритету
+            while candidates and len(pending) < max_parallel:
+                launch_next()
+                if mode == "delay":
+                    break
+    finally:
+        for task in pending:
+            task.cancel()
+
+    print(f"💥 {task_name}: ВСЕ API недоступны!")
+    return None, None, None
+
+
+async def stream_api_request_with_fallback(
+    priority_list,           # Список приоритетов
+    messages,                # Сообщения для API
+    max_tokens=None,         # Максимум токенов
+    temperature=0.1,         # Температура
+    task_name="API запрос"  # Название задачи для логов
+):
+    """
+    Потоковый запрос (stream=True): возвращает фрагменты текста по мере генерации.
+    Провайдер, упавший до первого фрагмента, заменяется следующим; если поток не отдал
+    ни один провайдер - выполняется обычный запрос и текст возвращается одним фрагментом
+
+    Yields:
+        str: Очередной фрагмент ответа
+    """
+    started = time.monotonic()
+    stream_stats.streams += 1
+    attempt = 0
+
+    for client_name, model_type in provider_health.order(priority_list):
+        client = llm_clients.get(client_name)
+        model = API_CLIENTS[client_name]["models"][model_type]
+        if not client:
+            print(f"⚠️ {task_name}: {client_name} не инициализирован, пропускаем")
+            continue
+
+        # Слот провайдера занят на все время потока
+        tokens = estimate_request_tokens(messages, max_tokens)
+        limiter = provider_limits.get(client_name)
+        try:
+            await limiter.acquire(tokens)
+        except ProviderBusy as e:
+            print(f"⏳ {task_name}: {e}")
+            llm_ledger.record(task_name, client_name, model, attempt, 0.0, classify_error(e))
+            attempt += 1
+            continue
+
+        print(f"🔄 {task_name}: Пробуем поток {client_name} ({model})")
+        attempt_started = time.monotonic()
+        first_content_at = None
+        stream = None
+        completion = ""
+        try:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+            async for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                if first_content_at is None:
+                    first_content_at = time.monotonic() - started
+                    stream_stats.ttfc.observe(first_content_at)
+                    print(f"⚡ {task_name}: первый текст через {first_content_at:.2f} с ({client_name})")
+                completion += text
+                yield text
+
+            if first_content_at is not None:
+                provider_health.record_success((client_name, model_type), time.monotonic() - attempt_started)
+                llm_ledger.record(task_name, client_name, model, attempt, time.monotonic() - attempt_started, OK,
+                                  messages=messages, completion=completion)
+                stream_stats.total.observe(time.monotonic() - started)
+                print(f"✅ {task_name}: Поток завершен через {client_name} ({model})")
+                return
+            print(f"❌ {task_name}: Пустой поток от {client_name}")
+            llm_ledger.record(task_name, client_name, model, attempt, time.monotonic() - attempt_started, ERROR)
+        except Exception as e:
+            provider_health.record_failure((client_name, model_type), time.monotonic() - attempt_started, e)
+            provider_limits.note_error(client_name, e)
+            llm_ledger.record(task_name, client_name, model, attempt, time.monotonic() - attempt_started,
+                              classify_error(e))
+            if first_content_at is not None:
+                # Часть ответа уже показана пользователю - продолжить с другим провайдером нельзя
+                stream_stats.interrupted += 1
+                print(f"❌ {task_name}: Поток {client_name} оборвался - {e}")
+                return
+            print(f"❌ {task_name}: Ошибка потока {client_name} - {e}")
+        finally:
+            attempt += 1
+            limiter.release(tokens)
+            if stream is not None:
+                await stream.response.aclose()
+
+    # Ни один провайдер не отдал поток - обычный запрос с перебором провайдеров
+    stream_stats.fallbacks += 1
+    response, used_client, used_model = await make_api_request_with_fallback(
+        priority_list, messages, max_tokens, temperature, task_name
+    )
+    if response and _is_valid_response(response):
+        stream_stats.ttfc.observe(time.monotonic() - started)
+        stream_stats.total.observe(time.monotonic() - started)
+        yield response.choices[0].message.content
+
+
+def format_stream_stats(snapshot):
+    """Статистика потоковых ответов для сообщения в Telegram (HTML)"""
+    if not snapshot["streams"]:
+        return "⚡ <b>Потоковые ответы:</b> запросов еще не было"
+
+    def seconds(value):
+        return f"{value:.2f} с" if value is not None else "-"
+
+    return (f"⚡ <b>Потоковые ответы:</b> {snapshot['streams']} запр., "
+            f"первый текст p50 {seconds(snapshot['ttfc_p50'])} / p95 {seconds(snapshot['ttfc_p95'])}, "
+            f"полностью p50 {seconds(snapshot['total_p50'])} / p95 {seconds(snapshot['total_p95'])}, "
+            f"без потока {snapshot['fallbacks']}, оборвано {snapshot['interrupted']}")
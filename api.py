@@ -1,16 +1,25 @@
 import os
 import json
 import asyncio
-import requests
-from openai import AsyncOpenAI
+from collections import deque
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 from ai_request import make_api_request_with_fallback
 from validate import convert_date
+from crm_client import get_crm_client, CRMError, make_idempotency_key, IDEMPOTENCY_KEYS_ENABLED
+from roster_cache import RosterCache
+from roster_snapshot import RosterSnapshot, ROSTER_SNAPSHOT_PATH
+from name_index import NameIndex, SCORE_SUBSTRING
+from single_flight import SingleFlight
+from crm_metrics import crm_metrics
+from metrics_server import register_collector
 
 load_dotenv()
 
+# Одновременные одинаковые GET-запросы к CRM выполняются один раз, результат общий
+crm_flights = SingleFlight()
+
 async def addPeople(employee):
     print(f"🔍 Добавляем пользователя {employee.get('full_name', ''), employee.get('position', ''), employee.get('phone', ''), employee.get('snils', ''), employee.get('inn', ''), employee.get('birth_date', ''), employee.get( '@'+'photo', '')}")
     data = {
@@ -24,31 +33,31 @@ async def addPeople(employee):
         "photo": employee.get( '@'+'photo', "")
     }
     try:
-        response = requests.post(
-            os.getenv("BASE_URL") + "/api/people",
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "User-Agent": "PolzaAI-Bot/1.0",
-                "Authorization": f'Bearer {os.getenv("API_TOKEN")}'
-            },
-            json=data,
-            timeout=30,
-                proxies={"http": None, "https": None}
-        )
+        # С ключом идемпотентности POST можно безопасно повторять при сбоях
+        idempotency_key = make_idempotency_key(data) if IDEMPOTENCY_KEYS_ENABLED else None
+        response = await get_crm_client().post("/api/people", "people_create", json_data=data, idempotency_key=idempotency_key)
     except Exception as e:
         print(f"❌ Ошибка при добавлении пользователя {employee.get('full_name', '')}: {e}")
         return None
 
     if response.status_code == 200 or response.status_code == 201:
         print(f"✅ Пользователь {employee.get('full_name', '')} успешно добавлен")
+        roster_cache.invalidate()
         print(f"📋 Ответ сервера: {response.text}")
         return response.json()
     else:
         print(f"❌ Ошибка при добавлении пользователя {employee.get('full_name', '')}: {response.status_code} {response.text}")
         return None
 
-async def UpdatePeople(employee):
+async def UpdatePeople(employee, only_filled=False):
+    """
+    Обновить сотрудника в CRM
+
+    Args:
+        employee: Данные сотрудника (с id)
+        only_filled: Отправить только заполненные поля, не меняя статус и фото
+                     (массовый импорт дополняет данные CRM, а не заменяет их)
+    """
     print(f"🔍 Обновляем пользователя {employee.get('full_name', '')}")
     data = {
         "full_name": employee.get("full_name", ""),
@@ -56,49 +65,36 @@ async def UpdatePeople(employee):
         "phone": employee.get("phone", ""),
         "snils": employee.get("snils", ""),
         "inn": employee.get("inn", ""),
-        "birth_date": await convert_date(employee.get("birth_date", "")),
+        "birth_date": await convert_date(employee.get("birth_date", "")) if employee.get("birth_date", "").strip() else "",
         "status": "В ожидании",
         "photo": employee.get( '@'+'photo', "")
     }
-    url = os.getenv("BASE_URL") + "/api/people/" + str(employee.get("id", ""))
-    print(f"🌐 URL для обновления: {url}")
+    if only_filled:
+        data = {field: value for field, value in data.items() if value and field not in ("status", "photo")}
     try:
-        response = requests.put(
-            url,
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "User-Agent": "PolzaAI-Bot/1.0",
-                "Authorization": f'Bearer {os.getenv("API_TOKEN")}'
-            },
-            json=data,
-            timeout=30,
-                proxies={"http": None, "https": None}
-        )
+        response = await get_crm_client().put("/api/people/" + str(employee.get("id", "")), "people_update", json_data=data)
     except Exception as e:
         print(f"❌ Ошибка при обновлении пользователя {employee.get('full_name', '')}: {e}")
         return None
 
     if response.status_code == 200 or response.status_code == 201:
         print(f"✅ Пользователь {employee.get('full_name', '')} успешно обновлен")
+        roster_cache.invalidate()
         return response.json()
     else:
         print(f"❌ Ошибка при обновлении пользователя {employee.get('full_name', '')}: {response.status_code} {response.text}")
         return None
 
+async def _get_person_response(id):
+    """GET /api/people/{id} с объединением одновременных запросов одного сотрудника"""
+    return await crm_flights.do(
+        ("people_get", str(id)),
+        lambda: get_crm_client().get("/api/people/" + str(id), "people_get")
+    )
+
 async def getPeople(id):
     try:
-        response = requests.get(
-            os.getenv("BASE_URL") + "/api/people/" + str(id),
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "User-Agent": "PolzaAI-Bot/1.0",
-                "Authorization": f'Bearer {os.getenv("API_TOKEN")}'
-            },
-            timeout=30,
-                proxies={"http": None, "https": None}
-        )
+        response = await _get_person_response(id)
     except Exception as e:
         print(f"❌ Ошибка при получении пользователя {id}: {e}")
         return None
@@ -110,10 +106,135 @@ async def getPeople(id):
         print(f"❌ Ошибка при получении пользователя {id}: {response.status_code} {response.text}")
         return None
 
+# Постраничная загрузка сотрудников
+ROSTER_PAGE_SIZE = int(os.getenv("ROSTER_PAGE_SIZE", "250"))
+ROSTER_FETCH_CONCURRENCY = int(os.getenv("ROSTER_FETCH_CONCURRENCY", "4"))
+# Лимит единственного запроса, если CRM не поддерживает параметр page (раньше весь список - limit=1000)
+ROSTER_SINGLE_REQUEST_LIMIT = int(os.getenv("ROSTER_SINGLE_REQUEST_LIMIT", "10000"))
+
+# CRM отдала на второй странице те же записи, что на первой: page игнорируется
+_page_param_ignored = False
+
+def _last_page(payload, page_size):
+    """Номер последней страницы из метаданных пагинации (если сервер их отдает)"""
+    meta = payload.get('meta') if isinstance(payload.get('meta'), dict) else payload
+    if meta.get('last_page'):
+        return int(meta['last_page'])
+    if meta.get('total') is not None:
+        return max(1, -(-int(meta['total']) // page_size))
+    return None
+
+async def _fetch_people_page(page, page_size):
+    """
+    Загружает одну страницу /api/people/compact
+    
+    Returns:
+        tuple: (список сотрудников, номер последней страницы или None)
+    """
+    resp = await crm_flights.do(
+        ("people_compact", page, page_size),
+        lambda: get_crm_client().get(
+            "/api/people/compact",
+            "people_compact",
+            params={"page": page, "limit": page_size}
+        )
+    )
+    if resp.status_code != 200:
+        raise CRMError(f"API вернул статус {resp.status_code}", resp.url, resp.text)
+    data = resp.json()
+    if not isinstance(data, dict) or 'data' not in data:
+        raise CRMError("Неверный формат данных", resp.url, resp.text)
+    return data['data'], _last_page(data, page_size)
+
+async def iter_people(page_size=None, concurrency=None):
+    """
+    Асинхронный генератор сотрудников: страницы загружаются параллельно
+    (не больше concurrency одновременно), записи отдаются по мере загрузки
+    
+    Args:
+        page_size: Размер страницы
+        concurrency: Сколько страниц загружать одновременно
+    
+    Yields:
+        dict: Сотрудник
+    
+    Raises:
+        CRMError: Неожиданный ответ CRM
+    """
+    global _page_param_ignored
+    page_size = page_size or ROSTER_PAGE_SIZE
+    concurrency = concurrency or ROSTER_FETCH_CONCURRENCY
+    seen_ids = set()
+
+    def new_records(items):
+        # Защита от сервера, который игнорирует page и отдает одно и то же
+        result = []
+        for item in items:
+            item_id = item.get('id') if isinstance(item, dict) else None
+            if item_id is not None:
+                if item_id in seen_ids:
+                    continue
+                seen_ids.add(item_id)
+            result.append(item)
+        return result
+
+    if _page_param_ignored:
+        items, _ = await _fetch_people_page(1, ROSTER_SINGLE_REQUEST_LIMIT)
+        for item in new_records(items):
+            yield item
+        return
+
+    # Первая страница - отдельно, чтобы узнать общее число страниц
+    items, last_page = await _fetch_people_page(1, page_size)
+    for item in new_records(items):
+        yield item
+    if last_page is not None and last_page <= 1:
+        return
+    if last_page is None and len(items) < page_size:
+        return
+
+    pending = deque()
+    next_page = 2
+    try:
+        while True:
+            # Держим в работе не больше concurrency страниц; если число страниц
+            # неизвестно - загружаем наперед, пока не придет неполная страница
+            while len(pending) < concurrency and (last_page is None or next_page <= last_page):
+                pending.append((next_page, asyncio.create_task(_fetch_people_page(next_page, page_size))))
+                next_page += 1
+            if not pending:
+                break
+
+            page, task = pending.popleft()
+            items, _ = await task
+            fresh = new_records(items)
+            if last_page is None and page == 2 and items and not fresh:
+                # Вторая страница повторяет первую: page игнорируется, иначе список обрезался бы
+                # до одной страницы - загружаем всех одним запросом
+                print(f"⚠️ CRM игнорирует параметр page, загружаем сотрудников одним запросом "
+                      f"(limit={ROSTER_SINGLE_REQUEST_LIMIT})")
+                _page_param_ignored = True
+                items, _ = await _fetch_people_page(1, ROSTER_SINGLE_REQUEST_LIMIT)
+                for item in new_records(items):
+                    yield item
+                break
+            for item in fresh:
+                yield item
+            if last_page is None and (len(items) < page_size or not fresh):
+                break
+    finally:
+        for _, task in pending:
+            task.cancel()
+
 async def allPeople():
 
     """Вызывает внешний API с надежной обработкой ошибок"""
     
+    # Одновременные вызовы (поиск, планировщик, фоновое обновление кэша) делят одну загрузку.
+    # Поколение кэша в ключе: после записи в CRM новые вызовы не присоединяются к загрузке, начатой до нее
+    return await crm_flights.do(("people_all", roster_cache.generation), _load_all_people)
+
+async def _load_all_people():
     try:
         api_token = os.getenv("API_TOKEN")
         
@@ -123,71 +244,36 @@ async def allPeople():
                 "details": "Проверьте файл .env и переменную API_TOKEN"
             }
         
-        headers = {
-            'User-Agent': 'PolzaAI-Bot/1.0',
-            'Authorization': f'Bearer {api_token}'
-        }
+        employees = [employee async for employee in iter_people()]
         
-
-        resp = requests.get(
-            f"{os.getenv('BASE_URL')}/api/people/compact?limit=1000",  # Устанавливаем лимит 1000 для получения всех людей
-            timeout=60,  # Увеличиваем таймаут для больших запросов
-            proxies={"http": None, "https": None},
-            headers=headers
-        )
-        
-    # Проверяем, сколько записей получили
-        if resp.status_code == 200:
-            data = resp.json()
-            if isinstance(data, dict) and 'data' in data:
-                print(f"Получено {len(data['data'])} записей")
-                return data['data']
-            else:
-                return {
-                    "error": "Неверный формат данных",
-                    "details": f"URL: {os.getenv('BASE_URL')}/api/people/compact?limit=1000",
-                    "response_text": resp.text
-                }
-        else:
-            return {
-                "error": f"API вернул статус {resp.status_code}",
-                "details": f"URL: {os.getenv('BASE_URL')}/api/people/compact?limit=1000",
-                "response_text": resp.text
-            }
+        # Проверяем, сколько записей получили
+        print(f"Получено {len(employees)} записей")
+        return employees
+    except CRMError as e:
+        return {
+            "error": str(e),
+            "details": f"URL: {e.url}",
+            "response_text": e.response_text
+        }
     except Exception as e:
         print(f"❌ Ошибка при получении всех пользователей: {e}")
         return None
 
 
-import re
+# Общий кэш сотрудников: поиск и планировщик уведомлений читают через него.
+# При старте кэш заполняется из локального снимка, пока в фоне идет синхронизация с CRM
+roster_cache = RosterCache(
+    allPeople,
+    stream_loader=iter_people,
+    snapshot=RosterSnapshot(ROSTER_SNAPSHOT_PATH) if ROSTER_SNAPSHOT_PATH else None
+)
 
-def normalize_text(text):
-    """Нормализует текст для поиска: убирает ВСЕ пробелы, приводит к нижнему регистру"""
-    if not text:
-        return ""
-    # Убираем ВСЕ пробелы, переносы строк, табы
-    normalized = re.sub(r'\s+', '', str(text).strip())
-    # Приводим к нижнему регистру
-    return normalized.lower()
+# Метрики CRM для /crm_stats и эндпоинта /metrics
+register_collector("crm", crm_metrics.snapshot, crm_metrics.render_prometheus)
+register_collector("crm_client", lambda: dict(get_crm_client().stats))
+register_collector("crm_single_flight", crm_flights.stats)
+register_collector("roster_cache", roster_cache.stats)
 
-def fuzzy_search(query, target_text):
-    """Нечеткий поиск с нормализацией текста"""
-    if not query or not target_text:
-        return False
-    
-    # Нормализуем оба текста
-    norm_query = normalize_text(query)
-    norm_target = normalize_text(target_text)
-    
-    # Точное совпадение
-    if norm_query == norm_target:
-        return True
-    
-    # Поиск подстроки
-    if norm_query in norm_target:
-        return True
-    
-    return False
 
 async def get_employee_certificates(employee_id):
     """
@@ -206,17 +292,7 @@ async def get_employee_certificates(employee_id):
             print("❌ API_TOKEN не найден")
             return None
         
-        headers = {
-            'User-Agent': 'PolzaAI-Bot/1.0',
-            'Authorization': f'Bearer {api_token}'
-        }
-        
-        resp = requests.get(
-            f"{os.getenv('BASE_URL')}/api/people/{employee_id}",
-            timeout=30,
-            proxies={"http": None, "https": None},
-            headers=headers
-        )
+        resp = await _get_person_response(employee_id)
         
         if resp.status_code == 200:
             data = resp.json()
@@ -247,66 +323,96 @@ async def get_employee_certificates(employee_id):
         print(f"❌ Ошибка при получении сертификатов: {e}")
         return []
 
-async def search_employees(query):
+def _filter_employee(employee):
+    """Основные поля сотрудника + сертификаты"""
+    return {
+        'id': employee.get('id'),
+        'full_name': employee.get('full_name'),
+        'position': employee.get('position'),
+        'phone': employee.get('phone'),
+        'status': employee.get('status', 'Не указан'),
+        'snils': employee.get('snils'),
+        'inn': employee.get('inn'),
+        'birth_date': employee.get('birth_date'),
+        'photo': employee.get('photo'),
+        'certificates': employee.get('all_certificates')
+    }
+
+
+_name_index = None
+
+async def get_name_index():
     """
-    Улучшенный поиск сотрудников с нормализацией текста
+    Индекс ФИО для текущей версии кэша сотрудников (перестраивается только при обновлении кэша)
+    
+    Returns:
+        tuple: (NameIndex, employees) или (None, результат с ошибкой)
+    """
+    global _name_index
+    employees = await roster_cache.get()
+    if not isinstance(employees, list):
+        return None, employees
+    if _name_index is None or _name_index.version != roster_cache.version:
+        _name_index = NameIndex(employees, roster_cache.version)
+        print(f"🔍 Индекс ФИО построен: {len(_name_index)} сотрудников (версия {roster_cache.version})")
+    return _name_index, employees
+
+async def search_employees_ranked(query, limit=5, min_score=0):
+    """
+    Ранжированный поиск сотрудников по индексу ФИО
     
     Args:
         query: Поисковый запрос (ФИО, часть имени и т.д.)
+        limit: Сколько лучших совпадений вернуть
+        min_score: Минимальная оценка совпадения (см. name_index)
     
     Returns:
-        dict: Найденный сотрудник или None
+        list: Найденные сотрудники (с полем 'score') по убыванию релевантности
     """
-    print(f"🔍 search_employees вызвана с запросом: {query}")
     if not query or not query.strip():
-        print("❌ Пустой запрос")
-        return None
+        return []
     
     try:
-        print(f"🔍 Получаем всех сотрудников...")
-        employees = await allPeople()
-        print(f"🔍 Получено {len(employees) if employees else 0} сотрудников")
-       
-        
-        if not employees or isinstance(employees, dict) and 'error' in employees:
+        index, employees = await get_name_index()
+        if index is None:
             print(f"❌ Ошибка получения данных: {employees}")
-            return None
-      
-        # Ищем точное совпадение
-        print(f"🔍 Начинаем поиск среди {len(employees)} сотрудников")
-        for i, employee in enumerate(employees):
-            if not isinstance(employee, dict) or 'full_name' not in employee:
-                continue
-            
-            employee_name = employee.get('full_name', '')
-            
-            if fuzzy_search(query, employee_name):
-                print(f"✅ Найден сотрудник: {employee_name}")
-                
-                # Получаем сертификаты сотрудника
-                employee_id = employee.get('id')
-                
-                
-                # Возвращаем основные поля + сертификаты
-                filtered_employee = {
-                    'id': employee.get('id'),
-                    'full_name': employee.get('full_name'),
-                    'position': employee.get('position'),
-                    'phone': employee.get('phone'),
-                    'status': employee.get('status', 'Не указан'),
-                    'snils': employee.get('snils'),
-                    'inn': employee.get('inn'),
-                    'birth_date': employee.get('birth_date'),
-                    'photo': employee.get('photo'),
-                    'certificates': employee.get('all_certificates')
-                }
-                return filtered_employee
-        
-       
+            return []
         
+        results = []
+        for employee, score in index.search(query, limit=limit, min_score=min_score):
+            filtered_employee = _filter_employee(employee)
+            filtered_employee['score'] = score
+            results.append(filtered_employee)
+        return results
     except Exception as e:
         print(f"❌ Ошибка при поиске сотрудников: {e}")
+        return []
+
+async def search_employees(query):
+    """
+    Поиск сотрудника по ФИО: лучшее совпадение из индекса
+    
+    Args:
+        query: Поисковый запрос (ФИО, часть имени и т.д.)
+    
+    Returns:
+        dict: Найденный сотрудник или None
+    """
+    print(f"🔍 search_employees вызвана с запросом: {query}")
+    if not query or not query.strip():
+        print("❌ Пустой запрос")
         return None
+    
+    # Как и раньше, считаем совпадением только вхождение запроса в ФИО (без опечаток),
+    # т.к. результат используется для обновления существующего сотрудника
+    results = await search_employees_ranked(query, limit=1, min_score=SCORE_SUBSTRING)
+    if not results:
+        return None
+    
+    employee = results[0]
+    employee.pop('score', None)
+    print(f"✅ Найден сотрудник: {employee.get('full_name')}")
+    return employee
 
 
 async def main():
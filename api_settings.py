@@ -1,42 +1,10 @@
 import os
-from openai import AsyncOpenAI
 
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
-# Инициализация клиентов
-print(f"🔍 POLZA_AI_TOKEN: {os.getenv('POLZA_AI_TOKEN')[:10]}..." if os.getenv('POLZA_AI_TOKEN') else "❌ POLZA_AI_TOKEN не найден")
-
-try:
-    client_polza = AsyncOpenAI(
-        base_url="https://api.polza.ai/api/v1",
-        api_key=os.getenv("POLZA_AI_TOKEN")
-    )
-except Exception as e:
-    print(f"❌ Ошибка инициализации Polza клиента: {e}")
-    client_polza = None
-
-try:
-    client_vsegpt = AsyncOpenAI(
-        base_url="https://api.vsegpt.ru/v1",
-        api_key=os.getenv("VSEGPT_API_KEY")
-    )
-except Exception as e:
-    print(f"❌ Ошибка инициализации Vsegpt клиента: {e}")
-    client_vsegpt = None
-
-try:
-    client_proxyapi = AsyncOpenAI(
-        base_url="https://api.proxyapi.ru/openai/v1",
-        api_key=os.getenv("PROXYAPI_API_KEY")
-    )
-except Exception as e:
-    print(f"❌ Ошибка инициализации Proxyapi клиента: {e}")
-    client_proxyapi = None
-
-
 # Модели из переменных окружения
 OPENAI_MODEL_POLZA_4_1 = os.getenv("OPENAI_MODEL_POLZA_4_1", "openai/gpt-4.1-mini")    
 GEMINI_MODEL_POLZA_2_0 = os.getenv("GEMINI_MODEL_POLZA_2_0", "google/gemini-2.0-flash-lite-001")
@@ -45,11 +13,11 @@ GEMINI_MODEL_VSEGPT = os.getenv("GEMINI_MODEL_VSEGPT", "google/gemini-2.0-flash"
 OPENAI_MODEL_PROXYAPI = os.getenv("OPENAI_MODEL_PROXYAPI", "gpt-4o-mini")
 GEMINI_MODEL_PROXYAPI = os.getenv("GEMINI_MODEL_PROXYAPI", "gemini-2.0-flash")
 
-# Конфигурация клиентов и моделей
+# Конфигурация провайдеров и моделей (клиенты создаются при первом запросе, см. llm_clients.py).
+# <ПРОВАЙДЕР>_BASE_URL переключает провайдера на другой адрес, например на fake_llm_server.py
 API_CLIENTS = {
     "polza": {
-        "client": client_polza,
-        "base_url": "https://api.polza.ai/api/v1",
+        "base_url": os.getenv("POLZA_BASE_URL", "https://api.polza.ai/api/v1"),
         "token_env": "POLZA_AI_TOKEN",
         "models": {
             "openai": OPENAI_MODEL_POLZA_4_1,
@@ -57,8 +25,7 @@ API_CLIENTS = {
         }
     },
     "vsegpt": {
-        "client": client_vsegpt,
-        "base_url": "https://api.vsegpt.ru/v1",
+        "base_url": os.getenv("VSEGPT_BASE_URL", "https://api.vsegpt.ru/v1"),
         "token_env": "VSEGPT_API_KEY",
         "models": {
             "openai": OPENAI_MODEL_VSEGPT,
@@ -66,8 +33,7 @@ API_CLIENTS = {
         }
     },
     "proxyapi": {
-        "client": client_proxyapi,
-        "base_url": "https://api.proxyapi.ru/openai/v1",
+        "base_url": os.getenv("PROXYAPI_BASE_URL", "https://api.proxyapi.ru/openai/v1"),
         "token_env": "PROXYAPI_API_KEY",
         "models": {
             "openai": OPENAI_MODEL_PROXYAPI,
@@ -118,7 +84,7 @@ CERTIFICATE_SEARCH_PRIORITY = [
     ("vsegpt", "gemini")
 ]
 
-# Приоритеты для makeOrderformat (форматирование заказа)
+# Приоритеты для разбора заказа (extractOrder) и ответов диспетчера
 ORDER_FORMAT_PRIORITY = [
     ("polza", "openai"),      # Нужна точность
     ("proxyapi", "openai"),      # Запасной вариант
@@ -126,4 +92,74 @@ ORDER_FORMAT_PRIORITY = [
     ("polza", "gemini"),
     ("proxyapi", "gemini"),
     ("vsegpt", "gemini")
-]
\ No newline at end of file
+]
+
+# Хеджирование запросов к провайдерам (гонка провайдеров).
+# mode: "off" - строго по очереди (как раньше),
+#       "delay" - если первый провайдер не ответил за delay секунд, параллельно запускается следующий,
+#       "parallel" - сразу запускаются первые max_parallel провайдеров.
+# Побеждает первый корректный ответ, остальные запросы отменяются.
+# Включается переменной LLM_HEDGING=1, политика задается для каждой задачи отдельно (по task_name)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+
+HEDGE_OFF = {"mode": "off"}
+
+TASK_HEDGE_POLICIES = {
+    # Пользователь ждет ответа диспетчера - запасной провайдер стартует быстро
+    "CEO диспетчер": {"mode": "delay", "delay": float(os.getenv("LLM_HEDGE_DELAY_DISPATCHER", "3")), "max_parallel": 2},
+    "Разбор заказа": {"mode": "delay", "delay": float(os.getenv("LLM_HEDGE_DELAY_ORDER", "5")), "max_parallel": 2},
+    # Короткий запрос - дешевле сразу спросить двух провайдеров
+    "Конвертация даты": {"mode": "parallel", "max_parallel": 2},
+}
+
+
+# Время жизни ответов ИИ в кэше (секунды) по task_name.
+# Задачи, которых нет в словаре, не кэшируются. Ответы диспетчера и разбора заказа целиком не кэшируются:
+# их промпты и ответы содержат персональные данные сотрудников
+LLM_CACHE_TTL = {
+    # Дата не меняет своего значения
+    "Конвертация даты": int(os.getenv("LLM_CACHE_TTL_DATE", str(30 * 24 * 3600))),
+    "Конвертация дат": int(os.getenv("LLM_CACHE_TTL_DATE", str(30 * 24 * 3600))),
+}
+# Решения CEO диспетчера для сообщений без истории чата (ceo_dispatcher.py): ключ - шаблон сообщения
+# без персональных данных, в кэше - только намерение и уверенность (0 - не кэшировать)
+LLM_CACHE_TTL_DISPATCHER = int(os.getenv("LLM_CACHE_TTL_DISPATCHER", str(7 * 24 * 3600)))
+
+
+# Ограничения нагрузки на провайдеров (0 - без ограничения).
+# max_concurrency - одновременных запросов, rpm/tpm - запросов и токенов в минуту,
+# max_wait - сколько запрос ждет в очереди, прежде чем уйти к следующему провайдеру,
+# cooldown - пауза после ответа 429 без заголовка Retry-After.
+# Переопределяются переменными LLM_LIMIT_<ПРОВАЙДЕР>_CONCURRENCY / _RPM / _TPM
+LLM_LIMIT_MAX_WAIT = float(os.getenv("LLM_LIMIT_MAX_WAIT", "10"))
+LLM_LIMIT_COOLDOWN = float(os.getenv("LLM_LIMIT_COOLDOWN", "10"))
+# Резерв токенов на ответ, если max_tokens не задан (уточняется по usage ответа)
+LLM_LIMIT_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_LIMIT_DEFAULT_COMPLETION_TOKENS", "500"))
+
+
+def _provider_limits(name, max_concurrency, rpm, tpm):
+    prefix = f"LLM_LIMIT_{name.upper()}"
+    return {
+        "max_concurrency": int(os.getenv(f"{prefix}_CONCURRENCY", str(max_concurrency))),
+        "rpm": int(os.getenv(f"{prefix}_RPM", str(rpm))),
+        "tpm": int(os.getenv(f"{prefix}_TPM", str(tpm))),
+        "max_wait": LLM_LIMIT_MAX_WAIT,
+        "cooldown": LLM_LIMIT_COOLDOWN,
+    }
+
+
+PROVIDER_LIMITS = {
+    "polza": _provider_limits("polza", 10, 120, 200000),
+    "proxyapi": _provider_limits("proxyapi", 5, 60, 100000),
+    "vsegpt": _provider_limits("vsegpt", 5, 60, 100000),
+}
+
+
+# Цены моделей для журнала запросов (llm_ledger.py): ₽ за 1М входных и выходных токенов.
+# Ключ - часть имени модели (выбирается самое длинное совпадение); значения примерные, уточнять по тарифам
+LLM_PRICES = {
+    "gpt-4.1-mini": (45.0, 180.0),
+    "gpt-4o-mini": (17.0, 68.0),
+    "gemini-2.0-flash-lite": (8.0, 34.0),
+    "gemini-2.0-flash": (11.0, 45.0),
+}
@@ -0,0 +1,304 @@
+"""
+Массовый импорт сотрудников из CSV/XLSX/JSONL с ограничением параллельности
+"""
+import os
+import re
+import csv
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+
+from api import addPeople, UpdatePeople, get_name_index
+from field_extractor import format_snils, normalize_phone, validate_inn, validate_snils
+from name_index import normalize_name, SCORE_EXACT
+from validate import extractOrder, convert_dates
+
+# Сколько запросов к CRM выполнять одновременно
+BULK_IMPORT_CONCURRENCY = int(os.getenv("BULK_IMPORT_CONCURRENCY", "5"))
+
+EMPLOYEE_FIELDS = ["full_name", "position", "phone", "snils", "inn", "birth_date"]
+
+# Допустимые названия колонок для каждого поля (после normalize_name)
+FIELD_ALIASES = {
+    "full_name": ["full name", "full_name", "fio", "фио", "ф и о", "сотрудник", "name"],
+    "position": ["position", "должность", "профессия"],
+    "phone": ["phone", "телефон", "тел", "мобильный"],
+    "snils": ["snils", "снилс"],
+    "inn": ["inn", "инн"],
+    "birth_date": ["birth date", "birth_date", "дата рождения", "дата_рождения", "др"],
+}
+
+# Колонки со свободным текстом заявки - разбираются через ИИ, если полей нет
+TEXT_ALIASES = ["text", "order", "заказ", "заявка", "текст"]
+
+_space_re = re.compile(r"\s+")
+
+
+def _column_map(columns) -> Dict[str, str]:
+    """Сопоставить колонки файла полям сотрудника"""
+    mapping = {}
+    for column in columns:
+        key = normalize_name(column).replace("_", " ")
+        for field, aliases in FIELD_ALIASES.items():
+            if key in [alias.replace("_", " ") for alias in aliases] and field not in mapping.values():
+                mapping[column] = field
+                break
+        else:
+            if key in TEXT_ALIASES:
+                mapping[column] = "text"
+    return mapping
+
+
+def _read_csv(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        return list(csv.DictReader(f, dialect=dialect))
+
+
+def _read_jsonl(path: str) -> List[Dict]:
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+    return rows
+
+
+def _read_xlsx(path: str) -> List[Dict]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Для импорта XLSX установите openpyxl: pip install openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    sheet = workbook.active
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(cell or "").strip() for cell in next(rows, [])]
+    result = []
+    for values in rows:
+        if not any(values):
+            continue
+        result.append({header[i]: values[i] for i in range(min(len(header), len(values))) if header[i]})
+    workbook.close()
+    return result
+
+
+def read_employees_file(path: str) -> List[Dict]:
+    """
+    Прочитать файл сотрудников
+
+    Returns:
+        list: Строки файла (колонка -> значение)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return _read_csv(path)
+    if ext in (".jsonl", ".ndjson"):
+        return _read_jsonl(path)
+    if ext == ".xlsx":
+        return _read_xlsx(path)
+    raise ValueError(f"Неподдерживаемый формат файла: {ext} (нужен CSV, XLSX или JSONL)")
+
+
+def _format_cell(value) -> str:
+    if value is None:
+        return ""
+    if hasattr(value, "strftime"):
+        # Даты из XLSX приходят объектами datetime
+        return value.strftime("%Y-%m-%d")
+    return _space_re.sub(" ", str(value)).strip()
+
+
+async def extract_employee(row: Dict, mapping: Dict[str, str]) -> Dict:
+    """Поля сотрудника из строки файла; ИИ - только для строк со свободным текстом"""
+    employee = {field: "" for field in EMPLOYEE_FIELDS}
+    text = ""
+    for column, value in row.items():
+        field = mapping.get(column)
+        if field == "text":
+            text = _format_cell(value)
+        elif field:
+            employee[field] = _format_cell(value)
+
+    if not employee["full_name"] and text:
+        extraction = await extractOrder(text)
+        for field in EMPLOYEE_FIELDS:
+            employee[field] = extraction.get("employee", {}).get(field, "")
+    return employee
+
+
+def normalize_employee(employee: Dict) -> List[str]:
+    """
+    Привести телефон, СНИЛС и ИНН к тому же виду, что и в заявках из чата (field_extractor)
+
+    Returns:
+        list: Предупреждения о значениях, не прошедших проверку (они импортируются как есть)
+    """
+    warnings = []
+    if employee["phone"]:
+        phone = normalize_phone(employee["phone"])
+        if phone:
+            employee["phone"] = phone
+        else:
+            warnings.append(f"телефон {employee['phone']} не похож на российский номер")
+    if employee["snils"]:
+        digits = re.sub(r"\D", "", employee["snils"])
+        if len(digits) == 11:
+            employee["snils"] = format_snils(digits)
+        if not validate_snils(digits):
+            warnings.append(f"СНИЛС {employee['snils']} не прошел проверку контрольной суммы")
+    if employee["inn"]:
+        digits = re.sub(r"\D", "", employee["inn"])
+        employee["inn"] = digits or employee["inn"]
+        if not validate_inn(digits):
+            warnings.append(f"ИНН {employee['inn']} не прошел проверку контрольных цифр")
+    return warnings
+
+
+def _fill_empty(target: Dict, source: Dict):
+    """Дополнить пустые поля target значениями из source"""
+    target.update({field: value for field, value in source.items() if value and not target[field]})
+
+
+async def bulk_import(path: str, concurrency: Optional[int] = None) -> Dict:
+    """
+    Импортировать сотрудников из файла: новые добавляются, существующие обновляются
+
+    Args:
+        path: Путь к CSV/XLSX/JSONL файлу
+        concurrency: Сколько запросов к CRM выполнять одновременно
+
+    Returns:
+        dict: Отчет об импорте
+    """
+    started = time.perf_counter()
+    concurrency = concurrency or BULK_IMPORT_CONCURRENCY
+    rows = read_employees_file(path)
+    mapping = _column_map(rows[0].keys()) if rows else {}
+    print(f"📄 Прочитано строк: {len(rows)}, колонки: {mapping}")
+
+    report = {"total": len(rows), "added": 0, "updated": 0, "skipped": 0, "duplicates": 0,
+              "errors": [], "warnings": []}
+
+    # Даты рождения конвертируются заранее одним пакетом (ИИ - только для нераспознанных)
+    birth_column = next((column for column, field in mapping.items() if field == "birth_date"), None)
+    if birth_column:
+        dates = await convert_dates([_format_cell(row.get(birth_column)) for row in rows])
+        for row, birth_date in zip(rows, dates):
+            row[birth_column] = birth_date
+
+    # Сотрудники из CRM загружаются один раз на весь импорт
+    index, employees = await get_name_index()
+    if index is None:
+        raise RuntimeError(f"Не удалось получить список сотрудников: {employees}")
+    by_snils = {}
+    for existing in employees:
+        snils_digits = re.sub(r"\D", "", str(existing.get("snils") or ""))
+        if snils_digits:
+            by_snils[snils_digits] = existing
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract_row(row_number: int, row: Dict):
+        async with semaphore:
+            try:
+                employee = await extract_employee(row, mapping)
+                for warning in normalize_employee(employee):
+                    report["warnings"].append((row_number, f"{employee['full_name']}: {warning}"))
+                return row_number, employee
+            except Exception as e:
+                report["errors"].append((row_number, str(e)))
+                return row_number, None
+
+    # Номер строки как в файле (с учетом заголовка у CSV/XLSX)
+    offset = 1 if path.lower().endswith((".jsonl", ".ndjson")) else 2
+    extracted = await asyncio.gather(*(extract_row(i + offset, row) for i, row in enumerate(rows)))
+
+    # Один сотрудник в нескольких строках файла сохраняется одним запросом: параллельные добавления
+    # создали бы в CRM дубликаты. Ключ - ФИО и СНИЛС; строка без СНИЛС относится к строке с тем же ФИО
+    unique: Dict[tuple, tuple] = {}
+    for row_number, employee in extracted:
+        if employee is None:
+            continue
+        if not employee["full_name"]:
+            report["skipped"] += 1
+            report["errors"].append((row_number, "нет ФИО"))
+            continue
+        key = (normalize_name(employee["full_name"]), re.sub(r"\D", "", employee["snils"]))
+        if key in unique:
+            # Повтор только дополняет поля, не заполненные в первой строке
+            _fill_empty(unique[key][1], employee)
+            report["duplicates"] += 1
+        else:
+            unique[key] = (row_number, employee)
+
+    for name, snils in [key for key in unique if not key[1]]:
+        with_snils = [key for key in unique if key[0] == name and key[1]]
+        # Несколько СНИЛС при одном ФИО - однофамильцы, строку без СНИЛС не к кому отнести
+        if len(with_snils) == 1:
+            _fill_empty(unique[with_snils[0]][1], unique.pop((name, ""))[1])
+            report["duplicates"] += 1
+
+    async def save_row(row_number: int, employee: Dict):
+        async with semaphore:
+            try:
+                existing = by_snils.get(re.sub(r"\D", "", employee["snils"])) if employee["snils"] else None
+                if existing is None:
+                    matches = index.search(employee["full_name"], limit=1, min_score=SCORE_EXACT)
+                    existing = matches[0][0] if matches else None
+
+                if existing:
+                    # Отправляются только заполненные в файле поля: поля, которых нет в файле
+                    # (и в сокращенном списке сотрудников), в CRM не затираются
+                    result = await UpdatePeople({**employee, "id": existing.get("id")}, only_filled=True)
+                    action = "updated"
+                else:
+                    result = await addPeople(employee)
+                    action = "added"
+
+                if result and result.get("success"):
+                    report[action] += 1
+                else:
+                    message = result.get("message", "неизвестная ошибка") if result else "ошибка запроса к CRM"
+                    report["errors"].append((row_number, f"{employee['full_name']}: {message}"))
+            except Exception as e:
+                report["errors"].append((row_number, str(e)))
+
+    await asyncio.gather(*(save_row(row_number, employee) for row_number, employee in unique.values()))
+
+    elapsed = time.perf_counter() - started
+    report["elapsed"] = elapsed
+    report["throughput"] = len(rows) / elapsed if elapsed > 0 else 0
+    report["errors"].sort()
+    report["warnings"].sort()
+    return report
+
+
+def format_report(report: Dict) -> str:
+    """Текстовый отчет об импорте"""
+    lines = [
+        "📊 Итоги импорта:",
+        f"   Строк в файле: {report['total']}",
+        f"   ✅ Добавлено: {report['added']}",
+        f"   🔄 Обновлено: {report['updated']}",
+        f"   ⏭️ Пропущено: {report['skipped']}",
+        f"   👥 Повторов в файле (объединены): {report['duplicates']}",
+        f"   ❌ Ошибок: {len(report['errors']) - report['skipped']}",
+        f"   ⏱️ Время: {report['elapsed']:.1f} с ({report['throughput']:.2f} строк/с)",
+    ]
+    if report["errors"]:
+        lines.append("")
+        lines.append("Проблемные строки:")
+        for row_number, message in report["errors"]:
+            lines.append(f"   строка {row_number}: {message}")
+    if report["warnings"]:
+        lines.append("")
+        lines.append("Предупреждения (данные импортированы как есть):")
+        for row_number, message in report["warnings"]:
+            lines.append(f"   строка {row_number}: {message}")
+    return "\n".join(lines)
@@ -1,22 +1,67 @@
 import os
 import json
 import asyncio
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from ai_request import make_api_request_with_fallback
-from api_settings import ORDER_FORMAT_PRIORITY
+from ai_request import make_api_request_with_fallback, stream_api_request_with_fallback
+from api_settings import ORDER_FORMAT_PRIORITY, LLM_CACHE_TTL_DISPATCHER
+from intent_classifier import (classify_intent, intent_stats, intent_stats_snapshot, redact_pii,
+                               INTENT_RULES_THRESHOLD, NAME_PLACEHOLDER)
+from metrics_server import register_collector
+from validate import parse_json_response
+from chat_context import format_history
+from name_index import SCORE_SUBSTRING, normalize_name
+from llm_cache import llm_cache, make_cache_key, LLM_CACHE_ENABLED
+from llm_ledger import llm_ledger, CACHED
 
 load_dotenv()
 
-# Инициализация клиента OpenAI
-try:
-    client = AsyncOpenAI(
-        base_url="https://api.polza.ai/api/v1",
-        api_key=os.getenv("POLZA_AI_TOKEN")
-    )
-except Exception as e:
-    print(f"Не удалось инициализировать OpenAI клиент: {e}")
-    client = None
+register_collector("intent_rules", intent_stats_snapshot)
+
+# Подсказка, если намерение не определено и ИИ не ответил
+UNCLEAR_HELP_TEXT = """🤔 <b>Не понял ваше намерение</b>
+
+Пожалуйста, уточните, что вы хотите:
+
+📋 <b>Создать заявку на обучение:</b>
+• "Иванов Иван, монтажник, нужно обучить на высоту"
+• "Создай заявку для Петрова на ПБО"
+
+🔍 <b>Посмотреть информацию:</b>
+• "Иванов Иван"
+• "Покажи информацию о Петрове"
+• "Найди Сидорова"
+
+Или используйте команды:
+/help - помощь
+/start - начать заново"""
+
+DISPATCHER_TASK = "CEO диспетчер"
+DISPATCHER_INTENTS = ("create_order", "search_info", "unclear")
+
+
+def _dispatcher_cache_key(system_message, template):
+    """Ключ кэша решения: промпт диспетчера и шаблон сообщения без персональных данных"""
+    return make_cache_key(DISPATCHER_TASK, ORDER_FORMAT_PRIORITY,
+                          [system_message, {"role": "user", "content": template}], 0.1, None)
+
+
+async def _remember_decision(cache_key, result, name, used_client, used_model):
+    """
+    Сохранить решение диспетчера без персональных данных: ФИО из ответа ИИ хранится меткой.
+    Если ИИ привел ФИО к другой форме ("о Петрове" -> "Петров"), по шаблону его не восстановить - не кэшируем
+    """
+    employee_name = result.get("employee_name") or ""
+    if result.get("intent") not in DISPATCHER_INTENTS:
+        return
+    if employee_name and normalize_name(employee_name) != normalize_name(name):
+        return
+    decision = {
+        "intent": result["intent"],
+        "employee_name": NAME_PLACEHOLDER if employee_name else "",
+        "confidence": result.get("confidence", 0.5)
+    }
+    await llm_cache.put(cache_key, DISPATCHER_TASK, json.dumps(decision, ensure_ascii=False),
+                        used_client, used_model, LLM_CACHE_TTL_DISPATCHER)
 
 async def ceo_dispatcher(message_text, chat_history=None):
     """
@@ -29,12 +74,16 @@ async def ceo_dispatcher(message_text, chat_history=None):
     Returns:
         dict: Результат с типом действия и данными
     """
-    if not client:
-        return {
-            "type": "error",
-            "message": "❌ Ошибка: OpenAI клиент не инициализирован"
-        }
-    
+    # Сначала правила: очевидные случаи (только ФИО, ФИО + СНИЛС/телефон) не требуют запроса к ИИ
+    rules_result = classify_intent(message_text, chat_history)
+    if rules_result["confidence"] >= INTENT_RULES_THRESHOLD:
+        intent_stats["rules_hits"] += 1
+        intent_stats[f"rules_{rules_result['intent']}"] += 1
+        print(f"⚡ CEO диспетчер: намерение по правилам {rules_result['intent']} "
+              f"(уверенность {rules_result['confidence']})")
+        return rules_result
+    intent_stats["escalations"] += 1
+
     # Подготавливаем сообщения для ИИ
     messages = [
         {
@@ -75,19 +124,40 @@ async def ceo_dispatcher(message_text, chat_history=None):
         },
         {
             "role": "user", 
-            "content": f"История чата: {json.dumps(chat_history or [], ensure_ascii=False)}\n\nТекущее сообщение: {message_text}"
+            "content": f"История чата: {format_history(chat_history)}\n\nТекущее сообщение: {message_text}"
         }
     ]
     
+    # Решение по сообщению без истории чата кэшируется по шаблону без персональных данных:
+    # "Найди Сидорова" и "Найди Петрову" - один запрос к ИИ. История в ключ не входит,
+    # поэтому сообщения с историей (в ней ФИО и ответы CRM) всегда идут к ИИ
+    template = redact_pii(message_text) if not chat_history else None
+    cache_key = None
+    if template and LLM_CACHE_ENABLED and LLM_CACHE_TTL_DISPATCHER:
+        cache_key = _dispatcher_cache_key(messages[0], template["text"])
+        cached = await llm_cache.get(cache_key, DISPATCHER_TASK)
+        if cached:
+            decision = json.loads(cached.content)
+            intent_stats["cache_hits"] += 1
+            llm_ledger.record(DISPATCHER_TASK, cached.client, cached.model, 0, 0.0, CACHED)
+            print(f"💾 CEO диспетчер: решение из кэша для шаблона \"{template['text']}\"")
+            return {
+                "type": "success",
+                "intent": decision["intent"],
+                "employee_name": template["name"] if decision["employee_name"] else "",
+                "message": message_text,
+                "confidence": decision["confidence"]
+            }
+
     try:
         response, used_client, used_model = await make_api_request_with_fallback(
             priority_list=ORDER_FORMAT_PRIORITY,
             messages=messages,
             temperature=0.1,
-            task_name="CEO диспетчер"
+            task_name=DISPATCHER_TASK
         )
         
-        if not response.choices or not response.choices[0].message:
+        if not response or not response.choices or not response.choices[0].message:
             return {
                 "type": "error",
                 "message": "❌ Ошибка: получен пустой ответ от OpenAI API"
@@ -98,7 +168,9 @@ async def ceo_dispatcher(message_text, chat_history=None):
         
         try:
             # Парсим JSON ответ от ИИ
-            result = json.loads(ai_response)
+            result = parse_json_response(ai_response)
+            if not isinstance(result, dict):
+                raise json.JSONDecodeError("ответ не является JSON-объектом", ai_response or "", 0)
             
             # Проверяем обязательные поля
             if "intent" not in result:
@@ -107,6 +179,13 @@ async def ceo_dispatcher(message_text, chat_history=None):
                     "message": "❌ Ошибка: ИИ не вернул тип намерения"
                 }
             
+            # Совпадение с догадкой правил ниже порога - подсказка для настройки порога
+            agreed = result.get("intent") == rules_result["intent"]
+            intent_stats["escalations_agree" if agreed else "escalations_disagree"] += 1
+
+            if cache_key:
+                await _remember_decision(cache_key, result, template["name"], used_client, used_model)
+
             return {
                 "type": "success",
                 "intent": result.get("intent"),
@@ -127,6 +206,45 @@ async def ceo_dispatcher(message_text, chat_history=None):
             "message": f"❌ Ошибка CEO диспетчера: {e}"
         }
 
+def stream_unclear_reply(message_text, chat_history=None):
+    """
+    Свободный ответ ИИ на сообщение с неясным намерением (потоком фрагментов)
+
+    Args:
+        message_text: Текст сообщения пользователя
+        chat_history: История чата (опционально)
+
+    Returns:
+        AsyncIterator[str]: Фрагменты ответа
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": """Ты — помощник Telegram бота по работе с сотрудниками и их обучением.
+
+Бот умеет:
+1. Создавать заявку на обучение: пользователь присылает ФИО, должность, телефон, СНИЛС, дату рождения
+   и вид обучения. Пример: "Иванов Иван Иванович, монтажник, +7 999 123-45-67, СНИЛС 123-456-789 01, 01.01.1990, обучить на высоту"
+2. Показывать информацию о сотруднике и его удостоверениях по ФИО. Пример: "Покажи информацию о Петрове"
+3. Команды: /help - помощь, /start - начать заново, /clear - очистить историю
+
+Намерение пользователя не удалось определить. Кратко (2-4 предложения) ответь на его сообщение
+и подскажи, как сформулировать запрос. Можно использовать только теги <b> и <i>."""
+        },
+        {
+            "role": "user",
+            "content": f"История чата: {format_history(chat_history)}\n\nТекущее сообщение: {message_text}"
+        }
+    ]
+    return stream_api_request_with_fallback(
+        priority_list=ORDER_FORMAT_PRIORITY,
+        messages=messages,
+        max_tokens=300,
+        temperature=0.3,
+        task_name="Ответ на неясный запрос"
+    )
+
+
 async def handle_search_request(employee_name):
     """
     Обрабатывает запрос на поиск информации о сотруднике
@@ -141,14 +259,25 @@ async def handle_search_request(employee_name):
     try:
         print(f"🔍 ===== НАЧАЛО handle_search_request =====")
         print(f"🔍 Начинаем поиск сотрудника: {employee_name}")
-        from api import search_employees
+        from api import search_employees_ranked
         
-        # Ищем сотрудника
-        employee = await search_employees(employee_name)
+        # Ищем сотрудника (лучшее совпадение + однофамильцы с той же оценкой).
+        # Карточка показывается только для совпадения не ниже вхождения запроса в ФИО (как в search_employees),
+        # похожие по триграммам ФИО - лишь подсказки
+        results = await search_employees_ranked(employee_name, limit=5)
+        suggestions = [r for r in results if r.get('score', 0) < SCORE_SUBSTRING]
+        results = [r for r in results if r.get('score', 0) >= SCORE_SUBSTRING]
+        employee = results[0] if results else None
         print(f"🔍 Результат поиска: {employee}")
         
         if not employee:
-            return f"❌ <b>Сотрудник не найден</b>\n\nПо запросу '{employee_name}' ничего не найдено.\n\nПопробуйте:\n• Проверить правильность написания ФИО\n• Использовать частичное совпадение имени"
+            response = f"❌ <b>Сотрудник не найден</b>\n\nПо запросу '{employee_name}' ничего не найдено."
+            if suggestions:
+                response += "\n\n🤔 <b>Возможно, вы имели в виду:</b>\n"
+                response += "".join(f"• {other.get('full_name')} ({other.get('position') or 'должность не указана'})\n"
+                                    for other in suggestions)
+                return response
+            return response + "\n\nПопробуйте:\n• Проверить правильность написания ФИО\n• Использовать частичное совпадение имени"
         
         # Форматируем информацию о сотруднике
         full_name = employee.get('full_name', 'Не указано')
@@ -195,6 +324,13 @@ async def handle_search_request(employee_name):
 {certificates_info}
 """
         
+        # Если есть другие сотрудники с такой же оценкой совпадения - показываем их
+        namesakes = [r for r in results[1:] if r.get('score') == employee.get('score')]
+        if namesakes:
+            response += "\n👥 <b>Также найдены:</b>\n"
+            for other in namesakes:
+                response += f"• {other.get('full_name')} ({other.get('position') or 'должность не указана'})\n"
+        
         print(f"🔍 ===== КОНЕЦ handle_search_request =====")
         return response
         
@@ -1,19 +1,23 @@
 import os
 import json
 import asyncio
+import argparse
 import requests
 
 from ai_request import make_api_request_with_fallback
 from api_settings import DATE_CONVERSION_PRIORITY, CERTIFICATE_SEARCH_PRIORITY
 
-from validate import makeOrderformat, validateOrder
+from validate import extractOrder
 from dotenv import load_dotenv
 from api import search_employees, addPeople, UpdatePeople
+from crm_client import close_crm_client
+from llm_clients import llm_clients
+from chat_context import ChatContext
 
 
 load_dotenv()
 
-chat_history = []
+chat_history = ChatContext()
 
 
 async def main():
@@ -23,56 +27,23 @@ async def main():
             break
         
         # Передаем текущее сообщение + всю историю чата
-        validation_result = await validateOrder(order, chat_history)
+        extraction = await extractOrder(order, chat_history)
         
-        # Пытаемся распарсить JSON ответ
-        try:
-            if isinstance(validation_result, str):
-                # Убираем markdown блоки если есть
-                json_str = validation_result.strip()
-                if json_str.startswith('```json'):
-                    json_str = json_str[7:]  # Убираем ```json
-                if json_str.endswith('```'):
-                    json_str = json_str[:-3]  # Убираем ```
-                json_str = json_str.strip()
-                
-                order_data = json.loads(json_str)
-            else:
-                order_data = validation_result
-        except json.JSONDecodeError as e:
-            print(f"❌ Ошибка парсинга JSON: {e}")
-            print(f"📋 Исходный ответ: {validation_result}")
+        if extraction.get("error") == "extraction_failed":
+            print(f"❌ Не удалось разобрать заказ: {extraction.get('message')}")
             continue
             
-        if order_data.get("error") == "missing_data":
-            print(f"❌ Нет данных в заказе: {order_data.get('message')}")
+        if extraction.get("error") == "missing_data":
+            print(f"❌ Нет данных в заказе: {extraction.get('message')}")
             # Добавляем сообщение пользователя в историю для следующей итерации
+            chat_history.update_fields(extraction["employee"])
             chat_history.append({"role": "user", "content": order})
             continue
-        print(f"✅ Данные в заказе проверены: {order_data}")
         # Добавляем сообщение пользователя в историю
         chat_history.append({"role": "user", "content": order})
-        chat_history.append({"role": "assistant", "content": str(order_data)})
-        order_json = await makeOrderformat(order, chat_history)
-        
-        # Парсим JSON ответ от makeOrderformat
-        try:
-            if isinstance(order_json, str):
-                # Убираем markdown блоки если есть
-                json_str = order_json.strip()
-                if json_str.startswith('```json'):
-                    json_str = json_str[7:]  # Убираем ```json
-                if json_str.endswith('```'):
-                    json_str = json_str[:-3]  # Убираем ```
-                json_str = json_str.strip()
-                
-                order_data = json.loads(json_str)
-            else:
-                order_data = order_json
-        except json.JSONDecodeError as e:
-            print(f"❌ Ошибка парсинга JSON заказа: {e}")
-            print(f"📋 Исходный ответ: {order_json}")
-            continue
+        chat_history.update_fields(extraction["employee"])
+        chat_history.append({"role": "assistant", "content": extraction.get("message")})
+        order_data = dict(extraction["employee"])
             
         print(f"✅ Формат заказа сформирован: {order_data}")
         
@@ -89,10 +60,33 @@ async def main():
             result = await addPeople(order_data)
             print(f"✅ Сотрудник добавлен: {result}")
         
-        chat_history.append({"role": "assistant", "content": str(result)})
+        chat_history.append({"role": "assistant", "content": result})
         print(f"✅ История чата: {chat_history}")
         print(f"🧹 Очищаем историю чата")
         chat_history.clear()
+
+    await close_crm_client()
+    await llm_clients.close()
+
+
+async def bulk_main(path, concurrency):
+    """Массовый импорт сотрудников из файла"""
+    from bulk_import import bulk_import, format_report
+
+    try:
+        report = await bulk_import(path, concurrency)
+        print(format_report(report))
+    finally:
+        await close_crm_client()
+        await llm_clients.close()
     
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Обработка заказов на обучение")
+    parser.add_argument("--bulk", metavar="FILE", help="Импорт сотрудников из CSV/XLSX/JSONL файла")
+    parser.add_argument("--concurrency", type=int, default=None, help="Сколько запросов к CRM выполнять одновременно")
+    args = parser.parse_args()
+
+    if args.bulk:
+        asyncio.run(bulk_main(args.bulk, args.concurrency))
+    else:
+        asyncio.run(main())
\ No newline at end of file
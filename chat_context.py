@@ -0,0 +1,140 @@
+"""
+Контекст диалога для промптов ИИ: извлеченные поля + последние сообщения в пределах бюджета токенов
+"""
+import os
+import ast
+import json
+import math
+from typing import Any, Dict, Iterable, Optional
+
+# Бюджет токенов на историю в одном промпте
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "600"))
+# Сколько последних сообщений хранить
+CHAT_CONTEXT_MAX_TURNS = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "6"))
+# Ограничение на одно сообщение (длинные обрезаются)
+CHAT_CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGE_TOKENS", "200"))
+
+FIELD_TITLES = {
+    "full_name": "ФИО",
+    "position": "Должность",
+    "phone": "Телефон",
+    "snils": "СНИЛС",
+    "inn": "ИНН",
+    "birth_date": "Дата рождения",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора: для русского текста в моделях семейства GPT-4o
+    в среднем ~3 символа на токен (для латиницы ~4, оценка с запасом)
+    """
+    return math.ceil(len(text) / 3) if text else 0
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 3
+    return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+
+def summarize_crm_payload(payload: Dict[str, Any]) -> str:
+    """Краткое описание ответа CRM вместо полного дампа"""
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else {}
+    status = "успешно" if payload.get("success") else "ошибка"
+    details = ", ".join(str(value) for value in (data.get("full_name"), data.get("id") and f"id {data['id']}") if value)
+    message = payload.get("message") or ""
+    return f"[CRM: {status}{': ' + message if message else ''}{' (' + details + ')' if details else ''}]"
+
+
+def _as_payload(content: Any) -> Optional[Dict]:
+    """Ответ CRM (dict или его строковый дамп) или None"""
+    if isinstance(content, dict):
+        payload = content
+    elif isinstance(content, str) and content.lstrip().startswith("{"):
+        try:
+            payload = ast.literal_eval(content)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            try:
+                payload = json.loads(content)
+            except json.JSONDecodeError:
+                return None
+    else:
+        return None
+    if isinstance(payload, dict) and ("success" in payload or "data" in payload or "error" in payload):
+        return payload
+    return None
+
+
+def compact_content(content: Any) -> str:
+    """Сообщение для истории: дампы ответов CRM сворачиваются, длинный текст обрезается"""
+    payload = _as_payload(content)
+    if payload is not None:
+        return summarize_crm_payload(payload)
+    return _truncate(str(content), CHAT_CONTEXT_MAX_MESSAGE_TOKENS)
+
+
+class ChatContext(list):
+    """
+    История чата пользователя, совместимая со списком сообщений ({"role", "content"}).
+    Хранит извлеченные поля заказа отдельно, поэтому старые сообщения можно отбрасывать
+    без потери данных: размер промпта не растет с длиной диалога
+    """
+
+    def __init__(self, messages: Iterable[Dict] = (), token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+                 max_turns: int = CHAT_CONTEXT_MAX_TURNS):
+        super().__init__()
+        self.fields: Dict[str, str] = {}
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Dict):
+        message = {"role": message.get("role", "user"), "content": compact_content(message.get("content", ""))}
+        super().append(message)
+        self._enforce_budget()
+
+    def extend(self, messages: Iterable[Dict]):
+        for message in messages:
+            self.append(message)
+
+    def clear(self):
+        super().clear()
+        self.fields.clear()
+
+    def update_fields(self, fields: Dict[str, Any]):
+        """Запомнить найденные поля заказа (пустые значения не затирают известные)"""
+        self.fields.update({key: str(value) for key, value in fields.items() if value})
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+    def _enforce_budget(self):
+        # Самые старые сообщения отбрасываются первыми; последнее сообщение остается всегда
+        while len(self) > 1 and (len(self) > self.max_turns or self.tokens > self.token_budget):
+            del self[0]
+
+    def user_messages(self):
+        """Тексты сообщений пользователя"""
+        return [message["content"] for message in self if message["role"] == "user"]
+
+    def render(self) -> str:
+        """История для промпта: известные данные + последние сообщения"""
+        lines = []
+        if self.fields:
+            known = "; ".join(f"{FIELD_TITLES.get(key, key)}: {value}" for key, value in self.fields.items())
+            lines.append(f"Уже известно: {known}")
+        for message in self:
+            role = "Пользователь" if message["role"] == "user" else "Бот"
+            lines.append(f"{role}: {message['content']}")
+        return "\n".join(lines)
+
+
+def format_history(chat_history) -> str:
+    """История чата (ChatContext или обычный список сообщений) в компактном виде для промпта"""
+    if not chat_history:
+        return "[]"
+    if not isinstance(chat_history, ChatContext):
+        chat_history = ChatContext(chat_history)
+    return chat_history.render()
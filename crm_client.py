@@ -0,0 +1,324 @@
+"""
+Асинхронный клиент CRM с общим пулом соединений
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from crm_metrics import crm_metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Таймауты по эндпоинтам (секунды), переопределяются через CRM_TIMEOUT_<ENDPOINT>
+DEFAULT_TIMEOUTS = {
+    "people_create": 30,
+    "people_update": 30,
+    "people_get": 30,
+    "people_compact": 60,
+}
+
+# Общий срок на вызов с учетом всех повторов (секунды), переопределяются через CRM_DEADLINE_<ENDPOINT>
+DEFAULT_DEADLINES = {
+    "people_create": 45,
+    "people_update": 45,
+    "people_get": 45,
+    "people_compact": 90,
+}
+
+DEFAULT_TIMEOUT = float(os.getenv("CRM_TIMEOUT_DEFAULT", "30"))
+POOL_SIZE = int(os.getenv("CRM_POOL_SIZE", "20"))
+KEEPALIVE_TIMEOUT = float(os.getenv("CRM_KEEPALIVE_TIMEOUT", "30"))
+
+# Повторы: экспоненциальная задержка со случайным разбросом (full jitter)
+RETRY_ATTEMPTS = int(os.getenv("CRM_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("CRM_RETRY_BASE_DELAY", "0.3"))
+RETRY_MAX_DELAY = float(os.getenv("CRM_RETRY_MAX_DELAY", "5"))
+# Через сколько секунд без ответа на GET отправлять второй (хеджирующий) запрос; 0 - отключено
+HEDGE_DELAY = float(os.getenv("CRM_HEDGE_DELAY", "0"))
+# Передавать Idempotency-Key в POST (тогда POST тоже повторяется при сбоях)
+IDEMPOTENCY_KEYS_ENABLED = os.getenv("CRM_IDEMPOTENCY_KEYS", "0") == "1"
+
+# Повторять безопасно только идемпотентные методы; POST - только с ключом идемпотентности
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def get_endpoint_timeout(endpoint: str) -> float:
+    """Таймаут для эндпоинта с учетом переменных окружения"""
+    env_value = os.getenv(f"CRM_TIMEOUT_{endpoint.upper()}")
+    if env_value:
+        return float(env_value)
+    return float(DEFAULT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+
+
+def get_endpoint_deadline(endpoint: str) -> float:
+    """Общий срок вызова (с повторами) для эндпоинта"""
+    env_value = os.getenv(f"CRM_DEADLINE_{endpoint.upper()}")
+    if env_value:
+        return float(env_value)
+    return float(DEFAULT_DEADLINES.get(endpoint, get_endpoint_timeout(endpoint) * 1.5))
+
+
+def make_idempotency_key(payload: Dict[str, Any]) -> str:
+    """Ключ идемпотентности: одинаковое тело запроса - одинаковый ключ"""
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый повтор/хедж тратит токен, каждый успешный ответ
+    возвращает долю токена. Во время аварии CRM токены кончаются, и клиент
+    перестает умножать нагрузку повторами.
+    """
+
+    def __init__(self, max_tokens: float = 10, token_ratio: float = 0.2):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+
+    def on_success(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.token_ratio)
+
+    def try_acquire(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CRMError(Exception):
+    """Ошибка ответа CRM (неожиданный статус или формат данных)"""
+
+    def __init__(self, message: str, url: str = "", response_text: str = ""):
+        super().__init__(message)
+        self.url = url
+        self.response_text = response_text
+
+
+class CRMResponse:
+    """Полностью прочитанный ответ CRM (аналог requests.Response)"""
+
+    def __init__(self, status_code: int, body: bytes, url: str, retry_after: Optional[str] = None):
+        self.status_code = status_code
+        self.content = body
+        self.url = url
+        self.retry_after = retry_after
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class CRMClient:
+    """Клиент CRM: одна aiohttp-сессия с keep-alive пулом на весь процесс"""
+
+    def __init__(self, base_url: Optional[str] = None, api_token: Optional[str] = None,
+                 pool_size: int = POOL_SIZE):
+        self.base_url = (base_url or os.getenv("BASE_URL") or "").strip().rstrip("/")
+        self.api_token = api_token if api_token is not None else os.getenv("API_TOKEN")
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.retry_budget = RetryBudget()
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "budget_exhausted": 0}
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "User-Agent": "PolzaAI-Bot/1.0",
+            "Authorization": f"Bearer {self.api_token}"
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Создать сессию при первом обращении (нужен запущенный event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=KEEPALIVE_TIMEOUT
+            )
+            # trust_env=False - как proxies=None в requests: прокси из окружения не используем
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self._headers(),
+                trust_env=False
+            )
+            logger.info(f"CRM сессия создана (пул: {self.pool_size} соединений)")
+        return self._session
+
+    async def _send(self, method: str, path: str, timeout: float, **kwargs) -> CRMResponse:
+        """Одна попытка запроса (с записью задержки, статуса и размера ответа в метрики)"""
+        session = self._get_session()
+        started = time.perf_counter()
+        try:
+            async with session.request(method, self.base_url + path,
+                                       timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as resp:
+                body = await resp.read()
+        except asyncio.CancelledError:
+            # Отмененный хеджирующий запрос - не ошибка CRM
+            raise
+        except Exception:
+            crm_metrics.observe(method, path, time.perf_counter() - started)
+            raise
+        crm_metrics.observe(method, path, time.perf_counter() - started, resp.status, len(body))
+        return CRMResponse(resp.status, body, str(resp.url), resp.headers.get("Retry-After"))
+
+    async def _send_hedged(self, method: str, path: str, timeout: float, **kwargs) -> CRMResponse:
+        """
+        Попытка с хеджированием: если ответа нет за HEDGE_DELAY, параллельно
+        отправляется второй запрос, берется первый успешный ответ
+        """
+        first = asyncio.create_task(self._send(method, path, timeout, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=HEDGE_DELAY)
+        if done or not self.retry_budget.try_acquire():
+            return await first
+
+        self.stats["hedges"] += 1
+        second = asyncio.create_task(self._send(method, path, max(timeout - HEDGE_DELAY, 0.1), **kwargs))
+        pending = {first, second}
+        last_task = first
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last_task = task
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUSES:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+            # Оба запроса неудачны - возвращаем (или выбрасываем) результат последнего
+            return last_task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Задержка перед повтором: Retry-After сервера или экспонента со случайным разбросом"""
+        if retry_after:
+            try:
+                return min(float(retry_after), RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+    async def request(self, method: str, path: str, endpoint: str,
+                      params: Optional[Dict[str, Any]] = None,
+                      json_data: Optional[Dict[str, Any]] = None,
+                      headers: Optional[Dict[str, str]] = None,
+                      idempotency_key: Optional[str] = None) -> CRMResponse:
+        """
+        Выполняет запрос к CRM с повторами при временных сбоях
+
+        Args:
+            method: HTTP метод
+            path: Путь относительно BASE_URL (например, /api/people)
+            endpoint: Имя эндпоинта для выбора таймаута и срока вызова
+            params: Query-параметры
+            json_data: Тело запроса
+            headers: Дополнительные заголовки
+            idempotency_key: Ключ идемпотентности; без него POST не повторяется
+
+        Returns:
+            CRMResponse: Прочитанный ответ сервера (последний, если все попытки неудачны)
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: Если ответа так и не получено
+        """
+        method = method.upper()
+        headers = dict(headers or {})
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        retryable = method in IDEMPOTENT_METHODS or idempotency_key is not None
+        hedged = method == "GET" and HEDGE_DELAY > 0
+        timeout = get_endpoint_timeout(endpoint)
+        deadline = time.monotonic() + get_endpoint_deadline(endpoint)
+        kwargs = {"params": params, "json": json_data, "headers": headers}
+
+        self.stats["requests"] += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            attempt_timeout = max(min(timeout, deadline - time.monotonic()), 0.1)
+            error = None
+            response = None
+            try:
+                if hedged:
+                    response = await self._send_hedged(method, path, attempt_timeout, **kwargs)
+                else:
+                    response = await self._send(method, path, attempt_timeout, **kwargs)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.retry_budget.on_success()
+                    return response
+            except RETRYABLE_ERRORS as e:
+                error = e
+
+            if not retryable:
+                if error:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt, response.retry_after if response else None)
+            reason = f"{type(error).__name__}: {error}" if error else f"статус {response.status_code}"
+            if attempt >= RETRY_ATTEMPTS or time.monotonic() + delay >= deadline:
+                logger.warning(f"CRM {method} {path}: попытки исчерпаны ({reason})")
+            elif not self.retry_budget.try_acquire():
+                self.stats["budget_exhausted"] += 1
+                logger.warning(f"CRM {method} {path}: бюджет повторов исчерпан ({reason})")
+            else:
+                self.stats["retries"] += 1
+                logger.info(f"CRM {method} {path}: {reason}, повтор {attempt + 1} через {delay:.2f} с")
+                await asyncio.sleep(delay)
+                continue
+
+            if error:
+                raise error
+            return response
+
+    async def get(self, path: str, endpoint: str, **kwargs) -> CRMResponse:
+        return await self.request("GET", path, endpoint, **kwargs)
+
+    async def post(self, path: str, endpoint: str, **kwargs) -> CRMResponse:
+        return await self.request("POST", path, endpoint, **kwargs)
+
+    async def put(self, path: str, endpoint: str, **kwargs) -> CRMResponse:
+        return await self.request("PUT", path, endpoint, **kwargs)
+
+    async def close(self):
+        """Закрыть сессию и пул соединений"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("CRM сессия закрыта")
+        self._session = None
+
+
+_crm_client: Optional[CRMClient] = None
+
+
+def get_crm_client() -> CRMClient:
+    """Общий на процесс клиент CRM"""
+    global _crm_client
+    if _crm_client is None:
+        _crm_client = CRMClient()
+    return _crm_client
+
+
+async def close_crm_client():
+    """Закрыть общий клиент CRM (при остановке бота)"""
+    global _crm_client
+    if _crm_client is not None:
+        await _crm_client.close()
+        _crm_client = None
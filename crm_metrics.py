@@ -0,0 +1,161 @@
+"""
+Метрики запросов к CRM: задержки, статусы и объем ответов по эндпоинтам
+"""
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Границы корзин гистограммы задержек (секунды)
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_id_segment_re = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_label(path: str) -> str:
+    """Путь без query и с {id} вместо числовых сегментов: /api/people/42 -> /api/people/{id}"""
+    path = path.split("?", 1)[0]
+    return _id_segment_re.sub("/{id}", path)
+
+
+class LatencyHistogram:
+    """Гистограмма с фиксированными корзинами (совместима с форматом Prometheus)"""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class EndpointStats:
+    """Статистика одного эндпоинта"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses: Counter = Counter()
+        self.errors = 0
+        self.bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        count = self.latency.count
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count * 100 if count else 0,
+            "p50": self.latency.quantile(0.5),
+            "p95": self.latency.quantile(0.95),
+            "p99": self.latency.quantile(0.99),
+            "avg": self.latency.sum / count if count else None,
+            "bytes": self.bytes,
+            "avg_bytes": self.bytes / count if count else 0,
+            "statuses": dict(self.statuses)
+        }
+
+
+class CRMMetrics:
+    """Метрики всех HTTP-запросов к CRM, сгруппированные по (метод, эндпоинт)"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.endpoints: Dict[tuple, EndpointStats] = {}
+
+    def observe(self, method: str, path: str, seconds: float,
+                status: Optional[int] = None, size: int = 0):
+        """
+        Записать один запрос
+
+        Args:
+            method: HTTP метод
+            path: Путь запроса
+            seconds: Длительность запроса
+            status: HTTP статус (None - ответа нет: таймаут или ошибка соединения)
+            size: Размер тела ответа в байтах
+        """
+        key = (method.upper(), endpoint_label(path))
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats()
+        stats.latency.observe(seconds)
+        stats.statuses[str(status) if status is not None else "error"] += 1
+        if status is None or status >= 500 or status == 429:
+            stats.errors += 1
+        stats.bytes += size
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Снимок метрик по эндпоинтам"""
+        return {
+            "uptime": time.time() - self.started_at,
+            "endpoints": {f"{method} {path}": stats.snapshot()
+                          for (method, path), stats in sorted(self.endpoints.items())}
+        }
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP crm_request_duration_seconds CRM request latency",
+            "# TYPE crm_request_duration_seconds histogram",
+        ]
+        for (method, path), stats in sorted(self.endpoints.items()):
+            labels = f'method="{method}",endpoint="{path}"'
+            cumulative = 0
+            for bound, bucket_count in zip(stats.latency.buckets, stats.latency.counts):
+                cumulative += bucket_count
+                lines.append(f'crm_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'crm_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+            lines.append(f"crm_request_duration_seconds_sum{{{labels}}} {stats.latency.sum:.6f}")
+            lines.append(f"crm_request_duration_seconds_count{{{labels}}} {stats.latency.count}")
+
+        lines.append("# HELP crm_requests_total CRM requests by status")
+        lines.append("# TYPE crm_requests_total counter")
+        for (method, path), stats in sorted(self.endpoints.items()):
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'crm_requests_total{{method="{method}",endpoint="{path}",status="{status}"}} {count}')
+
+        lines.append("# HELP crm_response_bytes_total CRM response body size")
+        lines.append("# TYPE crm_response_bytes_total counter")
+        for (method, path), stats in sorted(self.endpoints.items()):
+            lines.append(f'crm_response_bytes_total{{method="{method}",endpoint="{path}"}} {stats.bytes}')
+        return "\n".join(lines) + "\n"
+
+
+def format_snapshot(snapshot: Dict[str, Any]) -> str:
+    """Снимок метрик для сообщения в Telegram (HTML)"""
+    if not snapshot["endpoints"]:
+        return "📡 <b>CRM:</b> запросов еще не было"
+
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "-"
+
+    lines = [f"📡 <b>Запросы к CRM</b> (за {snapshot['uptime'] / 3600:.1f} ч)", ""]
+    for name, stats in snapshot["endpoints"].items():
+        lines.append(f"<b>{name}</b>")
+        lines.append(
+            f"  {stats['count']} запр., ошибок {stats['error_rate']:.1f}%, "
+            f"p50/p95/p99: {ms(stats['p50'])}/{ms(stats['p95'])}/{ms(stats['p99'])} мс, "
+            f"в среднем {stats['avg_bytes'] / 1024:.1f} КБ"
+        )
+    return "\n".join(lines)
+
+
+crm_metrics = CRMMetrics()
@@ -0,0 +1,101 @@
+"""
+Разбор дат без ИИ: дд.мм.гггг, д/м/гг, ISO и русские названия месяцев ("5 мая 1985")
+"""
+import re
+from datetime import date, datetime
+from typing import Optional
+
+# Основы названий месяцев: "январь", "января", "янв." и т.д.
+MONTH_STEMS = [
+    ("янв", 1), ("фев", 2), ("мар", 3), ("апр", 4), ("мая", 5), ("май", 5), ("мае", 5),
+    ("июн", 6), ("июл", 7), ("авг", 8), ("сен", 9), ("окт", 10), ("ноя", 11), ("дек", 12),
+]
+
+# Самая ранняя допустимая дата рождения
+MIN_YEAR = 1900
+
+_iso_re = re.compile(r"^(\d{4})[-./](\d{1,2})[-./](\d{1,2})(?:[t ][\d:.]+(?:z|[+-]\d{2}:?\d{2})?)?$")
+_numeric_re = re.compile(r"^(\d{1,2})\s*[-./\\ ]\s*(\d{1,2})\s*[-./\\ ]\s*(\d{2}|\d{4})$")
+_compact_re = re.compile(r"^\d{8}$")
+_month_name_re = re.compile(r"^(\d{1,2})\s*[-. ]?\s*([а-я]+)\.?\s*[-. ,]?\s*(\d{2}|\d{4})$")
+_year_suffix_re = re.compile(r"\s*(?:г\.?|гг\.?|год[а]?)\s*\.?$")
+
+
+def month_from_name(word: str) -> Optional[int]:
+    """Номер месяца по русскому названию в любом падеже или сокращению"""
+    word = word.lower().replace("ё", "е")
+    if len(word) < 3:
+        return None
+    for stem, month in MONTH_STEMS:
+        if word.startswith(stem):
+            return month
+    return None
+
+
+def expand_year(year: int, today: Optional[date] = None) -> int:
+    """Двузначный год: 85 -> 1985, 05 -> 2005 (будущие годы считаются прошлым веком)"""
+    if year >= 100:
+        return year
+    today = today or date.today()
+    candidate = 2000 + year
+    return candidate if candidate <= today.year else 1900 + year
+
+
+def parse_date(text: str, min_year: int = MIN_YEAR, max_year: Optional[int] = None,
+               today: Optional[date] = None) -> Optional[str]:
+    """
+    Разобрать дату (день всегда перед месяцем, как принято в России)
+
+    Args:
+        text: Дата в свободном формате
+        min_year: Минимальный допустимый год
+        max_year: Максимальный допустимый год (по умолчанию - текущий)
+        today: Текущая дата (для двузначных годов и проверки диапазона)
+
+    Returns:
+        str: Дата в формате yyyy-mm-dd или None, если дату не удалось разобрать
+    """
+    if not text:
+        return None
+    today = today or date.today()
+    # Без явного max_year дата из будущего тоже считается ошибкой
+    limit_to_today = max_year is None
+    max_year = max_year or today.year
+
+    value = str(text).strip().lower().replace("ё", "е")
+    value = _year_suffix_re.sub("", value).strip()
+
+    if _compact_re.match(value):
+        # 8 цифр подряд: ддммгггг или ггггммдд
+        for candidate in (f"{value[:2]}.{value[2:4]}.{value[4:]}", f"{value[:4]}-{value[4:6]}-{value[6:]}"):
+            result = parse_date(candidate, min_year, None if limit_to_today else max_year, today)
+            if result:
+                return result
+        return None
+
+    match = _iso_re.match(value)
+    if match:
+        year, month, day = (int(part) for part in match.groups())
+    else:
+        match = _numeric_re.match(value)
+        if match:
+            day, month, year = (int(part) for part in match.groups())
+        else:
+            match = _month_name_re.match(value)
+            if not match:
+                return None
+            month = month_from_name(match.group(2))
+            if month is None:
+                return None
+            day, year = int(match.group(1)), int(match.group(3))
+        year = expand_year(year, today)
+
+    if not (min_year <= year <= max_year):
+        return None
+    try:
+        parsed = datetime(year, month, day).date()
+    except ValueError:
+        return None
+    if limit_to_today and parsed > today:
+        return None
+    return parsed.isoformat()
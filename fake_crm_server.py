@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Локальная замена CRM для нагрузочного тестирования и замеров задержек api.py
+
+Запуск:
+    python fake_crm_server.py --size 100000 --latency 50 --jitter 20 --error-rate 0.01
+    BASE_URL=http://127.0.0.1:8080 API_TOKEN=test python telegram_bot.py
+"""
+import json
+import random
+import asyncio
+import argparse
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов",
+            "Михайлов", "Новиков", "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов",
+            "Егоров", "Павлов", "Козлов", "Степанов", "Николаев", "Орлов", "Андреев", "Макаров",
+            "Никитин", "Захаров", "Зайцев", "Соловьев", "Борисов", "Яковлев", "Григорьев", "Романов",
+            "Воробьев", "Сергеев", "Кузьмин", "Фролов", "Александров", "Дмитриев", "Королев", "Гусев",
+            "Мазитов", "Хасанов", "Галиев", "Сафин", "Гарипов", "Нуриев", "Ахметов", "Валиев"]
+FIRST_NAMES = ["Иван", "Петр", "Сергей", "Андрей", "Алексей", "Дмитрий", "Михаил", "Николай",
+               "Владимир", "Александр", "Евгений", "Виктор", "Олег", "Юрий", "Павел", "Роман",
+               "Ильнар", "Ринат", "Айдар", "Марат", "Руслан", "Тимур", "Артем", "Денис"]
+PATRONYMICS = ["Иванович", "Петрович", "Сергеевич", "Андреевич", "Алексеевич", "Дмитриевич",
+               "Михайлович", "Николаевич", "Владимирович", "Александрович", "Раисович", "Ринатович",
+               "Федорович", "Викторович", "Олегович", "Юрьевич"]
+POSITIONS = ["Монтажник", "Электромонтажник", "Сварщик", "Прораб", "Мастер", "Инженер", "Разнорабочий",
+             "Стропальщик", "Каменщик", "Бетонщик", "Начальник участка", "Менеджер"]
+CERTIFICATES = ["Работы на высоте", "Пожарная безопасность", "Электробезопасность", "Охрана труда",
+                "Стропальщик", "Первая помощь", "Работа в замкнутых пространствах", "Леса и подмости"]
+
+
+def snils_with_checksum(rng: random.Random) -> str:
+    """Случайный СНИЛС с правильной контрольной суммой"""
+    digits = [rng.randint(0, 9) for _ in range(9)]
+    total = sum(d * (9 - i) for i, d in enumerate(digits))
+    checksum = total % 101
+    if checksum == 100:
+        checksum = 0
+    d = "".join(map(str, digits))
+    return f"{d[0:3]}-{d[3:6]}-{d[6:9]} {checksum:02d}"
+
+
+def inn_with_checksum(rng: random.Random) -> str:
+    """Случайный ИНН физлица (12 цифр) с правильными контрольными цифрами"""
+    digits = [rng.randint(0, 9) for _ in range(10)]
+    weights_11 = [7, 2, 4, 10, 3, 5, 9, 4, 6, 8]
+    weights_12 = [3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8]
+    digits.append(sum(w * d for w, d in zip(weights_11, digits)) % 11 % 10)
+    digits.append(sum(w * d for w, d in zip(weights_12, digits)) % 11 % 10)
+    return "".join(map(str, digits))
+
+
+class FakeRoster:
+    """Синтетический список сотрудников: записи генерируются детерминированно по id"""
+
+    def __init__(self, size: int, seed: int = 42, bloat: int = 0):
+        self.size = size
+        self.seed = seed
+        self.bloat = bloat
+        self.overrides: Dict[int, Dict] = {}   # созданные и измененные через API записи
+        self.next_id = size + 1
+        self.version = 0                        # растет при каждом изменении данных
+
+    def _generate(self, employee_id: int) -> Dict[str, Any]:
+        rng = random.Random(self.seed * 1_000_003 + employee_id)
+        today = date.today()
+        certificates = []
+        for cert_id, name in enumerate(CERTIFICATES, start=1):
+            assigned = rng.random() < 0.5
+            assigned_data = None
+            if assigned:
+                assigned_date = today - timedelta(days=rng.randint(0, 3 * 365))
+                expiry_date = assigned_date + timedelta(days=3 * 365)
+                days_left = (expiry_date - today).days
+                status = 2 if days_left < 0 else 3 if days_left <= 30 else 4
+                assigned_data = {
+                    "assigned_date": assigned_date.isoformat(),
+                    "expiry_date": expiry_date.isoformat() + "T00:00:00.000000Z",
+                    "status": status
+                }
+            certificates.append({
+                "id": cert_id,
+                "name": name,
+                "is_assigned": assigned,
+                "assigned_data": assigned_data
+            })
+        birth_date = date(1960, 1, 1) + timedelta(days=rng.randint(0, 40 * 365))
+        employee = {
+            "id": employee_id,
+            "full_name": f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(PATRONYMICS)}",
+            "position": rng.choice(POSITIONS),
+            "phone": f"+79{rng.randint(0, 999999999):09d}",
+            "snils": snils_with_checksum(rng),
+            "inn": inn_with_checksum(rng),
+            "birth_date": birth_date.isoformat() + "T00:00:00.000000Z",
+            "status": rng.choice(["В ожидании", "Активен", "Активен", "Активен"]),
+            "photo": None,
+            "all_certificates": certificates
+        }
+        if self.bloat:
+            employee["_padding"] = "x" * self.bloat
+        return employee
+
+    def get(self, employee_id: int) -> Optional[Dict[str, Any]]:
+        if employee_id in self.overrides:
+            return self.overrides[employee_id]
+        if 1 <= employee_id <= self.size:
+            return self._generate(employee_id)
+        return None
+
+    def ids(self):
+        yield from range(1, self.size + 1)
+        yield from (i for i in sorted(self.overrides) if i > self.size)
+
+    def total(self) -> int:
+        return self.size + sum(1 for i in self.overrides if i > self.size)
+
+    def create(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        employee = {**data, "id": self.next_id, "all_certificates": []}
+        self.overrides[self.next_id] = employee
+        self.next_id += 1
+        self.version += 1
+        return employee
+
+    def update(self, employee_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        current = self.get(employee_id)
+        if current is None:
+            return None
+        employee = {**current, **data, "id": employee_id}
+        self.overrides[employee_id] = employee
+        self.version += 1
+        return employee
+
+
+class FakeCRM:
+    """aiohttp-приложение с эндпоинтами CRM и инъекцией задержек/ошибок"""
+
+    def __init__(self, roster: FakeRoster, latency: float = 0, jitter: float = 0,
+                 error_rate: float = 0, timeout_rate: float = 0, pagination_meta: bool = True,
+                 token: Optional[str] = None, seed: int = 42):
+        self.roster = roster
+        self.config = {
+            "latency": latency,          # средняя задержка, мс
+            "jitter": jitter,            # разброс задержки, мс
+            "error_rate": error_rate,    # доля ответов 502/503
+            "timeout_rate": timeout_rate,  # доля "зависших" запросов (60 с)
+            "pagination_meta": pagination_meta
+        }
+        self.token = token
+        self.rng = random.Random(seed)
+        self.idempotency: Dict[str, Dict] = {}
+        self.requests = 0
+        # Готовые JSON страниц: генерация 100k записей упирается в CPU сервера,
+        # а замерять нужно клиента
+        self._page_cache: Dict[tuple, str] = {}
+
+    @web.middleware
+    async def inject_faults(self, request: web.Request, handler):
+        if request.path.startswith("/_fake"):
+            return await handler(request)
+        self.requests += 1
+        if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+            return web.json_response({"success": False, "message": "Unauthenticated."}, status=401)
+
+        delay = max(0.0, self.rng.gauss(self.config["latency"], self.config["jitter"])) / 1000
+        if self.rng.random() < self.config["timeout_rate"]:
+            delay = 60
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.config["error_rate"]:
+            return web.Response(status=self.rng.choice([502, 503]), text="Bad Gateway")
+        return await handler(request)
+
+    async def compact(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get("limit", 15))
+        page = int(request.query.get("page", 1))
+        cache_key = (page, limit, self.roster.version, self.roster.bloat, self.config["pagination_meta"])
+        text = self._page_cache.get(cache_key)
+        if text is None:
+            if len(self._page_cache) > 2000:
+                self._page_cache.clear()
+            text = self._page_cache[cache_key] = self._render_page(page, limit)
+        return web.Response(text=text, content_type="application/json")
+
+    def _render_page(self, page: int, limit: int) -> str:
+        ids = list(self.roster.ids())
+        chunk = ids[(page - 1) * limit:page * limit]
+        body = {"data": [self.roster.get(i) for i in chunk]}
+        if self.config["pagination_meta"]:
+            total = len(ids)
+            body["meta"] = {
+                "current_page": page,
+                "per_page": limit,
+                "total": total,
+                "last_page": max(1, -(-total // limit))
+            }
+        return json.dumps(body, ensure_ascii=False)
+
+    async def get_person(self, request: web.Request) -> web.Response:
+        employee = self.roster.get(int(request.match_info["id"]))
+        if employee is None:
+            return web.json_response({"success": False, "message": "Человек не найден"}, status=404)
+        return web.json_response({"success": True, "data": employee})
+
+    async def create_person(self, request: web.Request) -> web.Response:
+        key = request.headers.get("Idempotency-Key")
+        if key and key in self.idempotency:
+            return web.json_response(self.idempotency[key], status=201)
+        data = await request.json()
+        body = {"success": True, "message": "Человек успешно добавлен", "data": self.roster.create(data)}
+        if key:
+            self.idempotency[key] = body
+        return web.json_response(body, status=201)
+
+    async def update_person(self, request: web.Request) -> web.Response:
+        employee = self.roster.update(int(request.match_info["id"]), await request.json())
+        if employee is None:
+            return web.json_response({"success": False, "message": "Человек не найден"}, status=404)
+        return web.json_response({"success": True, "message": "Данные успешно обновлены", "data": employee})
+
+    async def get_config(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.config, "size": self.roster.total(), "requests": self.requests})
+
+    async def set_config(self, request: web.Request) -> web.Response:
+        """Изменить параметры инъекции на лету: POST /_fake/config {"latency": 500}"""
+        updates = await request.json()
+        self.config.update({k: v for k, v in updates.items() if k in self.config})
+        if "bloat" in updates:
+            self.roster.bloat = int(updates["bloat"])
+        return await self.get_config(request)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject_faults])
+        app.router.add_get("/api/people/compact", self.compact)
+        app.router.add_get("/api/people/{id:\\d+}", self.get_person)
+        app.router.add_post("/api/people", self.create_person)
+        app.router.add_put("/api/people/{id:\\d+}", self.update_person)
+        app.router.add_get("/_fake/config", self.get_config)
+        app.router.add_post("/_fake/config", self.set_config)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена CRM для тестирования api.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--size", type=int, default=1000, help="Количество сотрудников")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0, help="Средняя задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="Разброс задержки, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="Доля ответов 502/503 (0..1)")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="Доля зависающих запросов (0..1)")
+    parser.add_argument("--bloat", type=int, default=0, help="Лишних байт в каждой записи")
+    parser.add_argument("--no-pagination-meta", action="store_true", help="Не отдавать meta.last_page/total")
+    parser.add_argument("--token", default=None, help="Требовать этот Bearer токен")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    crm = FakeCRM(
+        FakeRoster(args.size, args.seed, args.bloat),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        pagination_meta=not args.no_pagination_meta,
+        token=args.token,
+        seed=args.seed
+    )
+    print(f"🧪 Фейковая CRM: {args.size} сотрудников на http://{args.host}:{args.port}")
+    web.run_app(crm.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
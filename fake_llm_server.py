@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Локальная замена провайдеров ИИ (OpenAI-совместимый /v1/chat/completions) для тестов без сети
+
+Ответы берутся из записанных фикстур (ключ - хэш сообщений), а для новых промптов
+синтезируются правдоподобные ответы локальными разборщиками бота. Для каждого провайдера
+задаются задержка, доля ошибок, 429 и зависаний - переключение и гонку провайдеров
+можно замерять воспроизводимо.
+
+Запуск:
+    python fake_llm_server.py --port 8090 --provider polza:latency=3000 --provider proxyapi:error_rate=0.5
+    POLZA_BASE_URL=http://127.0.0.1:8090/polza/v1 PROXYAPI_BASE_URL=http://127.0.0.1:8090/proxyapi/v1 \\
+    VSEGPT_BASE_URL=http://127.0.0.1:8090/vsegpt/v1 python telegram_bot.py
+
+Запись фикстур с настоящего провайдера (ключ берется из запроса клиента):
+    python fake_llm_server.py --record polza=https://api.polza.ai/api/v1
+"""
+import os
+import re
+import json
+import time
+import zlib
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from chat_context import estimate_tokens
+from date_parser import parse_date
+from field_extractor import extract_fields
+from intent_classifier import classify_intent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_PATH = "data/llm_fixtures.jsonl"
+
+# Параметры инъекции по умолчанию (для каждого провайдера переопределяются отдельно)
+DEFAULT_FAULTS = {
+    "latency": 0.0,          # задержка до ответа (до первого фрагмента потока), мс
+    "jitter": 0.0,           # разброс задержки, мс
+    "chunk_delay": 30.0,     # пауза между фрагментами потока, мс
+    "error_rate": 0.0,       # доля ответов 500/502/503
+    "rate_limit_rate": 0.0,  # доля ответов 429
+    "timeout_rate": 0.0,     # доля зависших запросов (ответ через 120 с)
+}
+
+ORDER_FORMAT_FIELDS = ["full_name", "position", "phone", "snils", "inn", "birth_date"]
+
+
+def prompt_hash(messages: List[Dict[str, Any]]) -> str:
+    """Ключ фикстуры: хэш ролей и текстов сообщений (модель и провайдер не учитываются)"""
+    canonical = json.dumps([[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _user_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+
+
+def _current_message(text: str) -> str:
+    match = re.search(r"Текущее сообщение:\s*(.*)", text, re.DOTALL)
+    return match.group(1).strip() if match else text
+
+
+def synthesize(messages: List[Dict[str, Any]]) -> str:
+    """Правдоподобный ответ для незаписанного промпта (по промптам задач бота)"""
+    system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    user = _user_text(messages)
+
+    if '"intent"' in system:
+        # CEO диспетчер
+        result = classify_intent(_current_message(user))
+        return json.dumps({key: result[key] for key in ("intent", "employee_name", "message", "confidence")},
+                          ensure_ascii=False)
+
+    if '{"employee":' in system:
+        # Разбор заказа: только запрошенные в промпте поля
+        match = re.search(r'\{"employee": (\{.*?\})\}', system)
+        requested = list(json.loads(match.group(1))) if match else ORDER_FORMAT_FIELDS
+        fields = extract_fields(user)["fields"]
+        return json.dumps({"employee": {field: fields.get(field, "") for field in requested}}, ensure_ascii=False)
+
+    if "JSON-массив" in system and "дат" in system:
+        try:
+            dates = json.loads(user)
+        except json.JSONDecodeError:
+            dates = []
+        return json.dumps([parse_date(str(value)) or "" for value in dates], ensure_ascii=False)
+
+    if "конвертер дат" in system:
+        return parse_date(user.strip()) or ""
+
+    return ("Я помогаю с заявками на обучение сотрудников. Пришлите ФИО, должность, телефон, СНИЛС "
+            "и дату рождения, чтобы создать заявку, или только ФИО, чтобы посмотреть удостоверения.")
+
+
+class FakeLLM:
+    """aiohttp-приложение: /{provider}/v1/chat/completions с фикстурами и инъекцией ошибок"""
+
+    def __init__(self, fixtures_path: str = DEFAULT_FIXTURES_PATH, faults: Optional[Dict[str, Dict]] = None,
+                 record: Optional[Dict[str, str]] = None, seed: int = 42):
+        self.fixtures_path = fixtures_path
+        self.fixtures: Dict[str, Dict[str, Any]] = {}
+        self.faults = faults or {}
+        self.record = record or {}
+        self.seed = seed
+        self.rngs: Dict[str, random.Random] = {}
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._load_fixtures()
+
+    def _load_fixtures(self):
+        if not os.path.exists(self.fixtures_path):
+            return
+        with open(self.fixtures_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    fixture = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.fixtures[fixture["hash"]] = fixture
+        logger.info(f"Загружено фикстур: {len(self.fixtures)} из {self.fixtures_path}")
+
+    def _save_fixture(self, fixture: Dict[str, Any]):
+        self.fixtures[fixture["hash"]] = fixture
+        directory = os.path.dirname(self.fixtures_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.fixtures_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(fixture, ensure_ascii=False) + "\n")
+
+    def provider_faults(self, provider: str) -> Dict[str, float]:
+        return {**DEFAULT_FAULTS, **self.faults.get("*", {}), **self.faults.get(provider, {})}
+
+    def _rng(self, provider: str) -> random.Random:
+        # Отдельная последовательность для каждого провайдера - сбои воспроизводимы при любом порядке запросов
+        if provider not in self.rngs:
+            self.rngs[provider] = random.Random(self.seed * 1_000_003 + zlib.crc32(provider.encode()))
+        return self.rngs[provider]
+
+    @staticmethod
+    def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        error_type = "rate_limit_error" if status == 429 else "server_error"
+        return web.json_response({"error": {"message": message, "type": error_type}}, status=status, headers=headers)
+
+    async def _inject_faults(self, provider: str) -> Optional[web.Response]:
+        """Задержка и сбои перед ответом; None - отвечать нормально"""
+        faults = self.provider_faults(provider)
+        rng = self._rng(provider)
+        roll = rng.random()
+        delay = max(0.0, rng.gauss(faults["latency"], faults["jitter"])) / 1000
+        if roll < faults["timeout_rate"]:
+            self.stats[provider]["timeouts"] += 1
+            await asyncio.sleep(120)
+        await asyncio.sleep(delay)
+        roll -= faults["timeout_rate"]
+        if 0 <= roll < faults["rate_limit_rate"]:
+            self.stats[provider]["rate_limited"] += 1
+            return self._error(429, "Rate limit exceeded", {"Retry-After": "1"})
+        roll -= faults["rate_limit_rate"]
+        if 0 <= roll < faults["error_rate"]:
+            self.stats[provider]["errors"] += 1
+            return self._error(rng.choice([500, 502, 503]), "Upstream provider error")
+        return None
+
+    async def _proxy(self, provider: str, request: web.Request, body: Dict[str, Any]) -> Optional[str]:
+        """Запрос к настоящему провайдеру в режиме записи"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+        upstream = self.record[provider].rstrip("/") + "/chat/completions"
+        headers = {"Authorization": request.headers.get("Authorization", ""), "Content-Type": "application/json"}
+        async with self._session.post(upstream, json={**body, "stream": False}, headers=headers) as response:
+            if response.status != 200:
+                logger.warning(f"{provider}: запись не удалась, ответ {response.status}")
+                return None
+            data = await response.json()
+        return data["choices"][0]["message"]["content"]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        provider = request.match_info["provider"]
+        self.stats[provider]["requests"] += 1
+        body = await request.json()
+        messages = body.get("messages", [])
+        key = prompt_hash(messages)
+
+        fault = await self._inject_faults(provider)
+        if fault is not None:
+            return fault
+
+        fixture = self.fixtures.get(key)
+        if fixture is not None:
+            self.stats[provider]["replayed"] += 1
+            content = fixture["content"]
+        elif provider in self.record:
+            content = await self._proxy(provider, request, body)
+            if content is None:
+                return self._error(502, "Recording failed")
+            self.stats[provider]["recorded"] += 1
+            self._save_fixture({"hash": key, "provider": provider, "model": body.get("model"),
+                                "content": content, "recorded_at": int(time.time())})
+        else:
+            self.stats[provider]["synthesized"] += 1
+            content = synthesize(messages)
+
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        completion_id = f"chatcmpl-fake-{key[:12]}"
+        model = body.get("model", "fake")
+        if body.get("stream"):
+            return await self._stream(request, provider, completion_id, model, content)
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    async def _stream(self, request: web.Request, provider: str, completion_id: str, model: str,
+                      content: str) -> web.StreamResponse:
+        """Ответ потоком (SSE) фрагментами по несколько слов"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        chunk_delay = self.provider_faults(provider)["chunk_delay"] / 1000
+
+        async def send(delta: Dict[str, Any], finish_reason: Optional[str] = None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        await send({"role": "assistant", "content": ""})
+        for piece in re.findall(r"\S+\s*|\s+", content):
+            await send({"content": piece})
+            await asyncio.sleep(chunk_delay)
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def get_config(self, request: web.Request) -> web.Response:
+        providers = sorted((set(self.faults) | set(self.stats)) - {"*"})
+        return web.json_response({
+            "defaults": self.provider_faults("*"),
+            "providers": {name: self.provider_faults(name) for name in providers},
+            "stats": {name: dict(counter) for name, counter in self.stats.items()},
+            "fixtures": len(self.fixtures),
+            "record": self.record,
+        })
+
+    async def set_config(self, request: web.Request) -> web.Response:
+        """Изменить параметры на лету: POST /_fake/config {"provider": "polza", "latency": 5000}"""
+        updates = await request.json()
+        provider = updates.pop("provider", "*")
+        self.faults.setdefault(provider, {}).update(
+            {key: float(value) for key, value in updates.items() if key in DEFAULT_FAULTS}
+        )
+        return await self.get_config(request)
+
+    async def close(self, app: web.Application):
+        if self._session is not None:
+            await self._session.close()
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/{provider}/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/_fake/config", self.get_config)
+        app.router.add_post("/_fake/config", self.set_config)
+        app.on_cleanup.append(self.close)
+        return app
+
+
+def parse_provider_faults(values: List[str]) -> Dict[str, Dict[str, float]]:
+    """--provider polza:latency=3000,error_rate=0.2 -> {"polza": {"latency": 3000, "error_rate": 0.2}}"""
+    faults: Dict[str, Dict[str, float]] = {}
+    for value in values:
+        provider, _, settings = value.partition(":")
+        for setting in filter(None, settings.split(",")):
+            key, _, number = setting.partition("=")
+            if key not in DEFAULT_FAULTS:
+                raise argparse.ArgumentTypeError(f"Неизвестный параметр {key}, доступны: {', '.join(DEFAULT_FAULTS)}")
+            faults.setdefault(provider, {})[key] = float(number)
+    return faults
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена провайдеров ИИ (OpenAI-совместимый API)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_PATH, help="Файл фикстур (JSONL)")
+    parser.add_argument("--latency", type=float, default=0, help="Задержка ответа для всех провайдеров, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="Разброс задержки, мс")
+    parser.add_argument("--chunk-delay", type=float, default=30, help="Пауза между фрагментами потока, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="Доля ответов 5xx (0..1)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Доля ответов 429 (0..1)")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="Доля зависающих запросов (0..1)")
+    parser.add_argument("--provider", action="append", default=[],
+                        help="Параметры провайдера: polza:latency=3000,error_rate=0.2 (можно повторять)")
+    parser.add_argument("--record", action="append", default=[],
+                        help="Записывать ответы провайдера: polza=https://api.polza.ai/api/v1 (можно повторять)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    faults = parse_provider_faults(args.provider)
+    faults["*"] = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "chunk_delay": args.chunk_delay,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "timeout_rate": args.timeout_rate,
+    }
+    record = dict(value.split("=", 1) for value in args.record)
+    fake = FakeLLM(args.fixtures, faults, record, args.seed)
+    print(f"🧪 Фейковые провайдеры ИИ на http://{args.host}:{args.port}/<провайдер>/v1 "
+          f"(фикстур: {len(fake.fixtures)}{', запись: ' + ', '.join(record) if record else ''})")
+    web.run_app(fake.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Извлечение полей заказа без ИИ: СНИЛС и ИНН (с проверкой контрольных сумм), телефон (E.164),
+дата рождения, ФИО и должность
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from date_parser import parse_date
+from intent_classifier import DATE_RE, POSITION_KEYWORDS, detect_name
+
+# Минимальная похожесть на ФИО, при которой имя принимается без ИИ
+NAME_MIN_SCORE = 0.75
+
+_snils_labeled_re = re.compile(r"снилс\D{0,5}(\d{3}[- ]?\d{3}[- ]?\d{3}[- ]?\d{2})(?!\d)", re.IGNORECASE)
+_snils_formatted_re = re.compile(r"(?<![\d-])(\d{3}-\d{3}-\d{3}[- ]\d{2})(?![\d-])")
+_inn_labeled_re = re.compile(r"инн\D{0,5}(\d{10}|\d{12})(?!\d)", re.IGNORECASE)
+# С кодом страны (+7, 8, 7) или без него - тогда мобильный номер с 9 (9161234567, (916) 123-45-67)
+_phone_re = re.compile(
+    r"(?<![\d-])(?:(?:\+7|8|7)[\s\-(]*\d{3}|\(?9\d{2})[\s\-)]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?![\d-])"
+)
+_bare_number_re = re.compile(r"(?<![\d-])(\d{10,12})(?![\d-])")
+_segment_split_re = re.compile(r"[,;\n]+")
+
+
+def _digits(text: str) -> str:
+    return re.sub(r"\D", "", text)
+
+
+def validate_snils(snils: str) -> bool:
+    """Проверить контрольную сумму СНИЛС (номера до 001-001-998 не проверяются)"""
+    digits = _digits(snils)
+    if len(digits) != 11:
+        return False
+    number, checksum = digits[:9], int(digits[9:])
+    if int(number) <= 1001998:
+        return True
+    total = sum(int(d) * (9 - i) for i, d in enumerate(number))
+    if total > 101:
+        total %= 101
+    return (0 if total in (100, 101) else total) == checksum
+
+
+def format_snils(snils: str) -> str:
+    """СНИЛС в формате XXX-XXX-XXX XX"""
+    d = _digits(snils)
+    return f"{d[0:3]}-{d[3:6]}-{d[6:9]} {d[9:11]}"
+
+
+def validate_inn(inn: str) -> bool:
+    """Проверить контрольные цифры ИНН (10 цифр - организация, 12 - физлицо)"""
+    digits = [int(d) for d in _digits(inn)]
+
+    def check(weights):
+        return sum(w * d for w, d in zip(weights, digits)) % 11 % 10
+
+    if len(digits) == 10:
+        return check([2, 4, 10, 3, 5, 9, 4, 6, 8]) == digits[9]
+    if len(digits) == 12:
+        return (check([7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == digits[10]
+                and check([3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == digits[11])
+    return False
+
+
+def normalize_phone(phone: str) -> Optional[str]:
+    """Российский номер в формате E.164 (+7XXXXXXXXXX) или None"""
+    digits = _digits(phone)
+    if len(digits) == 10 and digits[0] == "9":
+        digits = "7" + digits
+    if len(digits) == 11 and digits[0] in "78":
+        return "+7" + digits[1:]
+    return None
+
+
+def _find_position(text: str, name: str) -> Optional[str]:
+    """Должность: фрагмент между запятыми со словом из словаря должностей"""
+    for segment in _segment_split_re.split(text):
+        segment = segment.strip(" .:-")
+        lower = segment.lower()
+        if not segment or any(char.isdigit() for char in segment) or len(segment.split()) > 4:
+            continue
+        if name and name.lower() in lower:
+            continue
+        if any(re.search(rf"\b{keyword}", lower) for keyword in POSITION_KEYWORDS):
+            return segment[0].upper() + segment[1:]
+    return None
+
+
+def _extract_from_text(text: str) -> Dict[str, Any]:
+    """Поля из одного сообщения"""
+    fields: Dict[str, str] = {}
+    warnings: Dict[str, str] = {}
+    rest = text
+
+    match = _snils_labeled_re.search(rest) or _snils_formatted_re.search(rest)
+    if match:
+        fields["snils"] = format_snils(match.group(1))
+        if not validate_snils(match.group(1)):
+            warnings["snils"] = f"СНИЛС {fields['snils']} не прошел проверку контрольной суммы"
+        rest = rest.replace(match.group(0), " ")
+
+    match = _inn_labeled_re.search(rest)
+    if match:
+        fields["inn"] = match.group(1)
+        if not validate_inn(match.group(1)):
+            warnings["inn"] = f"ИНН {fields['inn']} не прошел проверку контрольных цифр"
+        rest = rest.replace(match.group(0), " ")
+
+    # Даты - до телефона, чтобы "01.01.1990" не принять за часть номера
+    for match in DATE_RE.finditer(rest):
+        birth_date = parse_date(match.group(0))
+        if birth_date:
+            fields["birth_date"] = birth_date
+            rest = rest.replace(match.group(0), " ")
+            break
+
+    for match in _phone_re.finditer(rest):
+        phone = normalize_phone(match.group(0))
+        # Голые 11 цифр с верной контрольной суммой СНИЛС - это СНИЛС, а не телефон
+        if phone and not ("snils" not in fields and _bare_number_re.fullmatch(match.group(0))
+                          and validate_snils(match.group(0))):
+            fields["phone"] = phone
+            rest = rest.replace(match.group(0), " ")
+            break
+
+    # Номера без подписи принимаются только с верной контрольной суммой; ИНН - только 12 цифр
+    # (физлицо), 10 цифр - ИНН организации и без подписи "ИНН" скорее телефон или другой номер
+    for match in _bare_number_re.finditer(rest):
+        number = match.group(1)
+        if len(number) == 11 and "snils" not in fields and validate_snils(number):
+            fields["snils"] = format_snils(number)
+        elif len(number) == 12 and "inn" not in fields and validate_inn(number):
+            fields["inn"] = number
+
+    name = detect_name(rest)
+    if name["score"] >= NAME_MIN_SCORE and len(name["name"].split()) >= 2:
+        fields["full_name"] = name["name"]
+
+    position = _find_position(rest, fields.get("full_name", ""))
+    if position:
+        fields["position"] = position
+
+    return {"fields": fields, "warnings": warnings}
+
+
+def extract_fields(order: str, chat_history: Optional[List] = None) -> Dict[str, Any]:
+    """
+    Извлечь поля заказа из текущего сообщения и сообщений пользователя в истории
+
+    Returns:
+        dict: fields - найденные поля (более поздние сообщения важнее),
+              warnings - предупреждения о неверных контрольных суммах
+    """
+    texts = [entry.get("content", "") for entry in chat_history or []
+             if isinstance(entry, dict) and entry.get("role") == "user"]
+    texts.append(order or "")
+
+    fields: Dict[str, str] = {}
+    warnings: Dict[str, str] = {}
+    for text in texts:
+        result = _extract_from_text(str(text))
+        for field, value in result["fields"].items():
+            fields[field] = value
+            # Исправленное значение снимает предупреждение о предыдущем
+            warnings.pop(field, None)
+        warnings.update(result["warnings"])
+    return {"fields": fields, "warnings": list(warnings.values())}
@@ -0,0 +1,242 @@
+"""
+Быстрое определение намерения без ИИ: регулярные выражения для СНИЛС/ИНН/телефона/дат,
+словарь должностей и распознавание ФИО
+"""
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Ниже этой уверенности намерение определяет ИИ (CEO диспетчер)
+INTENT_RULES_THRESHOLD = float(os.getenv("INTENT_RULES_THRESHOLD", "0.8"))
+
+SNILS_RE = re.compile(r"(?<!\d)\d{3}[- ]?\d{3}[- ]?\d{3}[- ]?\d{2}(?!\d)")
+INN_RE = re.compile(r"(?:инн\D{0,5})(\d{10}|\d{12})(?!\d)|(?<![\d-])(\d{12})(?![\d-])", re.IGNORECASE)
+PHONE_RE = re.compile(r"(?<!\d)(?:\+7|8)[\s\-(]*\d{3}[\s\-)]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)")
+DATE_RE = re.compile(
+    r"(?<!\d)\d{1,2}[./-]\d{1,2}[./-](?:\d{4}|\d{2})(?!\d)"
+    r"|(?<!\d)\d{4}-\d{2}-\d{2}(?!\d)"
+    r"|(?<!\d)\d{1,2}\s+(?:янв|фев|мар|апр|ма[яй]|июн|июл|авг|сен|окт|ноя|дек)[а-я]*\.?\s+\d{2,4}",
+    re.IGNORECASE
+)
+
+POSITION_KEYWORDS = [
+    "монтажник", "электромонтажник", "сварщик", "электросварщик", "газосварщик", "прораб", "мастер",
+    "инженер", "рабочий", "разнорабочий", "стропальщик", "каменщик", "бетонщик", "арматурщик",
+    "начальник", "менеджер", "электрик", "слесарь", "водитель", "машинист", "крановщик", "плотник",
+    "маляр", "штукатур", "бригадир", "геодезист", "сантехник", "кладовщик", "изолировщик",
+    "монтажница", "механик", "оператор", "техник", "специалист", "директор", "руководитель",
+]
+ORDER_KEYWORDS = [
+    "обучить", "обучени", "заявк", "создай", "создать", "нужно", "требуется", "записать", "запиши",
+    "оформи", "добавь", "добавить",
+]
+SEARCH_KEYWORDS = [
+    "покажи", "показать", "найди", "найти", "информаци", "данные по", "кто такой", "кто такая",
+    "поиск", "посмотреть", "посмотри",
+]
+# Служебные слова, которые не относятся ни к ФИО, ни к данным
+FILLER_WORDS = {"о", "об", "про", "по", "на", "для", "мне", "пожалуйста", "сотрудник", "сотрудника",
+                "сотруднике", "информацию", "информация", "данные", "и", "с"}
+# Приветствия и вежливые фразы: "Добрый вечер, коллеги" и "Спасибо большое" - не ФИО
+COURTESY_WORDS = {"здравствуйте", "здравствуй", "привет", "добрый", "доброе", "доброй", "день", "утро", "вечер",
+                  "ночи", "спасибо", "благодарю", "большое", "огромное", "коллеги", "всем", "всего", "хорошего",
+                  "свидания", "пока", "уважаемые", "уважаемый", "извините", "простите", "ок", "окей", "понятно",
+                  "хорошо", "отлично", "ясно"}
+# Вопросительные слова и подписи полей: "Сколько стоит обучение", "СНИЛС 123-456-789 01" - не ФИО
+QUESTION_WORDS = {"сколько", "стоит", "стоимость", "цена", "как", "где", "когда", "почему", "зачем", "что",
+                  "кто", "какой", "какая", "какое", "какие", "каких", "чем", "куда", "откуда", "можно", "есть"}
+DATA_LABEL_WORDS = {"снилс", "инн", "телефон", "тел", "моб", "мобильный", "дата", "рождения", "должность",
+                    "фио", "паспорт", "номер"}
+
+PATRONYMIC_ENDINGS = ("ович", "евич", "ич", "овна", "евна", "ична", "инична", "оглы", "кызы", "улы")
+SURNAME_ENDINGS = ("ов", "ев", "ёв", "ин", "ын", "ский", "цкий", "ской", "ова", "ева", "ина", "ына",
+                   "ская", "цкая", "ых", "их", "ко", "ук", "юк", "ян", "дзе", "швили", "енко")
+# Окончания косвенных падежей ("о Петрове", "найди Сидорова", "покажи Иванову"); женские ФИО на -а
+# в именительном падеже тоже сюда попадают - их форму уточняет ИИ
+INFLECTED_ENDINGS = ("а", "я", "у", "ю", "е", "ой", "ым", "им", "ом", "ем")
+
+_word_re = re.compile(r"[а-яёА-ЯЁ][а-яёА-ЯЁ-]*")
+_long_number_re = re.compile(r"\d{5,}")
+
+# Метка ФИО в шаблоне сообщения без персональных данных (см. redact_pii)
+NAME_PLACEHOLDER = "<ФИО>"
+
+# Вес длины последовательности: фамилия без имени - слабый признак ФИО
+_LENGTH_WEIGHT = {1: 0.5, 2: 0.9, 3: 1.0}
+
+# Счетчики для настройки порога
+intent_stats = Counter()
+
+
+def _name_word_score(word: str) -> float:
+    """Насколько слово похоже на часть ФИО"""
+    lower = word.lower()
+    if len(lower) < 3 or lower in FILLER_WORDS or lower in COURTESY_WORDS:
+        return 0.0
+    if lower in QUESTION_WORDS or lower in DATA_LABEL_WORDS:
+        return 0.0
+    if any(lower.startswith(k) for k in POSITION_KEYWORDS + ORDER_KEYWORDS + SEARCH_KEYWORDS):
+        return 0.0
+    score = 0.5
+    if word[0].isupper():
+        score += 0.2
+    if lower.endswith(PATRONYMIC_ENDINGS) or lower.endswith(SURNAME_ENDINGS):
+        score += 0.3
+    return min(score, 1.0)
+
+
+def detect_name(text: str) -> Dict[str, Any]:
+    """
+    Найти ФИО в тексте: самая длинная последовательность из 1-3 "именных" слов
+
+    Returns:
+        dict: name - найденное ФИО (или ""), score - похожесть на ФИО (0..1)
+    """
+    best_words: List[str] = []
+    best_score = 0.0
+    current: List[str] = []
+    current_scores: List[float] = []
+    for match in _word_re.finditer(text):
+        word = match.group(0)
+        score = _name_word_score(word)
+        # Слова ФИО идут подряд: разрыв (цифры, знаки) между словами начинает новую последовательность
+        gap = text[current_end:match.start()] if current else ""
+        if score and (not current or gap.strip(" ") == ""):
+            current.append(word)
+            current_scores.append(score)
+        else:
+            current, current_scores = ([word], [score]) if score else ([], [])
+        current_end = match.end()
+        if current and len(current) <= 3:
+            total = sum(current_scores) / len(current_scores) * _LENGTH_WEIGHT[len(current)]
+            if len(current) >= 2 and current[-1].lower().endswith(PATRONYMIC_ENDINGS):
+                total = min(1.0, total + 0.2)
+            if total > best_score:
+                best_words, best_score = list(current), total
+    return {"name": " ".join(best_words), "score": round(best_score, 2)}
+
+
+def redact_pii(text: str) -> Dict[str, str]:
+    """
+    Шаблон сообщения без персональных данных: СНИЛС, ИНН, телефоны, даты, длинные номера
+    и найденное ФИО заменяются метками (метки - подписи полей, поэтому сами за ФИО не принимаются)
+
+    Returns:
+        dict: text - шаблон сообщения, name - замененное ФИО (или "")
+    """
+    text = INN_RE.sub("<ИНН>", text)
+    text = PHONE_RE.sub("<ТЕЛЕФОН>", text)
+    text = SNILS_RE.sub("<СНИЛС>", text)
+    text = DATE_RE.sub("<ДАТА>", text)
+    text = _long_number_re.sub("<НОМЕР>", text)
+    name = detect_name(text)["name"]
+    if name:
+        pattern = r"(?<![\w-])" + r"\s+".join(re.escape(word) for word in name.split()) + r"(?![\w-])"
+        text = re.sub(pattern, NAME_PLACEHOLDER, text)
+    return {"text": text, "name": name}
+
+
+def extract_features(text: str) -> Dict[str, Any]:
+    """Признаки сообщения для определения намерения"""
+    lower = text.lower()
+    phone = bool(PHONE_RE.search(text))
+    # Телефон из 11 цифр не должен считаться СНИЛС
+    snils = bool(SNILS_RE.search(PHONE_RE.sub(" ", text)))
+    features = {
+        "snils": snils or "снилс" in lower,
+        "inn": bool(INN_RE.search(text)) or "инн" in lower.split(),
+        "phone": phone or any(k in lower for k in ("телефон", "тел.", "моб")),
+        "date": bool(DATE_RE.search(text)) or "рождения" in lower,
+        "position": any(k in lower for k in POSITION_KEYWORDS),
+        "order_keywords": any(k in lower for k in ORDER_KEYWORDS),
+        "search_keywords": any(k in lower for k in SEARCH_KEYWORDS),
+        "digits": any(char.isdigit() for char in text),
+        "words": len(text.split()),
+    }
+    features.update(detect_name(text))
+    features["data_count"] = sum(features[k] for k in ("snils", "inn", "phone", "date", "position"))
+    return features
+
+
+def has_surname_word(name: str) -> bool:
+    """В найденном ФИО есть слово с окончанием фамилии или отчества (отсекает "Москва Россия")"""
+    return any(word.lower().endswith(SURNAME_ENDINGS + PATRONYMIC_ENDINGS) for word in name.split())
+
+
+def is_inflected_name(name: str) -> bool:
+    """ФИО, возможно, не в именительном падеже - для поиска его нормализует ИИ"""
+    return any(word.lower().endswith(INFLECTED_ENDINGS) for word in name.split())
+
+
+def is_only_name(text: str) -> bool:
+    """Сообщение содержит только ФИО (2-4 слова, без цифр, данных и ключевых слов, с фамилией)"""
+    features = extract_features(text)
+    return (
+        2 <= features["words"] <= 4
+        and not features["digits"]
+        and "?" not in text
+        and features["data_count"] == 0
+        and not features["order_keywords"]
+        and not features["search_keywords"]
+        and len(features["name"].split()) >= 2
+        and has_surname_word(features["name"])
+    )
+
+
+def has_additional_data(text: str) -> bool:
+    """В сообщении есть данные сотрудника кроме ФИО или просьба об обучении"""
+    features = extract_features(text)
+    return features["data_count"] > 0 or features["order_keywords"]
+
+
+def classify_intent(message_text: str, chat_history: Optional[List] = None) -> Dict[str, Any]:
+    """
+    Определить намерение по правилам
+
+    Returns:
+        dict: Результат в формате ceo_dispatcher (type, intent, employee_name, message, confidence)
+              и source="rules"; при низкой уверенности решение нужно отдать ИИ
+    """
+    features = extract_features(message_text)
+    name, name_score = features["name"], features["score"]
+    data_count = features["data_count"]
+    intent, confidence = "unclear", 0.3
+
+    if data_count >= 2:
+        intent, confidence = "create_order", 0.9 + 0.05 * bool(name)
+    elif features["order_keywords"] and (data_count or name):
+        intent, confidence = "create_order", 0.85 + 0.05 * bool(data_count and name)
+    elif data_count == 1 and chat_history:
+        # Похоже на продолжение заказа (недостающие данные отдельным сообщением), но одно поле
+        # бывает и в вопросе - решает ИИ
+        intent, confidence = "create_order", 0.6
+    elif data_count == 1 and name:
+        intent, confidence = "create_order", 0.7
+    elif features["search_keywords"] and name and not data_count:
+        # После "покажи", "найди", "о" ФИО обычно склоняется: такое ФИО ИИ вернет в именительном падеже
+        intent, confidence = "search_info", 0.6 if is_inflected_name(name) else 0.9
+    elif is_only_name(message_text):
+        intent, confidence = "search_info", 0.5 + 0.45 * name_score
+
+    return {
+        "type": "success",
+        "intent": intent,
+        "employee_name": name,
+        "message": message_text,
+        "confidence": round(min(confidence, 1.0), 2),
+        "source": "rules"
+    }
+
+
+def intent_stats_snapshot() -> Dict[str, Any]:
+    """Сколько сообщений решено правилами и сколько ушло в ИИ"""
+    total = intent_stats["rules_hits"] + intent_stats["escalations"]
+    escalated = intent_stats["escalations_agree"] + intent_stats["escalations_disagree"]
+    return {
+        **intent_stats,
+        "threshold": INTENT_RULES_THRESHOLD,
+        "rules_hit_rate": intent_stats["rules_hits"] / total * 100 if total else 0,
+        # Как часто ИИ согласен с догадкой правил ниже порога - подсказка для снижения порога
+        "escalation_agreement_rate": intent_stats["escalations_agree"] / escalated * 100 if escalated else 0,
+    }
@@ -0,0 +1,189 @@
+"""
+Кэш ответов ИИ по содержимому запроса: LRU в памяти и (опционально) SQLite на диске
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import threading
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 0 - кэш отключен полностью
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+# Сколько ответов держать в памяти
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+# Файл для хранения кэша между перезапусками; пустая строка - только память
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/llm_cache.db")
+# Как часто (секунды) при записи удаляются просроченные строки с диска
+LLM_CACHE_PURGE_INTERVAL = float(os.getenv("LLM_CACHE_PURGE_INTERVAL", "60"))
+
+
+def make_cache_key(task_name: str, priority_list, messages: List[Dict],
+                   temperature: float, max_tokens: Optional[int]) -> str:
+    """
+    Ключ кэша: хэш задачи, класса моделей, сообщений и параметров генерации.
+    Конкретный провайдер в ключ не входит - ответы одного класса моделей взаимозаменяемы
+    """
+    model_classes = list(dict.fromkeys(model_type for _, model_type in priority_list))
+    payload = json.dumps(
+        [task_name, model_classes, messages, temperature, max_tokens],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """Ответ из кэша с тем же интерфейсом, что у ответа OpenAI: response.choices[0].message.content"""
+
+    cached = True
+
+    def __init__(self, content: str, client: str, model: str):
+        self.client = client
+        self.model = model
+        self.usage = None
+        self.choices = [SimpleNamespace(message=SimpleNamespace(role="assistant", content=content),
+                                        finish_reason="stop", index=0)]
+
+    @property
+    def content(self) -> str:
+        return self.choices[0].message.content
+
+
+class LLMCache:
+    """LRU-кэш ответов с временем жизни записей и записью на диск"""
+
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, path: Optional[str] = LLM_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path or None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (content, client, model, expires_at)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._task_stats: Dict[str, Counter] = {}
+        self._purged_at = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    client TEXT,
+                    model TEXT,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._purge_expired()
+        return self._conn
+
+    def _purge_expired(self):
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+        self._purged_at = time.monotonic()
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db().execute(
+                "SELECT content, client, model, expires_at FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time())
+            ).fetchone()
+
+    def _disk_put(self, key: str, task_name: str, entry: tuple):
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, task, content, client, model, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, task_name, *entry)
+            )
+            conn.commit()
+            # Просроченные ответы не задерживаются на диске до следующего перезапуска
+            if time.monotonic() - self._purged_at >= LLM_CACHE_PURGE_INTERVAL:
+                self._purge_expired()
+
+    def _count(self, task_name: str, event: str):
+        self._stats[event] += 1
+        self._task_stats.setdefault(task_name, Counter())[event] += 1
+
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get(self, key: str, task_name: str) -> Optional[CachedResponse]:
+        """Ответ из кэша или None"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[3] < time.time():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._count(task_name, "hits")
+        elif self.path:
+            try:
+                entry = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось прочитать кэш ИИ с диска: {e}")
+            if entry is not None:
+                self._remember(key, tuple(entry))
+                self._count(task_name, "hits")
+                self._stats["disk_hits"] += 1
+
+        if entry is None:
+            self._count(task_name, "misses")
+            return None
+        content, client, model, _ = entry
+        return CachedResponse(content, client, model)
+
+    async def put(self, key: str, task_name: str, content: str, client: str, model: str, ttl: float):
+        """Сохранить ответ на ttl секунд"""
+        entry = (content, client, model, time.time() + ttl)
+        self._remember(key, entry)
+        self._stats["stores"] += 1
+        if self.path:
+            try:
+                await asyncio.to_thread(self._disk_put, key, task_name, entry)
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось сохранить кэш ИИ на диск: {e}")
+
+    def clear(self):
+        """Очистить кэш (в памяти и на диске)"""
+        self._entries.clear()
+        if self.path:
+            with self._lock:
+                self._db().execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Доля попаданий в целом и по задачам"""
+        def hit_rate(counter: Counter) -> float:
+            total = counter["hits"] + counter["misses"]
+            return counter["hits"] / total * 100 if total else 0
+
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "persistent": bool(self.path),
+            **{event: self._stats[event] for event in ("hits", "misses", "disk_hits", "stores", "evictions")},
+            "hit_rate": hit_rate(self._stats),
+            "tasks": {task: {"hits": counter["hits"], "misses": counter["misses"], "hit_rate": hit_rate(counter)}
+                      for task, counter in self._task_stats.items()}
+        }
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,95 @@
+"""
+Клиенты провайдеров ИИ: создаются при первом запросе и используют общий пул HTTP-соединений
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from api_settings import API_CLIENTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Общий пул соединений ко всем провайдерам
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "50"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+# Повторы внутри клиента openai (переключение на другого провайдера - в ai_request.py)
+LLM_CLIENT_MAX_RETRIES = int(os.getenv("LLM_CLIENT_MAX_RETRIES", "2"))
+
+
+class LLMClientRegistry:
+    """Клиенты AsyncOpenAI по имени провайдера из API_CLIENTS"""
+
+    def __init__(self, config: Dict[str, Dict[str, Any]]):
+        self.config = config
+        self.clients: Dict[str, Any] = {}
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        # Соединения привязаны к циклу событий: в новом цикле (новый asyncio.run) пул создается заново
+        loop = asyncio.get_running_loop()
+        if self._http_client is None or self._loop is not loop:
+            if self._http_client is not None and not self._http_client.is_closed:
+                # Пул закрывает close() перед завершением цикла; из другого цикла его уже не закрыть
+                logger.warning("Пул соединений к провайдерам ИИ не был закрыт (llm_clients.close()) до завершения цикла событий")
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(LLM_HTTP_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT),
+            )
+            self._loop = loop
+            self.clients.clear()
+        return self._http_client
+
+    def get(self, name: str):
+        """
+        Клиент провайдера (создается при первом обращении)
+
+        Returns:
+            AsyncOpenAI: Клиент или None, если провайдер не настроен (нет ключа)
+        """
+        http_client = self._get_http_client()
+        if name in self.clients:
+            return self.clients[name]
+
+        config = self.config.get(name)
+        api_key = os.getenv(config["token_env"]) if config else None
+        client = None
+        if not api_key:
+            logger.warning(f"Провайдер ИИ {name}: не задан ключ {config['token_env'] if config else ''}")
+        else:
+            try:
+                from openai import AsyncOpenAI
+                client = AsyncOpenAI(
+                    base_url=config["base_url"],
+                    api_key=api_key,
+                    http_client=http_client,
+                    max_retries=LLM_CLIENT_MAX_RETRIES,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка инициализации клиента {name}: {e}")
+        self.clients[name] = client
+        return client
+
+    async def close(self):
+        """Закрыть пул соединений (при остановке бота или в конце скрипта, в том же цикле событий)"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            self._loop = None
+            self.clients.clear()
+
+
+llm_clients = LLMClientRegistry(API_CLIENTS)
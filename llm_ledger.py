@@ -0,0 +1,300 @@
+"""
+Журнал запросов к ИИ: задача, провайдер, модель, номер попытки, задержка, токены и результат.
+Записи дописываются в JSONL-файл (с ротацией по размеру), по ним строятся сводки по задачам и по часам.
+
+Запуск отчета: python llm_ledger.py --hours 24 [--by-hour]
+"""
+import os
+import glob
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from api_settings import LLM_PRICES
+from chat_context import estimate_tokens
+from crm_metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+LLM_LEDGER_ENABLED = os.getenv("LLM_LEDGER_ENABLED", "1") == "1"
+LLM_LEDGER_PATH = os.getenv("LLM_LEDGER_PATH", "logs/llm_ledger.jsonl")
+# Размер файла, после которого он переименовывается в .1 (старые - в .2 и т.д.); 0 - без ротации
+LLM_LEDGER_MAX_BYTES = int(os.getenv("LLM_LEDGER_MAX_BYTES", str(10 * 1024 * 1024)))
+# Сколько переименованных файлов хранить (более старые удаляются)
+LLM_LEDGER_BACKUPS = int(os.getenv("LLM_LEDGER_BACKUPS", "5"))
+
+# Результаты попытки
+OK = "ok"
+ERROR = "error"
+TIMEOUT = "timeout"
+RATE_LIMITED = "rate_limited"
+BUSY = "busy"            # не дождался слота в очереди провайдера
+CANCELLED = "cancelled"  # проигравший запрос гонки провайдеров
+CACHED = "cached"        # ответ из кэша, провайдер не вызывался
+
+
+def classify_error(error: BaseException) -> str:
+    """Результат попытки по исключению"""
+    if isinstance(error, asyncio.CancelledError):
+        return CANCELLED
+    if getattr(error, "status_code", None) == 429:
+        return RATE_LIMITED
+    name = type(error).__name__
+    if name == "ProviderBusy":
+        return BUSY
+    if isinstance(error, asyncio.TimeoutError) or "Timeout" in name:
+        return TIMEOUT
+    return ERROR
+
+
+def price_for(model: str) -> Optional[tuple]:
+    """Цена модели (за 1М входных и выходных токенов): самое длинное совпадение имени из LLM_PRICES"""
+    matches = [key for key in LLM_PRICES if key in (model or "")]
+    return LLM_PRICES[max(matches, key=len)] if matches else None
+
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price = price_for(model)
+    if not price:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+class Rollup:
+    """Сводка по группе записей"""
+
+    def __init__(self):
+        self.calls = 0
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        # Гистограмма вместо списка задержек: память не растет с числом запросов
+        self.latency = LatencyHistogram()
+
+    def add(self, record: Dict[str, Any]):
+        self.calls += 1
+        self.outcomes[record["o"]] += 1
+        self.prompt_tokens += record.get("pt", 0)
+        self.completion_tokens += record.get("ct", 0)
+        self.cost += cost_of(record.get("m", ""), record.get("pt", 0), record.get("ct", 0))
+        # Задержка отмененных запросов и кэша не говорит о скорости провайдера
+        if record["o"] not in (CANCELLED, CACHED, BUSY):
+            self.latency.observe(record["l"])
+
+    def snapshot(self) -> Dict[str, Any]:
+        provider_calls = self.calls - self.outcomes[CACHED]
+        failed = provider_calls - self.outcomes[OK] - self.outcomes[CANCELLED]
+        return {
+            "calls": self.calls,
+            "outcomes": dict(self.outcomes),
+            "error_rate": failed / provider_calls * 100 if provider_calls else 0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": round(self.cost, 4),
+            "latency_p50": self.latency.quantile(0.5),
+            "latency_p95": self.latency.quantile(0.95),
+        }
+
+
+def rollup(records: Iterable[Dict[str, Any]], by_hour: bool = False) -> Dict[str, Any]:
+    """
+    Сводка записей журнала
+
+    Returns:
+        dict: tasks - по задачам, hours - по часам и задачам (если by_hour), total - итог
+    """
+    tasks: Dict[str, Rollup] = defaultdict(Rollup)
+    hours: Dict[str, Dict[str, Rollup]] = defaultdict(lambda: defaultdict(Rollup))
+    total = Rollup()
+    for record in records:
+        tasks[record["task"]].add(record)
+        total.add(record)
+        if by_hour:
+            hour = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:00")
+            hours[hour][record["task"]].add(record)
+    result = {
+        "tasks": {task: stats.snapshot() for task, stats in sorted(tasks.items(), key=lambda item: -item[1].cost)},
+        "total": total.snapshot(),
+    }
+    if by_hour:
+        result["hours"] = {hour: {task: stats.snapshot() for task, stats in sorted(by_task.items())}
+                           for hour, by_task in sorted(hours.items())}
+    return result
+
+
+class LLMLedger:
+    """Журнал запросов к ИИ (только дописывание) и сводка с момента запуска"""
+
+    def __init__(self, path: str = LLM_LEDGER_PATH, enabled: bool = LLM_LEDGER_ENABLED,
+                 max_bytes: int = LLM_LEDGER_MAX_BYTES, backups: int = LLM_LEDGER_BACKUPS):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self.session = defaultdict(Rollup)
+
+    def _write(self, line: str):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._file.write(line)
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """journal.jsonl -> journal.jsonl.1 -> ... -> journal.jsonl.<backups>; самый старый удаляется"""
+        self._file.close()
+        self._file = None
+        for number in range(self.backups, 0, -1):
+            source = f"{self.path}.{number - 1}" if number > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number}")
+        if not self.backups:
+            os.remove(self.path)
+
+    def files(self) -> List[str]:
+        """Файлы журнала от старых к новым"""
+        rotated = [path for path in glob.glob(glob.escape(self.path) + ".*")
+                   if path.rsplit(".", 1)[-1].isdigit()]
+        rotated.sort(key=lambda path: -int(path.rsplit(".", 1)[-1]))
+        return rotated + ([self.path] if os.path.exists(self.path) else [])
+
+    def record(self, task_name: str, provider: Optional[str], model: Optional[str], attempt: int,
+               latency: float, outcome: str, usage: Any = None, messages: Optional[List] = None,
+               completion: Optional[str] = None):
+        """
+        Записать попытку запроса
+
+        Args:
+            task_name: Название задачи
+            provider: Провайдер (polza, proxyapi, vsegpt)
+            model: Модель
+            attempt: Номер попытки в рамках запроса (с 0)
+            latency: Время ответа провайдера без ожидания в очереди (секунды)
+            outcome: Результат (ok, error, timeout, rate_limited, busy, cancelled, cached)
+            usage: response.usage; если его нет - токены оцениваются по messages и completion
+            messages: Сообщения запроса (для оценки токенов)
+            completion: Текст ответа (для оценки токенов)
+        """
+        if not self.enabled:
+            return
+        record = {
+            "ts": round(time.time(), 3), "task": task_name, "p": provider, "m": model,
+            "a": attempt, "l": round(latency, 3), "o": outcome,
+        }
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            record["pt"] = usage.prompt_tokens
+            record["ct"] = usage.completion_tokens or 0
+        elif outcome == OK and messages is not None:
+            # Потоковые ответы приходят без usage
+            record["pt"] = sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+            record["ct"] = estimate_tokens(completion or "")
+            record["est"] = 1
+        self.session[task_name].add(record)
+        try:
+            self._write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError as e:
+            logger.warning(f"Не удалось записать журнал ИИ {self.path}: {e}")
+
+    def read(self, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Записи журнала (начиная с since, unix time); поврежденные строки пропускаются.
+        Файлы, последняя запись в которые была раньше since, не читаются
+        """
+        records = []
+        for path in self.files():
+            try:
+                if since is not None and os.path.getmtime(path) < since:
+                    continue
+                with open(path, encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if since is None or record.get("ts", 0) >= since:
+                            records.append(record)
+            except FileNotFoundError:
+                # Файл переименован ротацией во время чтения
+                continue
+        return records
+
+    async def report(self, hours: float = 24, by_hour: bool = False) -> Dict[str, Any]:
+        """Сводка за последние hours часов (чтение файла - в отдельном потоке)"""
+        records = await asyncio.to_thread(self.read, time.time() - hours * 3600)
+        return rollup(records, by_hour)
+
+    def stats(self) -> Dict[str, Any]:
+        """Сводка с момента запуска (для /metrics)"""
+        return {task: stats.snapshot() for task, stats in sorted(self.session.items())}
+
+
+def format_report(report: Dict[str, Any], hours: float) -> str:
+    """Сводка для сообщения в Telegram (HTML)"""
+    if not report["tasks"]:
+        return f"📒 <b>Запросы к ИИ за {hours:g} ч:</b> записей нет"
+
+    def seconds(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    total = report["total"]
+    lines = [
+        f"📒 <b>Запросы к ИИ за {hours:g} ч</b>",
+        f"Всего {total['calls']} попыток, токенов {total['prompt_tokens']} / {total['completion_tokens']}, "
+        f"стоимость {total['cost']:.2f} ₽",
+        "",
+    ]
+    for task, stats in report["tasks"].items():
+        lines.append(f"<b>{task}</b>")
+        lines.append(
+            f"  {stats['calls']} попыток, ошибок {stats['error_rate']:.0f}%, из кэша {stats['outcomes'].get(CACHED, 0)}, "
+            f"токенов {stats['prompt_tokens']} / {stats['completion_tokens']}, {stats['cost']:.2f} ₽, "
+            f"p50/p95 {seconds(stats['latency_p50'])}/{seconds(stats['latency_p95'])} с"
+        )
+    return "\n".join(lines)
+
+
+def _print_table(title: str, tasks: Dict[str, Dict[str, Any]]):
+    print(title)
+    print(f"  {'задача':<28} {'попыток':>8} {'ошибок%':>8} {'кэш':>5} {'вх.ток':>9} {'вых.ток':>9} "
+          f"{'₽':>9} {'p50':>7} {'p95':>7}")
+    for task, stats in tasks.items():
+        p50 = f"{stats['latency_p50']:.2f}" if stats["latency_p50"] is not None else "-"
+        p95 = f"{stats['latency_p95']:.2f}" if stats["latency_p95"] is not None else "-"
+        print(f"  {task[:28]:<28} {stats['calls']:>8} {stats['error_rate']:>8.1f} "
+              f"{stats['outcomes'].get(CACHED, 0):>5} {stats['prompt_tokens']:>9} {stats['completion_tokens']:>9} "
+              f"{stats['cost']:>9.2f} {p50:>7} {p95:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчет по журналу запросов к ИИ")
+    parser.add_argument("--hours", type=float, default=24, help="За сколько последних часов")
+    parser.add_argument("--by-hour", action="store_true", help="Сводка по каждому часу")
+    parser.add_argument("--path", default=LLM_LEDGER_PATH, help="Файл журнала")
+    args = parser.parse_args()
+
+    ledger = LLMLedger(args.path)
+    report = rollup(ledger.read(time.time() - args.hours * 3600), args.by_hour)
+    _print_table(f"📒 Запросы к ИИ за {args.hours:g} ч", report["tasks"])
+    if args.by_hour:
+        for hour, tasks in report["hours"].items():
+            _print_table(f"\n🕐 {hour}", tasks)
+    total = report["total"]
+    print(f"\nИтого: {total['calls']} попыток, токенов {total['prompt_tokens']} / {total['completion_tokens']}, "
+          f"стоимость {total['cost']:.2f} ₽")
+
+
+llm_ledger = LLMLedger()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Объединение сообщений пользователя: части заказа, присланные подряд ("Иванов Иван", "монтажник",
+СНИЛС...), обрабатываются одним сообщением - один проход диспетчера и разбора заказа вместо нескольких
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Пауза без новых сообщений, после которой накопленные части обрабатываются (0 - без объединения).
+# Короткая: ее ждут только сообщения, похожие на часть заказа (см. should_buffer)
+MESSAGE_COALESCE_WINDOW = float(os.getenv("MESSAGE_COALESCE_WINDOW", "1.5"))
+# Максимальная задержка обработки от первого сообщения, даже если пользователь продолжает писать
+MESSAGE_COALESCE_MAX_WAIT = float(os.getenv("MESSAGE_COALESCE_MAX_WAIT", "6.0"))
+
+
+class _Batch:
+    def __init__(self):
+        self.messages: List[Any] = []
+        self.texts: List[str] = []
+        self.first_at = time.monotonic()
+        self.timer: asyncio.Task = None
+
+
+class MessageCoalescer:
+    """
+    Буфер сообщений по пользователям. Обработка сообщений одного пользователя идет строго
+    по очереди, чтобы части заказа попадали в историю чата в правильном порядке
+    """
+
+    def __init__(self, handler: Callable[[Any, str], Awaitable[None]],
+                 window: float = MESSAGE_COALESCE_WINDOW, max_wait: float = MESSAGE_COALESCE_MAX_WAIT,
+                 should_buffer: Optional[Callable[[str], bool]] = None,
+                 on_error: Optional[Callable[[Any, Exception], Awaitable[None]]] = None):
+        """
+        Args:
+            handler: Обработчик handler(последнее сообщение, объединенный текст)
+            window: Пауза без новых сообщений перед обработкой (секунды)
+            max_wait: Максимальная задержка от первого сообщения (секунды)
+            should_buffer: Какие сообщения ждут продолжения (по умолчанию - все); остальные
+                обрабатываются сразу, накопленные до них части - перед ними
+            on_error: Ответ пользователю при ошибке обработчика on_error(сообщение, ошибка)
+        """
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.should_buffer = should_buffer
+        self.on_error = on_error
+        self.pending: Dict[int, _Batch] = {}
+        # Блокировка пользователя живет, пока его сообщения обрабатываются или ждут очереди
+        self.locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users = Counter()
+        self.stats = Counter()
+        self._tasks = set()
+
+    async def add(self, user_id: int, message: Any, text: str):
+        """Добавить сообщение; обработка - после паузы в window секунд"""
+        self.stats["messages"] += 1
+        if not self.window or (self.should_buffer and not self.should_buffer(text)):
+            # Накопленные части обрабатываются раньше, чтобы сохранить порядок сообщений
+            if user_id in self.pending:
+                self.pending[user_id].timer.cancel()
+                await self._flush(user_id)
+            self.stats["batches"] += 1
+            await self._process(user_id, message, text)
+            return
+
+        batch = self.pending.get(user_id)
+        if batch is None:
+            batch = self.pending[user_id] = _Batch()
+        else:
+            batch.timer.cancel()
+            self.stats["coalesced"] += 1
+        batch.messages.append(message)
+        batch.texts.append(text)
+
+        delay = min(self.window, batch.first_at + self.max_wait - time.monotonic())
+        batch.timer = asyncio.ensure_future(self._flush_later(user_id, max(0.0, delay)))
+        self._tasks.add(batch.timer)
+        batch.timer.add_done_callback(self._tasks.discard)
+
+    def discard(self, user_id: int):
+        """Сбросить необработанные сообщения пользователя (например, при /clear)"""
+        batch = self.pending.pop(user_id, None)
+        if batch is not None:
+            batch.timer.cancel()
+            self.stats["discarded"] += len(batch.messages)
+
+    async def _flush_later(self, user_id: int, delay: float):
+        await asyncio.sleep(delay)
+        await self._flush(user_id)
+
+    async def _flush(self, user_id: int):
+        # После извлечения из pending новые сообщения собираются в следующую пачку
+        batch = self.pending.pop(user_id)
+        self.stats["batches"] += 1
+        if len(batch.messages) > 1:
+            logger.info(f"Пользователь {user_id}: объединено сообщений - {len(batch.messages)}")
+        await self._process(user_id, batch.messages[-1], "\n".join(batch.texts))
+
+    async def _process(self, user_id: int, message: Any, text: str):
+        lock = self.locks.setdefault(user_id, asyncio.Lock())
+        self._lock_users[user_id] += 1
+        try:
+            async with lock:
+                try:
+                    await self.handler(message, text)
+                except Exception as e:
+                    logger.exception(f"Ошибка обработки сообщения пользователя {user_id}: {e}")
+                    self.stats["errors"] += 1
+                    if self.on_error:
+                        try:
+                            await self.on_error(message, e)
+                        except Exception as reply_error:
+                            logger.error(f"Не удалось отправить ответ об ошибке пользователю {user_id}: {reply_error}")
+        finally:
+            self._lock_users[user_id] -= 1
+            if not self._lock_users[user_id]:
+                del self._lock_users[user_id]
+                del self.locks[user_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Сколько сообщений объединено"""
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "window": self.window,
+            "pending_users": len(self.pending),
+            "messages_per_batch": self.stats["messages"] / batches if batches else 0,
+        }
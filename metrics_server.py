@@ -0,0 +1,62 @@
+"""
+HTTP-эндпоинт для сбора метрик (Prometheus и JSON)
+"""
+import os
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Порт эндпоинта метрик; пусто - сервер не запускается
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+# Эндпоинт без авторизации - по умолчанию доступен только с этой машины
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Источники метрик: имя -> (снимок для JSON, текст Prometheus или None)
+_collectors: Dict[str, tuple] = {}
+
+
+def register_collector(name: str, snapshot: Callable[[], Any],
+                       prometheus: Optional[Callable[[], str]] = None):
+    """Добавить источник метрик"""
+    _collectors[name] = (snapshot, prometheus)
+
+
+def collect_snapshot() -> Dict[str, Any]:
+    """Снимок всех зарегистрированных метрик"""
+    return {name: snapshot() for name, (snapshot, _) in _collectors.items()}
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    text = "".join(prometheus() for _, prometheus in _collectors.values() if prometheus)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+async def _metrics_json(request: web.Request) -> web.Response:
+    return web.Response(
+        text=json.dumps(collect_snapshot(), ensure_ascii=False, indent=2, default=str),
+        content_type="application/json"
+    )
+
+
+async def start_metrics_server(port: Optional[int] = None) -> Optional[web.AppRunner]:
+    """
+    Запустить HTTP-сервер метрик: /metrics (Prometheus) и /metrics.json
+
+    Returns:
+        web.AppRunner: для остановки через runner.cleanup(), или None если порт не задан
+    """
+    port = port or (int(METRICS_PORT) if METRICS_PORT else None)
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    app.router.add_get("/metrics.json", _metrics_json)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{port}/metrics")
+    return runner
@@ -0,0 +1,207 @@
+"""
+Индекс ФИО сотрудников для быстрого ранжированного поиска
+"""
+import re
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Уровни совпадения (чем больше, тем выше в выдаче)
+SCORE_EXACT = 100          # полное совпадение ФИО
+SCORE_TOKENS = 90          # все слова запроса совпали со словами ФИО
+SCORE_PREFIX = 75          # все слова запроса - начала слов ФИО
+SCORE_SUBSTRING = 60       # запрос (без пробелов) - подстрока ФИО (поведение старого поиска)
+SCORE_FUZZY = 50           # похожесть по триграммам (опечатки), умножается на коэффициент
+
+# Минимальная похожесть по триграммам для нечеткого совпадения
+FUZZY_THRESHOLD = 0.45
+
+_non_word_re = re.compile(r"[^\w\s]+")
+_space_re = re.compile(r"\s+")
+
+
+def normalize_name(text) -> str:
+    """Нижний регистр, ё→е, без знаков препинания, одиночные пробелы"""
+    if not text:
+        return ""
+    text = str(text).lower().replace("ё", "е")
+    text = _non_word_re.sub(" ", text)
+    return _space_re.sub(" ", text).strip()
+
+
+def trigrams(text: str) -> set:
+    """Множество символьных триграмм строки"""
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    """
+    Индекс, построенный один раз на версию списка сотрудников:
+    нормализованные ФИО, отдельные слова (фамилия/имя/отчество) и триграммы
+    """
+
+    def __init__(self, employees: List[Dict], version: int = 0):
+        self.version = version
+        self.employees: List[Dict] = []
+        self._names: List[str] = []            # нормализованные ФИО
+        self._compact: List[str] = []          # ФИО без пробелов
+        self._tokens: List[List[str]] = []     # слова ФИО
+        self._grams: List[set] = []            # триграммы ФИО
+        self._by_compact: Dict[str, List[int]] = defaultdict(list)
+        self._by_token: Dict[str, set] = defaultdict(set)
+        self._by_trigram: Dict[str, set] = defaultdict(set)
+
+        for employee in employees:
+            if not isinstance(employee, dict) or not employee.get("full_name"):
+                continue
+            idx = len(self.employees)
+            name = normalize_name(employee.get("full_name"))
+            compact = name.replace(" ", "")
+            tokens = name.split(" ")
+
+            self.employees.append(employee)
+            self._names.append(name)
+            self._compact.append(compact)
+            self._tokens.append(tokens)
+            self._grams.append(trigrams(compact))
+
+            self._by_compact[compact].append(idx)
+            for token in tokens:
+                self._by_token[token].add(idx)
+            for gram in self._grams[idx]:
+                self._by_trigram[gram].add(idx)
+
+        # Отсортированные слова для поиска по началу слова через bisect
+        self._sorted_tokens = sorted(self._by_token)
+
+    def __len__(self):
+        return len(self.employees)
+
+    def _prefix_ids(self, prefix: str) -> set:
+        """Сотрудники, у которых есть слово, начинающееся с prefix"""
+        ids = set()
+        pos = bisect_left(self._sorted_tokens, prefix)
+        while pos < len(self._sorted_tokens) and self._sorted_tokens[pos].startswith(prefix):
+            ids |= self._by_token[self._sorted_tokens[pos]]
+            pos += 1
+        return ids
+
+    def _strict_candidates(self, query_tokens: List[str], query_compact: str) -> set:
+        """Кандидаты на точное, пословное или подстрочное совпадение"""
+        candidates = set(self._by_compact.get(query_compact, []))
+
+        # Каждое слово запроса должно быть началом какого-то слова ФИО
+        by_words = None
+        for token in sorted(query_tokens, key=len, reverse=True):
+            ids = self._prefix_ids(token)
+            by_words = ids if by_words is None else by_words & ids
+            if not by_words:
+                break
+        if by_words:
+            candidates |= by_words
+
+        # Для подстроки нужны все триграммы запроса
+        if len(query_compact) >= 3:
+            postings = sorted((self._by_trigram.get(g, set()) for g in trigrams(query_compact)), key=len)
+            common = set(postings[0]) if postings else set()
+            for posting in postings[1:]:
+                common &= posting
+                if not common:
+                    break
+            candidates |= common
+        return candidates
+
+    def _fuzzy_candidates(self, query_grams: set, limit: int) -> set:
+        """
+        Кандидаты на нечеткое совпадение: отсекаем тех, у кого общих триграмм
+        заведомо меньше, чем нужно для FUZZY_THRESHOLD, и оставляем лучших по их числу
+        """
+        counts = defaultdict(int)
+        for gram in query_grams:
+            for idx in self._by_trigram.get(gram, ()):
+                counts[idx] += 1
+        required = FUZZY_THRESHOLD * len(query_grams) / 2
+        passed = [(count, idx) for idx, count in counts.items() if count >= required]
+        return {idx for _, idx in heapq.nlargest(limit * 4, passed)}
+
+    def _score(self, idx: int, query_tokens: List[str], query_compact: str,
+               query_grams: set) -> float:
+        compact = self._compact[idx]
+        tokens = self._tokens[idx]
+
+        if compact == query_compact:
+            return SCORE_EXACT
+
+        remaining = list(tokens)
+        exact = True
+        matched = True
+        for q in query_tokens:
+            if q in remaining:
+                remaining.remove(q)
+                continue
+            exact = False
+            prefix = next((t for t in remaining if t.startswith(q)), None)
+            if prefix is None:
+                matched = False
+                break
+            remaining.remove(prefix)
+        if matched:
+            # Совпадение по фамилии (первому слову) ценнее совпадения по имени
+            surname_bonus = 1 if tokens and query_tokens and tokens[0].startswith(query_tokens[0]) else 0
+            return (SCORE_TOKENS if exact else SCORE_PREFIX) + surname_bonus
+
+        if query_compact in compact:
+            return SCORE_SUBSTRING
+
+        if query_grams:
+            name_grams = self._grams[idx]
+            similarity = 2 * len(query_grams & name_grams) / (len(query_grams) + len(name_grams))
+            if similarity >= FUZZY_THRESHOLD:
+                return SCORE_FUZZY * similarity
+        return 0
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0) -> List[Tuple[Dict, float]]:
+        """
+        Ранжированный поиск сотрудников
+
+        Args:
+            query: Поисковый запрос (ФИО или его часть)
+            limit: Сколько лучших результатов вернуть
+            min_score: Минимальный уровень совпадения (например, SCORE_SUBSTRING)
+
+        Returns:
+            list: Пары (сотрудник, оценка) по убыванию оценки
+        """
+        query_name = normalize_name(query)
+        if not query_name:
+            return []
+        query_tokens = query_name.split(" ")
+        query_compact = query_name.replace(" ", "")
+        query_grams = trigrams(query_compact) if len(query_compact) >= 3 else set()
+
+        scored = []
+        seen = set()
+
+        def score_candidates(candidates):
+            for idx in candidates - seen:
+                seen.add(idx)
+                score = self._score(idx, query_tokens, query_compact, query_grams)
+                if score > 0 and score >= min_score:
+                    # При равной оценке выше тот, чье ФИО ближе по длине к запросу
+                    scored.append((-score, abs(len(self._compact[idx]) - len(query_compact)), idx))
+
+        score_candidates(self._strict_candidates(query_tokens, query_compact))
+        # Нечеткий поиск (опечатки) - только если точных совпадений нет
+        if not scored and min_score < SCORE_SUBSTRING and query_grams:
+            score_candidates(self._fuzzy_candidates(query_grams, limit))
+
+        scored.sort()
+        return [(self.employees[idx], -neg_score) for neg_score, _, idx in scored[:limit]]
+
+    def best(self, query: str, min_score: float = 0) -> Optional[Dict]:
+        """Лучший результат поиска или None"""
+        results = self.search(query, limit=1, min_score=min_score)
+        return results[0][0] if results else None
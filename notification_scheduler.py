@@ -7,7 +7,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 from notification_types import NotificationType, get_template, format_notification
 from notification_storage import NotificationStorage
-from api import allPeople, getPeople
+from api import roster_cache, getPeople
 
 logger = logging.getLogger(__name__)
 
@@ -73,16 +73,10 @@ class NotificationScheduler:
     async def _check_expiring_certificates(self):
         """Проверить истекающие сертификаты"""
         try:
-            # Получаем всех сотрудников
-            all_people = await allPeople()
-            if not all_people or isinstance(all_people, dict) and all_people.get("error"):
-                return
-            
-            # allPeople() возвращает список напрямую
-            employees = all_people if isinstance(all_people, list) else []
             expiring_days = [7, 30]  # Проверяем за 7 и 30 дней
             
-            for employee in employees:
+            # Обрабатываем сотрудников по мере загрузки страниц (или из кэша)
+            async for employee in roster_cache.iter_employees():
                 employee_id = employee.get("id")
                 full_name = employee.get("full_name")
                 all_certificates = employee.get("all_certificates", [])
@@ -108,14 +102,7 @@ class NotificationScheduler:
     async def _check_expired_certificates(self):
         """Проверить просроченные сертификаты"""
         try:
-            all_people = await allPeople()
-            if not all_people or isinstance(all_people, dict) and all_people.get("error"):
-                return
-            
-            # allPeople() возвращает список напрямую
-            employees = all_people if isinstance(all_people, list) else []
-            
-            for employee in employees:
+            async for employee in roster_cache.iter_employees():
                 employee_id = employee.get("id")
                 full_name = employee.get("full_name")
                 all_certificates = employee.get("all_certificates", [])
@@ -0,0 +1,221 @@
+"""
+Здоровье провайдеров ИИ: автоматический выключатель (circuit breaker) и порядок по задержке
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних вызовов учитывать в доле ошибок
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", "20"))
+# Минимум вызовов в окне, чтобы судить по доле ошибок
+LLM_HEALTH_MIN_CALLS = int(os.getenv("LLM_HEALTH_MIN_CALLS", "5"))
+# Доля ошибок в окне, при которой выключатель размыкается
+LLM_HEALTH_ERROR_RATE = float(os.getenv("LLM_HEALTH_ERROR_RATE", "0.5"))
+# Ошибок подряд, при которых выключатель размыкается независимо от окна
+LLM_HEALTH_CONSECUTIVE_FAILURES = int(os.getenv("LLM_HEALTH_CONSECUTIVE_FAILURES", "3"))
+# Сколько секунд провайдер пропускается, прежде чем отправить ему пробный запрос
+LLM_HEALTH_OPEN_SECONDS = float(os.getenv("LLM_HEALTH_OPEN_SECONDS", "30"))
+# Коэффициент сглаживания EWMA задержки
+LLM_HEALTH_EWMA_ALPHA = float(os.getenv("LLM_HEALTH_EWMA_ALPHA", "0.3"))
+# 0 - не менять порядок провайдеров по задержке (выключатель работает всегда)
+LLM_ADAPTIVE_ORDER = os.getenv("LLM_ADAPTIVE_ORDER", "1") == "1"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+ProviderKey = Tuple[str, str]  # (провайдер, тип модели), например ("polza", "openai")
+
+
+class ProviderHealth:
+    """Состояние одного провайдера и типа модели"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes: deque = deque(maxlen=LLM_HEALTH_WINDOW)  # True - успех
+        self.consecutive_failures = 0
+        self.ewma_latency: Optional[float] = None
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def observe_latency(self, seconds: float):
+        if self.ewma_latency is None:
+            self.ewma_latency = seconds
+        else:
+            self.ewma_latency += LLM_HEALTH_EWMA_ALPHA * (seconds - self.ewma_latency)
+
+    def available(self, now: float) -> bool:
+        """Можно ли отправить запрос (открытый выключатель по истечении паузы переходит в half-open)"""
+        if self.state == OPEN and now - self.opened_at >= LLM_HEALTH_OPEN_SECONDS:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.probe_in_flight
+        return self.state == CLOSED
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "error_rate": self.error_rate * 100,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency": self.ewma_latency,
+            "open_for": max(0.0, LLM_HEALTH_OPEN_SECONDS - (time.monotonic() - self.opened_at))
+            if self.state == OPEN else 0.0,
+            "last_error": self.last_error
+        }
+
+
+class ProviderHealthRegistry:
+    """Здоровье всех провайдеров; порядок попыток для списка приоритетов"""
+
+    def __init__(self):
+        self.providers: Dict[ProviderKey, ProviderHealth] = {}
+
+    def get(self, key: ProviderKey) -> ProviderHealth:
+        health = self.providers.get(key)
+        if health is None:
+            health = self.providers[key] = ProviderHealth()
+        return health
+
+    def order(self, priority_list: List[ProviderKey]) -> List[ProviderKey]:
+        """
+        Порядок попыток: провайдеры с разомкнутым выключателем пропускаются,
+        внутри одного типа модели более быстрые идут раньше
+
+        Returns:
+            list: Доступные провайдеры; если недоступны все - исходный список
+        """
+        now = time.monotonic()
+        available = [key for key in priority_list if self.get(key).available(now)]
+        if not available:
+            logger.warning("Все провайдеры ИИ отключены выключателем, пробуем исходный список")
+            return list(priority_list)
+        if not LLM_ADAPTIVE_ORDER:
+            return available
+
+        # Тип модели задает качество ответа - его порядок из api_settings сохраняется,
+        # провайдеры без замеров не обгоняют провайдеров с известной задержкой
+        group_rank = {}
+        for _, model_type in priority_list:
+            group_rank.setdefault(model_type, len(group_rank))
+
+        def sort_key(key: ProviderKey):
+            health = self.get(key)
+            if health.ewma_latency is None:
+                return group_rank[key[1]], float("inf")
+            # Ожидаемое время с учетом повторов у ненадежного провайдера
+            return group_rank[key[1]], health.ewma_latency / (1 - min(health.error_rate, 0.9))
+
+        return sorted(available, key=sort_key)
+
+    async def call(self, key: ProviderKey, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить запрос к провайдеру и записать результат (отмена запроса не считается ошибкой)"""
+        health = self.get(key)
+        is_probe = health.state == HALF_OPEN
+        if is_probe:
+            health.probe_in_flight = True
+        started = time.monotonic()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            if is_probe:
+                health.probe_in_flight = False
+            raise
+        except Exception as e:
+            self.record_failure(key, time.monotonic() - started, e)
+            raise
+        self.record_success(key, time.monotonic() - started)
+        return result
+
+    def record_success(self, key: ProviderKey, seconds: float):
+        health = self.get(key)
+        health.calls += 1
+        health.outcomes.append(True)
+        health.consecutive_failures = 0
+        health.probe_in_flight = False
+        health.observe_latency(seconds)
+        if health.state != CLOSED:
+            logger.info(f"Провайдер {key[0]}/{key[1]} снова доступен")
+            health.state = CLOSED
+            health.outcomes.clear()
+            health.outcomes.append(True)
+
+    def record_failure(self, key: ProviderKey, seconds: float, error: Exception):
+        health = self.get(key)
+        health.calls += 1
+        health.failures += 1
+        health.outcomes.append(False)
+        health.consecutive_failures += 1
+        health.probe_in_flight = False
+        health.last_error = f"{type(error).__name__}: {error}"[:200]
+        # Быстрая ошибка не делает провайдера "быстрым", а зависание - учитывается
+        if health.ewma_latency is None or seconds > health.ewma_latency:
+            health.observe_latency(seconds)
+
+        should_open = (
+            health.state == HALF_OPEN
+            or health.consecutive_failures >= LLM_HEALTH_CONSECUTIVE_FAILURES
+            or (len(health.outcomes) >= LLM_HEALTH_MIN_CALLS and health.error_rate >= LLM_HEALTH_ERROR_RATE)
+        )
+        if should_open:
+            if health.state != OPEN:
+                logger.warning(
+                    f"Провайдер {key[0]}/{key[1]} отключен на {LLM_HEALTH_OPEN_SECONDS:.0f} с "
+                    f"(ошибок {health.error_rate * 100:.0f}%, подряд {health.consecutive_failures})"
+                )
+            health.state = OPEN
+            health.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние всех провайдеров"""
+        return {f"{provider}/{model_type}": health.snapshot()
+                for (provider, model_type), health in sorted(self.providers.items())}
+
+    def render_prometheus(self) -> str:
+        """Состояние провайдеров в формате Prometheus"""
+        states = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+        lines = [
+            "# HELP llm_provider_circuit_state Circuit state (0 closed, 1 half-open, 2 open)",
+            "# TYPE llm_provider_circuit_state gauge",
+        ]
+        for (provider, model_type), health in sorted(self.providers.items()):
+            labels = f'provider="{provider}",model_type="{model_type}"'
+            lines.append(f"llm_provider_circuit_state{{{labels}}} {states[health.state]}")
+            if health.ewma_latency is not None:
+                lines.append(f"llm_provider_latency_ewma_seconds{{{labels}}} {health.ewma_latency:.3f}")
+            lines.append(f"llm_provider_errors_total{{{labels}}} {health.failures}")
+        return "\n".join(lines) + "\n"
+
+
+def format_health(snapshot: Dict[str, Any]) -> str:
+    """Состояние провайдеров для сообщения в Telegram (HTML)"""
+    if not snapshot:
+        return "🧠 <b>Провайдеры ИИ:</b> запросов еще не было"
+    icons = {CLOSED: "🟢", HALF_OPEN: "🟡", OPEN: "🔴"}
+    lines = ["🧠 <b>Провайдеры ИИ</b>", ""]
+    for name, health in snapshot.items():
+        latency = f"{health['ewma_latency']:.2f} с" if health["ewma_latency"] is not None else "-"
+        line = (f"{icons[health['state']]} <b>{name}</b>: {health['calls']} запр., "
+                f"ошибок {health['error_rate']:.0f}%, задержка {latency}")
+        if health["state"] == OPEN:
+            line += f", пауза еще {health['open_for']:.0f} с"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+provider_health = ProviderHealthRegistry()
@@ -0,0 +1,275 @@
+"""
+Ограничение нагрузки на провайдеров ИИ: одновременные запросы, запросы и токены в минуту.
+Запросы сверх лимита ждут в очереди (FIFO), а не уходят сразу к следующему провайдеру
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from api_settings import PROVIDER_LIMITS, LLM_LIMIT_DEFAULT_COMPLETION_TOKENS
+from chat_context import estimate_tokens
+from crm_metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Корзины гистограммы ожидания в очереди (секунды)
+QUEUE_WAIT_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60]
+
+
+class ProviderBusy(Exception):
+    """Провайдер перегружен: запрос не дождался своей очереди"""
+
+
+class TokenBucket:
+    """Корзина токенов с пополнением per_minute в минуту; 0 - без ограничения"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Через сколько секунд в корзине будет amount (запрос больше емкости ждет полную корзину)"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Вернуть неиспользованный резерв (или списать перерасход при отрицательном amount)"""
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderLimiter:
+    """Лимиты одного провайдера и очередь запросов к нему"""
+
+    def __init__(self, name: str, max_concurrency: int = 0, rpm: int = 0, tpm: int = 0,
+                 max_wait: float = 10.0, cooldown: float = 10.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.cooldown = cooldown
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.queue: deque = deque()  # asyncio.Event каждого ожидающего запроса
+        self.queue_wait = LatencyHistogram(QUEUE_WAIT_BUCKETS)
+        self.max_queue_wait = 0.0
+        self.max_queued = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _delay(self, tokens: int, now: float) -> Optional[float]:
+        """Сколько ждать до отправки запроса; None - ждать освобождения слота"""
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return None
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _wake_head(self):
+        if self.queue:
+            self.queue[0].set()
+
+    async def acquire(self, tokens: int) -> float:
+        """
+        Дождаться очереди и занять слот
+
+        Args:
+            tokens: Оценка токенов запроса (резервируется в лимите TPM)
+
+        Returns:
+            float: Время ожидания в очереди (секунды)
+
+        Raises:
+            ProviderBusy: Очередь не подошла за max_wait
+        """
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        event = asyncio.Event()
+        self.queue.append(event)
+        self.max_queued = max(self.max_queued, len(self.queue))
+        try:
+            while True:
+                now = time.monotonic()
+                delay = self._delay(tokens, now) if self.queue[0] is event else None
+                if delay == 0:
+                    break
+                remaining = deadline - now
+                if remaining <= 0 or (delay is not None and delay > remaining):
+                    self.rejected += 1
+                    raise ProviderBusy(
+                        f"{self.name}: очередь не подошла за {self.max_wait:.0f} с "
+                        f"(выполняется {self.in_flight}, в очереди {len(self.queue)})"
+                    )
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining if delay is None else delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            was_head = self.queue[0] is event
+            self.queue.remove(event)
+            if was_head:
+                self._wake_head()
+            raise
+
+        self.queue.popleft()
+        self.in_flight += 1
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.acquired += 1
+        waited = time.monotonic() - started
+        self.queue_wait.observe(waited)
+        self.max_queue_wait = max(self.max_queue_wait, waited)
+        # Следующий в очереди проверяет, хватает ли лимитов и ему
+        self._wake_head()
+        return waited
+
+    def release(self, reserved_tokens: int, used_tokens: Optional[int] = None):
+        """Освободить слот; фактический расход токенов уточняет резерв"""
+        self.in_flight -= 1
+        if used_tokens is not None:
+            self.tokens.give_back(reserved_tokens - used_tokens)
+        self._wake_head()
+
+    def pause(self, seconds: Optional[float] = None):
+        """Провайдер ответил 429 - новые запросы ждут cooldown секунд"""
+        self.rate_limited += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + (seconds or self.cooldown))
+        logger.warning(f"Провайдер {self.name} ограничил частоту запросов (429), пауза {seconds or self.cooldown:.1f} с")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "max_queued": self.max_queued,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "queue_wait_p50": self.queue_wait.quantile(0.5),
+            "queue_wait_p95": self.queue_wait.quantile(0.95),
+            "queue_wait_max": self.max_queue_wait,
+            "limits": {
+                "max_concurrency": self.max_concurrency,
+                "rpm": int(self.requests.capacity),
+                "tpm": int(self.tokens.capacity),
+                "max_wait": self.max_wait,
+            },
+        }
+
+
+def estimate_request_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """Оценка токенов запроса: промпт по длине текста + максимум ответа"""
+    prompt = sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+    return prompt + (max_tokens or LLM_LIMIT_DEFAULT_COMPLETION_TOKENS)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Пауза из заголовка Retry-After ответа 429"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class ProviderLimitsRegistry:
+    """Лимитеры всех провайдеров (настройки - PROVIDER_LIMITS в api_settings.py)"""
+
+    def __init__(self, config: Dict[str, Dict[str, Any]]):
+        self.limiters = {name: ProviderLimiter(name, **limits) for name, limits in config.items()}
+
+    def get(self, name: str) -> ProviderLimiter:
+        if name not in self.limiters:
+            self.limiters[name] = ProviderLimiter(name)
+        return self.limiters[name]
+
+    async def run(self, name: str, tokens: int, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить запрос к провайдеру в пределах его лимитов"""
+        limiter = self.get(name)
+        waited = await limiter.acquire(tokens)
+        if waited >= 1:
+            logger.info(f"Запрос к {name} ждал в очереди {waited:.1f} с")
+        used_tokens = None
+        try:
+            result = await func()
+            usage = getattr(result, "usage", None)
+            used_tokens = getattr(usage, "total_tokens", None)
+            return result
+        except Exception as e:
+            self.note_error(name, e)
+            raise
+        finally:
+            limiter.release(tokens, used_tokens)
+
+    def note_error(self, name: str, error: Exception):
+        """Учесть ошибку запроса: на 429 провайдер ставится на паузу"""
+        if getattr(error, "status_code", None) == 429:
+            self.get(name).pause(_retry_after(error))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: limiter.snapshot() for name, limiter in sorted(self.limiters.items())}
+
+    def render_prometheus(self) -> str:
+        """Ожидание в очереди и загрузка провайдеров в формате Prometheus"""
+        lines = [
+            "# HELP llm_provider_queue_wait_seconds Time spent waiting for a provider slot",
+            "# TYPE llm_provider_queue_wait_seconds histogram",
+        ]
+        for name, limiter in sorted(self.limiters.items()):
+            labels = f'provider="{name}"'
+            histogram = limiter.queue_wait
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'llm_provider_queue_wait_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'llm_provider_queue_wait_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"llm_provider_queue_wait_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"llm_provider_queue_wait_seconds_count{{{labels}}} {histogram.count}")
+        for metric, attribute, kind in (
+            ("llm_provider_in_flight", "in_flight", "gauge"),
+            ("llm_provider_rejected_total", "rejected", "counter"),
+            ("llm_provider_rate_limited_total", "rate_limited", "counter"),
+        ):
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, limiter in sorted(self.limiters.items()):
+                lines.append(f'{metric}{{provider="{name}"}} {getattr(limiter, attribute)}')
+        lines.append("# TYPE llm_provider_queued gauge")
+        for name, limiter in sorted(self.limiters.items()):
+            lines.append(f'llm_provider_queued{{provider="{name}"}} {len(limiter.queue)}')
+        return "\n".join(lines) + "\n"
+
+
+def format_limits(snapshot: Dict[str, Any]) -> str:
+    """Загрузка провайдеров для сообщения в Telegram (HTML)"""
+    if not snapshot:
+        return "🚦 <b>Лимиты провайдеров:</b> не настроены"
+
+    def seconds(value):
+        return f"{value:.2f} с" if value is not None else "-"
+
+    lines = ["🚦 <b>Очереди провайдеров</b>"]
+    for name, stats in snapshot.items():
+        lines.append(
+            f"<b>{name}</b>: выполняется {stats['in_flight']}, в очереди {stats['queued']} "
+            f"(макс. {stats['max_queued']}), ожидание p50/p95 {seconds(stats['queue_wait_p50'])}/"
+            f"{seconds(stats['queue_wait_p95'])}, отказов {stats['rejected']}, 429: {stats['rate_limited']}"
+        )
+    return "\n".join(lines)
+
+
+provider_limits = ProviderLimitsRegistry(PROVIDER_LIMITS)
@@ -0,0 +1,242 @@
+"""
+Кэш списка сотрудников (roster) с TTL и фоновым обновлением
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд данные считаются свежими
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", "300"))
+# Сколько секунд после TTL можно отдавать устаревшие данные, обновляя их в фоне
+ROSTER_CACHE_STALE_TTL = float(os.getenv("ROSTER_CACHE_STALE_TTL", "3600"))
+# Сколько раз повторить загрузку, если во время нее данные снова объявили устаревшими
+ROSTER_CACHE_MAX_REFETCH = 3
+
+
+class RosterCache:
+    """Общий на процесс кэш сотрудников (stale-while-revalidate)"""
+
+    def __init__(self, loader: Callable[[], Awaitable[Any]],
+                 ttl: float = ROSTER_CACHE_TTL, stale_ttl: float = ROSTER_CACHE_STALE_TTL,
+                 stream_loader: Optional[Callable[[], AsyncIterator[Dict]]] = None,
+                 snapshot=None):
+        """
+        Args:
+            loader: Корутина загрузки, возвращает список сотрудников
+                    или dict с ключом 'error' / None при ошибке
+            ttl: Время свежести данных (секунды)
+            stale_ttl: Окно, в течение которого устаревшие данные отдаются с фоновым обновлением
+            stream_loader: Асинхронный генератор сотрудников для iter_employees()
+            snapshot: Локальный снимок (RosterSnapshot): из него кэш заполняется при старте
+                      и в него сохраняется после каждой загрузки
+        """
+        self.loader = loader
+        self.stream_loader = stream_loader
+        self.snapshot = snapshot
+        self._snapshot_loaded = False
+        self._persist_task: Optional[asyncio.Task] = None
+        self._persist_pending = False
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.version = 0
+        self._data: Optional[List[Dict]] = None
+        self._loaded_at: Optional[float] = None
+        self._invalidated = False
+        # Поколение данных: растет при invalidate(); загрузка, начатая в старом поколении, не сохраняется
+        self.generation = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "invalidations": 0,
+            "dropped_loads": 0,
+            "snapshot_loads": 0
+        }
+
+    def _age(self) -> Optional[float]:
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    async def get(self):
+        """
+        Получить список сотрудников
+
+        Returns:
+            list: Сотрудники, либо результат loader при ошибке без данных в кэше
+        """
+        if not self._snapshot_loaded:
+            await self.warm_up()
+
+        age = self._age()
+        if self._data is not None and not self._invalidated and age is not None:
+            if age < self.ttl:
+                self._stats["hits"] += 1
+                return self._data
+            if age < self.ttl + self.stale_ttl:
+                self._stats["stale_hits"] += 1
+                self._schedule_refresh()
+                return self._data
+
+        self._stats["misses"] += 1
+        return await self._load()
+
+    async def _load(self):
+        """Синхронная (для вызывающего) загрузка с защитой от параллельных загрузок"""
+        async with self._lock:
+            # Пока ждали блокировку, данные мог загрузить другой вызов
+            age = self._age()
+            if self._data is not None and not self._invalidated and age is not None and age < self.ttl:
+                return self._data
+            return await self._fetch()
+
+    async def warm_up(self):
+        """
+        Заполнить кэш из локального снимка (один раз, при старте). Данные снимка
+        считаются устаревшими: они сразу отдаются, а в фоне идет синхронизация с CRM.
+        """
+        if self._snapshot_loaded:
+            return
+        self._snapshot_loaded = True
+        if self.snapshot is None or self._data is not None:
+            return
+        try:
+            employees = await asyncio.to_thread(self.snapshot.load)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки снимка сотрудников: {e}")
+            return
+        if employees is None or self._data is not None:
+            return
+
+        self._data = employees
+        self._loaded_at = time.monotonic() - self.ttl
+        self.version += 1
+        self._stats["snapshot_loads"] += 1
+        self._schedule_refresh()
+
+    def _store(self, employees: List[Dict]):
+        self._data = employees
+        self._loaded_at = time.monotonic()
+        self._invalidated = False
+        self.version += 1
+        logger.info(f"Кэш сотрудников обновлен: {len(employees)} записей (версия {self.version})")
+        if self.snapshot is not None:
+            self._schedule_persist()
+
+    def _schedule_persist(self):
+        """Сохранить актуальные данные в снимок в фоне (запись в отдельном потоке)"""
+        if self._persist_task and not self._persist_task.done():
+            # Предыдущая запись еще идет - после нее сохранятся самые свежие данные
+            self._persist_pending = True
+            return
+        self._persist_pending = False
+        self._persist_task = asyncio.create_task(self._persist())
+
+    async def _persist(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.snapshot.save_changes, self._data)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения снимка сотрудников: {e}")
+            if not self._persist_pending:
+                break
+            self._persist_pending = False
+
+    async def _fetch(self):
+        for attempt in range(ROSTER_CACHE_MAX_REFETCH):
+            generation = self.generation
+            try:
+                result = await self.loader()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки сотрудников в кэш: {e}")
+                result = None
+            # Во время загрузки сотрудника добавили или изменили - ответ CRM мог его еще не содержать
+            if not isinstance(result, list) or generation == self.generation:
+                break
+            self._stats["dropped_loads"] += 1
+            logger.info("Кэш сотрудников устарел во время загрузки, загружаем заново")
+
+        if isinstance(result, list):
+            if generation == self.generation:
+                self._store(result)
+            return result
+
+        self._stats["errors"] += 1
+        if self._data is not None:
+            logger.warning("Не удалось обновить кэш сотрудников, отдаем устаревшие данные")
+            return self._data
+        return result
+
+    async def iter_employees(self) -> AsyncIterator[Dict]:
+        """
+        Перебрать сотрудников: из кэша, а если его нет - потоком по мере загрузки
+        страниц (обработка начинается до окончания загрузки). Полностью
+        полученный поток сохраняется в кэш.
+        """
+        if not self._snapshot_loaded:
+            await self.warm_up()
+
+        age = self._age()
+        has_data = self._data is not None and not self._invalidated and age is not None
+        if self.stream_loader is None or (has_data and age < self.ttl + self.stale_ttl):
+            employees = await self.get()
+            if isinstance(employees, list):
+                for employee in employees:
+                    yield employee
+            return
+
+        self._stats["misses"] += 1
+        generation = self.generation
+        collected = []
+        async for employee in self.stream_loader():
+            collected.append(employee)
+            yield employee
+
+        if generation == self.generation:
+            self._store(collected)
+        else:
+            self._stats["dropped_loads"] += 1
+
+    def _schedule_refresh(self):
+        """Запустить фоновое обновление, если оно еще не идет"""
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        self._stats["refreshes"] += 1
+        async with self._lock:
+            age = self._age()
+            if age is not None and age < self.ttl and not self._invalidated:
+                return
+            await self._fetch()
+
+    def invalidate(self):
+        """
+        Пометить данные как устаревшие: следующий get() загрузит их заново,
+        а уже идущая загрузка (начатая до записи в CRM) не попадет в кэш
+        """
+        self._invalidated = True
+        self.generation += 1
+        self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий/промахов и состояние кэша"""
+        total = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+        hit_rate = (self._stats["hits"] + self._stats["stale_hits"]) / total * 100 if total else 0
+        age = self._age()
+        return {
+            **self._stats,
+            "hit_rate": hit_rate,
+            "size": len(self._data) if self._data is not None else 0,
+            "age": age,
+            "version": self.version
+        }
@@ -0,0 +1,136 @@
+"""
+Локальный снимок списка сотрудников в SQLite (для быстрого старта и работы при недоступной CRM)
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу снимка. В снимке - полные записи сотрудников (СНИЛС, телефоны, даты рождения),
+# поэтому по умолчанию он выключен (пустая строка); включается явно, например data/roster_snapshot.db
+ROSTER_SNAPSHOT_PATH = os.getenv("ROSTER_SNAPSHOT_PATH", "")
+
+
+def record_key(employee: Dict) -> str:
+    """Ключ записи: id сотрудника, а если его нет - хэш содержимого"""
+    if employee.get("id") is not None:
+        return str(employee["id"])
+    return "hash:" + content_hash(employee)
+
+
+def content_hash(employee: Dict) -> str:
+    """Хэш содержимого записи (не зависит от порядка ключей)"""
+    payload = json.dumps(employee, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class RosterSnapshot:
+    """
+    Снимок сотрудников: загрузка при старте и сохранение только изменившихся записей (по хэшам).
+    Экономит запись на диск, а не запросы к CRM: список сотрудников по-прежнему загружается целиком
+    """
+
+    def __init__(self, path: str = ROSTER_SNAPSHOT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(self.path)
+        conn = sqlite3.connect(self.path)
+        if is_new:
+            # Персональные данные: файл доступен только владельцу
+            os.chmod(self.path, 0o600)
+        if not self._initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS people (
+                    key TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def load(self) -> Optional[List[Dict]]:
+        """
+        Загрузить снимок
+
+        Returns:
+            list: Сотрудники или None, если снимка еще нет
+        """
+        if not os.path.exists(self.path):
+            return None
+        with self._lock:
+            conn = self._connect()
+            try:
+                synced_at = conn.execute("SELECT value FROM meta WHERE key = 'synced_at'").fetchone()
+                if not synced_at:
+                    return None
+                rows = conn.execute("SELECT payload FROM people ORDER BY rowid").fetchall()
+            finally:
+                conn.close()
+        employees = [json.loads(payload) for (payload,) in rows]
+        age = time.time() - float(synced_at[0])
+        logger.info(f"Снимок сотрудников загружен: {len(employees)} записей, возраст {age:.0f} с")
+        return employees
+
+    def save_changes(self, employees: List[Dict]) -> Dict[str, int]:
+        """
+        Привести снимок к полному списку, загруженному из CRM: на диск пишутся только изменившиеся записи
+
+        Returns:
+            dict: Количество добавленных, измененных, удаленных и неизменных записей
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                stored = dict(conn.execute("SELECT key, content_hash FROM people"))
+                delta = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+                upserts = []
+                seen = set()
+
+                for employee in employees:
+                    key = record_key(employee)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    new_hash = content_hash(employee)
+                    old_hash = stored.get(key)
+                    if old_hash == new_hash:
+                        delta["unchanged"] += 1
+                        continue
+                    delta["added" if old_hash is None else "updated"] += 1
+                    upserts.append((key, new_hash, json.dumps(employee, ensure_ascii=False)))
+
+                removed = [(key,) for key in stored if key not in seen]
+                delta["removed"] = len(removed)
+
+                # UPSERT сохраняет rowid, а значит и порядок записей
+                conn.executemany(
+                    "INSERT INTO people (key, content_hash, payload) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET content_hash = excluded.content_hash, payload = excluded.payload",
+                    upserts
+                )
+                conn.executemany("DELETE FROM people WHERE key = ?", removed)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)", (str(time.time()),))
+                conn.commit()
+            finally:
+                conn.close()
+
+        logger.info(
+            f"Снимок сотрудников сохранен: +{delta['added']} ~{delta['updated']} "
+            f"-{delta['removed']} (без изменений {delta['unchanged']})"
+        )
+        return delta
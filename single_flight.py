@@ -0,0 +1,62 @@
+"""
+Объединение одновременных одинаковых запросов (single-flight)
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Одновременные вызовы с одинаковым ключом разделяют один выполняющийся запрос
+    и его результат (или исключение)
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._stats = {
+            "calls": 0,       # всего вызовов
+            "executions": 0,  # реально выполненных запросов
+            "shared": 0       # вызовов, получивших результат чужого запроса
+        }
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить func() или присоединиться к уже выполняющемуся вызову с тем же ключом
+
+        Args:
+            key: Ключ ресурса (например, ("people_get", 42))
+            func: Функция без аргументов, возвращающая корутину
+        """
+        self._stats["calls"] += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            self._stats["executions"] += 1
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self._stats["shared"] += 1
+            logger.debug(f"Запрос {key} уже выполняется, ждем его результат")
+
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            # Исключение уже получили ожидающие; помечаем его обработанным,
+            # если все ожидающие были отменены
+            future.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики подавленных дубликатов"""
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "in_flight": len(self._in_flight),
+            "saved_rate": self._stats["shared"] / calls * 100 if calls else 0
+        }
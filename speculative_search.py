@@ -0,0 +1,106 @@
+"""
+Спекулятивный поиск сотрудника: пока ИИ определяет намерение, поиск по ФИО из сообщения
+уже выполняется. Если намерение - поиск того же сотрудника, готовый ответ используется сразу,
+иначе поиск отменяется
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from ceo_dispatcher import handle_search_request
+from intent_classifier import classify_intent, detect_name, INTENT_RULES_THRESHOLD
+from metrics_server import register_collector
+from name_index import NameIndex, SCORE_SUBSTRING
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_SEARCH_ENABLED = os.getenv("SPECULATIVE_SEARCH", "1") == "1"
+# Минимальная похожесть на ФИО, при которой поиск запускается заранее
+SPECULATIVE_SEARCH_MIN_SCORE = float(os.getenv("SPECULATIVE_SEARCH_MIN_SCORE", "0.5"))
+
+speculation_stats = Counter()
+
+
+class SpeculativeSearch:
+    """Поиск сотрудника, запущенный до того, как известно намерение"""
+
+    def __init__(self, employee_name: str):
+        self.employee_name = employee_name
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.task = asyncio.ensure_future(handle_search_request(employee_name))
+        self.task.add_done_callback(self._on_done)
+        self.settled = False
+        speculation_stats["started"] += 1
+
+    def _on_done(self, task: asyncio.Future):
+        self.finished_at = time.monotonic()
+
+    @classmethod
+    def start(cls, message_text: str, chat_history: Optional[List] = None) -> Optional["SpeculativeSearch"]:
+        """
+        Запустить поиск, если намерение решит ИИ (правила не уверены), а в сообщении похоже есть ФИО
+
+        Returns:
+            SpeculativeSearch или None, если поиск заранее не нужен
+        """
+        if not SPECULATIVE_SEARCH_ENABLED:
+            return None
+        rules_result = classify_intent(message_text, chat_history)
+        # Уверенные правила отвечают без ИИ - скрывать нечего; данные сотрудника - скорее всего заявка
+        if rules_result["confidence"] >= INTENT_RULES_THRESHOLD or rules_result["intent"] == "create_order":
+            return None
+        guess = detect_name(message_text)
+        if not guess["name"] or guess["score"] < SPECULATIVE_SEARCH_MIN_SCORE:
+            return None
+        logger.info(f"Спекулятивный поиск: {guess['name']} (похожесть на ФИО {guess['score']})")
+        return cls(guess["name"])
+
+    def matches(self, employee_name: str) -> bool:
+        """
+        Ищем того же сотрудника, которого определил ИИ. ФИО сравниваются индексом ФИО с тем же порогом,
+        что и при поиске (не ниже вхождения запроса в ФИО), в обе стороны: ИИ приводит ФИО
+        к именительному падежу ("Петрову" -> "Петров"), а в поиске могло остаться полное ФИО
+        """
+        if not employee_name:
+            return False
+        pairs = ((self.employee_name, employee_name), (employee_name, self.employee_name))
+        return any(NameIndex([{"full_name": indexed}]).search(query, limit=1, min_score=SCORE_SUBSTRING)
+                   for indexed, query in pairs)
+
+    async def result(self) -> str:
+        """Использовать результат поиска (ответ для пользователя)"""
+        self.settled = True
+        committed_at = time.monotonic()
+        speculation_stats["committed"] += 1
+        if self.task.done():
+            speculation_stats["ready_before_intent"] += 1
+        response = await self.task
+        # Выигрыш - часть поиска, выполненная параллельно с определением намерения
+        speculation_stats["saved_ms"] += int((min(self.finished_at or committed_at, committed_at) - self.started_at) * 1000)
+        return response
+
+    def discard(self):
+        """Намерение не поиск или другой сотрудник - поиск отменяется"""
+        if self.settled:
+            return
+        self.settled = True
+        speculation_stats["discarded"] += 1
+        if not self.task.done():
+            self.task.cancel()
+
+
+def speculation_stats_snapshot() -> Dict[str, Any]:
+    """Сколько спекулятивных поисков пригодилось"""
+    started = speculation_stats["started"]
+    return {
+        **speculation_stats,
+        "enabled": SPECULATIVE_SEARCH_ENABLED,
+        "commit_rate": speculation_stats["committed"] / started * 100 if started else 0,
+    }
+
+
+register_collector("speculative_search", speculation_stats_snapshot)
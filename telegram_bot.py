@@ -9,13 +9,26 @@ from telebot.types import Message
 import requests
 from dotenv import load_dotenv
 
-from validate import makeOrderformat, validateOrder
-from api import search_employees, addPeople, UpdatePeople
+from validate import extractOrder
+from api import search_employees, addPeople, UpdatePeople, roster_cache
 from notification_types import NotificationType
 from notification_storage import NotificationStorage
 from notification_scheduler import NotificationScheduler
 from generateDocx import create_tetracom_document
-from ceo_dispatcher import ceo_dispatcher, handle_search_request
+from ceo_dispatcher import ceo_dispatcher, handle_search_request, stream_unclear_reply, UNCLEAR_HELP_TEXT
+from ai_request import stream_stats, format_stream_stats
+from telegram_stream import stream_reply, reply_with_placeholder
+from speculative_search import SpeculativeSearch
+from intent_classifier import is_only_name, has_additional_data
+from chat_context import ChatContext
+from crm_client import close_crm_client
+from llm_clients import llm_clients
+from crm_metrics import crm_metrics, format_snapshot
+from metrics_server import start_metrics_server, register_collector
+from provider_health import provider_health, format_health
+from provider_limits import provider_limits, format_limits
+from llm_ledger import llm_ledger, format_report
+from message_coalescer import MessageCoalescer
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -27,12 +40,22 @@ logger = logging.getLogger(__name__)
 # Создаем бота
 bot = AsyncTeleBot(os.getenv("TELEGRAM_BOT_TOKEN"))
 
-# Словарь для хранения истории чата каждого пользователя
+# Словарь для хранения истории чата каждого пользователя (ChatContext - ограниченная по токенам история)
 user_chat_histories = {}
 
 # Словарь для хранения фото из заявок пользователей
 user_photos = {}
 
+# Администраторы (через запятую); если не заданы - служебные команды доступны всем
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+# Заглушка, которая заменяется результатом поиска
+SEARCH_PLACEHOLDER = "🔍 Ищу сотрудника..."
+
+def is_admin(user_id) -> bool:
+    """Проверить, доступны ли пользователю служебные команды (без ADMIN_USER_IDS - никому)"""
+    return str(user_id) in ADMIN_USER_IDS
+
 # Инициализация системы уведомлений
 notification_storage = NotificationStorage()
 notification_scheduler = None
@@ -41,58 +64,31 @@ async def process_order(user_id: int, message_text: str):
     """Обрабатывает заказ пользователя"""
     try:
         # Получаем историю чата пользователя
-        chat_history = user_chat_histories.get(user_id, [])
+        chat_history = user_chat_histories.setdefault(user_id, ChatContext())
         
-        # Валидируем заказ
-        validation_result = await validateOrder(message_text, chat_history)
+        # Разбираем заказ одним запросом: данные сотрудника + недостающие поля
+        extraction = await extractOrder(message_text, chat_history)
+        
+        if extraction.get("error") == "extraction_failed":
+            return f"❌ Не удалось разобрать заказ: {extraction.get('message')}\n\nПопробуйте отправить данные еще раз."
+        
+        # Найденные поля сохраняются отдельно от сообщений - старые сообщения можно отбрасывать
+        chat_history.update_fields(extraction.get("employee", {}))
         
-        # Парсим JSON ответ
-        try:
-            if isinstance(validation_result, str):
-                # Убираем markdown блоки если есть
-                json_str = validation_result.strip()
-                if json_str.startswith('```json'):
-                    json_str = json_str[7:]  # Убираем ```json
-                if json_str.endswith('```'):
-                    json_str = json_str[:-3]  # Убираем ```
-                json_str = json_str.strip()
-                
-                order_data = json.loads(json_str)
-            else:
-                order_data = validation_result
-        except json.JSONDecodeError as e:
-            return f"❌ Ошибка парсинга JSON: {e}\n📋 Исходный ответ: {validation_result}"
-            
         # Проверяем, есть ли ошибки в данных
-        if order_data.get("error") == "missing_data":
+        if extraction.get("error") == "missing_data":
             # Добавляем сообщение пользователя в историю для следующей итерации
             chat_history.append({"role": "user", "content": message_text})
+            chat_history.append({"role": "assistant", "content": extraction.get("message")})
             user_chat_histories[user_id] = chat_history
-            return f"❌ Не хватает данных: {order_data.get('message')}\n\nПожалуйста, уточните недостающие данные."
+            return f"❌ Не хватает данных: {extraction.get('message')}\n\nПожалуйста, уточните недостающие данные."
         
         # Добавляем сообщение пользователя в историю
         chat_history.append({"role": "user", "content": message_text})
-        chat_history.append({"role": "assistant", "content": str(order_data)})
-        
-        # Форматируем заказ
-        order_json = await makeOrderformat(message_text, chat_history)
+        chat_history.append({"role": "assistant", "content": extraction.get("message")})
         
-        # Парсим JSON ответ от makeOrderformat
-        try:
-            if isinstance(order_json, str):
-                # Убираем markdown блоки если есть
-                json_str = order_json.strip()
-                if json_str.startswith('```json'):
-                    json_str = json_str[7:]  # Убираем ```json
-                if json_str.endswith('```'):
-                    json_str = json_str[:-3]  # Убираем ```
-                json_str = json_str.strip()
-                
-                order_data = json.loads(json_str)
-            else:
-                order_data = order_json
-        except json.JSONDecodeError as e:
-            return f"❌ Ошибка парсинга JSON заказа: {e}\n📋 Исходный ответ: {order_json}"
+        order_data = dict(extraction["employee"])
+        warnings = extraction.get("warnings", [])
             
         # Проверяем, существует ли сотрудник
         existing_employee = await search_employees(order_data.get("full_name"))
@@ -162,7 +158,7 @@ async def process_order(user_id: int, message_text: str):
                 response_text = f"❌ <b>Ошибка добавления:</b> {error_msg}"
         
         # Добавляем результат в историю
-        chat_history.append({"role": "assistant", "content": str(result)})
+        chat_history.append({"role": "assistant", "content": result})
         
         # Отправляем уведомления
         if result and result.get("success"):
@@ -248,7 +244,10 @@ async def process_order(user_id: int, message_text: str):
                         )
         
         # Очищаем историю чата после успешного завершения
-        user_chat_histories[user_id] = []
+        user_chat_histories[user_id] = ChatContext()
+        
+        if warnings:
+            response_text += "\n" + "\n".join(f"⚠️ {warning}" for warning in warnings)
         
         return response_text
         
@@ -319,7 +318,8 @@ async def help_command(message: Message):
 async def clear_command(message: Message):
     """Обработчик команды /clear"""
     user_id = message.from_user.id
-    user_chat_histories[user_id] = []
+    message_coalescer.discard(user_id)
+    user_chat_histories[user_id] = ChatContext()
     await bot.reply_to(message, "🧹 История чата очищена. Можете начать новый заказ.")
 
 @bot.message_handler(commands=['notifications'])
@@ -422,6 +422,56 @@ async def stats_command(message: Message):
     
     await bot.reply_to(message, response, parse_mode='HTML')
 
+@bot.message_handler(commands=['crm_stats'])
+async def crm_stats_command(message: Message):
+    """Метрики запросов к CRM (для администраторов)"""
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "⛔ Команда доступна только администраторам")
+        return
+    
+    await bot.reply_to(message, format_snapshot(crm_metrics.snapshot()), parse_mode='HTML')
+
+@bot.message_handler(commands=['llm_health'])
+async def llm_health_command(message: Message):
+    """Состояние провайдеров ИИ (для администраторов)"""
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "⛔ Команда доступна только администраторам")
+        return
+    
+    response = "\n\n".join([
+        format_health(provider_health.snapshot()),
+        format_limits(provider_limits.snapshot()),
+        format_stream_stats(stream_stats.snapshot()),
+    ])
+    await bot.reply_to(message, response, parse_mode='HTML')
+
+@bot.message_handler(commands=['llm_report'])
+async def llm_report_command(message: Message):
+    """Расход токенов, стоимость и задержка запросов к ИИ по задачам (для администраторов)"""
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, "⛔ Команда доступна только администраторам")
+        return
+    
+    # /llm_report 6 - за последние 6 часов (по умолчанию за сутки)
+    parts = message.text.split()
+    try:
+        hours = float(parts[1]) if len(parts) > 1 else 24
+    except ValueError:
+        await bot.reply_to(message, "Использование: /llm_report [часов]")
+        return
+    
+    report = await llm_ledger.report(hours)
+    await bot.reply_to(message, format_report(report, hours), parse_mode='HTML')
+
+async def reply_with_search(message: Message, employee_name: str, speculative=None):
+    """Ответ с результатом поиска; заранее начатый поиск используется, если искали того же сотрудника"""
+    if speculative and speculative.matches(employee_name):
+        logger.info(f"Используем спекулятивный поиск для: {employee_name}")
+        search = speculative.result()
+    else:
+        search = handle_search_request(employee_name)
+    await reply_with_placeholder(bot, message, SEARCH_PLACEHOLDER, search)
+
 @bot.message_handler(content_types=['text', 'photo'])
 async def handle_message(message: Message):
     """Обработчик текстовых сообщений и сообщений с фото"""
@@ -454,100 +504,102 @@ async def handle_message(message: Message):
     # Показываем, что бот печатает
     await bot.send_chat_action(message.chat.id, 'typing')
     
+    # Части заказа, присланные подряд, обрабатываются вместе после короткой паузы (MESSAGE_COALESCE_WINDOW)
+    await message_coalescer.add(user_id, message, message_text)
+
+def is_order_part(message_text: str) -> bool:
+    """Сообщение похоже на часть заказа (ФИО или данные сотрудника) - стоит подождать продолжения"""
+    return has_additional_data(message_text) or is_only_name(message_text)
+
+async def reply_with_error(message: Message, error: Exception):
+    """Ответ пользователю, если обработка сообщения завершилась ошибкой"""
+    await bot.reply_to(message, f"❌ Произошла ошибка при обработке сообщения: {error}\n\nПопробуйте еще раз.")
+
+async def process_message(message: Message, message_text: str):
+    """Обработка сообщения (или нескольких объединенных сообщений пользователя)"""
+    user_id = message.from_user.id
+    
+    if message_coalescer.window:
+        await bot.send_chat_action(message.chat.id, 'typing')
+    
     # Получаем историю чата для этого пользователя
-    chat_history = user_chat_histories.get(user_id, [])
+    chat_history = user_chat_histories.setdefault(user_id, ChatContext())
+    
+    # Пока ИИ определяет намерение, поиск по ФИО из сообщения уже идет
+    speculative = SpeculativeSearch.start(message_text, chat_history)
     
     # Определяем намерение пользователя через CEO диспетчер
     logger.info(f"Определяем намерение для сообщения: {message_text[:50]}...")
-    ceo_result = await ceo_dispatcher(message_text, chat_history)
+    try:
+        ceo_result = await ceo_dispatcher(message_text, chat_history)
     
-    if ceo_result.get("type") == "error":
-        response = ceo_result.get("message", "❌ Ошибка определения намерения")
-    else:
-        intent = ceo_result.get("intent")
-        confidence = ceo_result.get("confidence", 0.5)
-        employee_name = ceo_result.get("employee_name", "")
-        
-        logger.info(f"CEO результат: {ceo_result}")
-        logger.info(f"Намерение: {intent}, уверенность: {confidence}, сотрудник: {employee_name}")
+        if ceo_result.get("type") == "error":
+            response = ceo_result.get("message", "❌ Ошибка определения намерения")
+        else:
+            intent = ceo_result.get("intent")
+            confidence = ceo_result.get("confidence", 0.5)
+            employee_name = ceo_result.get("employee_name", "")
         
-        # Дополнительная проверка: если сообщение содержит только ФИО (без дополнительных данных), 
-        # принудительно направляем на поиск
-        message_lower = message_text.lower().strip()
-        words = message_lower.split()
+            logger.info(f"CEO результат: {ceo_result}")
+            logger.info(f"Намерение: {intent}, уверенность: {confidence}, сотрудник: {employee_name}")
         
-        # Проверяем, содержит ли сообщение только ФИО (2-4 слова, без цифр, без ключевых слов)
-        is_only_name = (
-            len(words) >= 2 and len(words) <= 4 and  # 2-4 слова (ФИО)
-            not any(char.isdigit() for char in message_text) and  # нет цифр
-            not any(keyword in message_lower for keyword in [
-                'монтажник', 'менеджер', 'инженер', 'рабочий', 'мастер', 'начальник',
-                '+7', '8-', 'телефон', 'тел', 'моб', 'снилс', 'инн', 'дата', 'рождения',
-                'обучить', 'заявка', 'создать', 'нужно', 'требуется', 'покажи', 'найди'
-            ])
-        )
+            # Дополнительная проверка: если сообщение содержит только ФИО (без дополнительных данных), 
+            # принудительно направляем на поиск
+            only_name = is_only_name(message_text)
         
-        if is_only_name:
-            logger.info(f"Сообщение содержит только ФИО, принудительно направляем на поиск: {employee_name}")
-            print(f"🔍 Вызываем handle_search_request для: {employee_name}")
-            response = await handle_search_request(employee_name)
-            print(f"🔍 Результат handle_search_request: {response[:100]}...")
-        else:
-            if intent == "search_info":
-                # Пользователь хочет просто посмотреть информацию
-                logger.info(f"Обрабатываем запрос на поиск информации для: {employee_name}")
+            if only_name:
+                logger.info(f"Сообщение содержит только ФИО, принудительно направляем на поиск: {employee_name}")
                 print(f"🔍 Вызываем handle_search_request для: {employee_name}")
-                response = await handle_search_request(employee_name)
-                print(f"🔍 Результат handle_search_request: {response[:100]}...")
+                await reply_with_search(message, employee_name, speculative)
+                return
+            else:
+                if intent == "search_info":
+                    # Пользователь хочет просто посмотреть информацию
+                    logger.info(f"Обрабатываем запрос на поиск информации для: {employee_name}")
+                    print(f"🔍 Вызываем handle_search_request для: {employee_name}")
+                    await reply_with_search(message, employee_name, speculative)
+                    return
                 
-            elif intent == "create_order":
-                # Проверяем, есть ли в сообщении дополнительные данные кроме ФИО
-                has_additional_data = any(keyword in message_lower for keyword in [
-                    'монтажник', 'менеджер', 'инженер', 'рабочий', 'мастер', 'начальник',  # должности
-                    '+7', '8-', 'телефон', 'тел', 'моб',  # телефоны
-                    'снилс', 'инн', 'дата', 'рождения', 'год',  # документы
-                    'обучить', 'заявка', 'создать', 'нужно', 'требуется'  # просьбы об обучении
-                ])
+                elif intent == "create_order":
+                    # Проверяем, есть ли в сообщении дополнительные данные кроме ФИО
+                    additional_data = has_additional_data(message_text)
                 
-                if not has_additional_data and confidence < 0.8:
-                    # Если нет дополнительных данных и низкая уверенность, перенаправляем на поиск
-                    logger.info(f"CEO определил как create_order, но нет дополнительных данных. Перенаправляем на поиск: {employee_name}")
-                    response = await handle_search_request(employee_name)
-                else:
-                    # Пользователь хочет создать заявку на обучение
-                    logger.info(f"Обрабатываем запрос на создание заявки для: {employee_name}")
-                    if chat_history:
-                        await bot.reply_to(message, f"📝 Продолжаю обработку заказа... (сообщений в истории: {len(chat_history)})")
-                    response = await process_order(user_id, message_text)
+                    if not additional_data and confidence < 0.8:
+                        # Если нет дополнительных данных и низкая уверенность, перенаправляем на поиск
+                        logger.info(f"CEO определил как create_order, но нет дополнительных данных. Перенаправляем на поиск: {employee_name}")
+                        await reply_with_search(message, employee_name, speculative)
+                        return
+                    else:
+                        # Пользователь хочет создать заявку на обучение
+                        logger.info(f"Обрабатываем запрос на создание заявки для: {employee_name}")
+                        if chat_history:
+                            await bot.reply_to(message, f"📝 Продолжаю обработку заказа... (сообщений в истории: {len(chat_history)})")
+                        response = await process_order(user_id, message_text)
                 
-            elif intent == "unclear":
-                # Намерение неясно, просим уточнить
-                response = """🤔 <b>Не понял ваше намерение</b>
-
-Пожалуйста, уточните, что вы хотите:
-
-📋 <b>Создать заявку на обучение:</b>
-• "Иванов Иван, монтажник, нужно обучить на высоту"
-• "Создай заявку для Петрова на ПБО"
-
-🔍 <b>Посмотреть информацию:</b>
-• "Иванов Иван"
-• "Покажи информацию о Петрове"
-• "Найди Сидорова"
-
-Или используйте команды:
-/help - помощь
-/start - начать заново"""
-            else:
-                # Неизвестное намерение
-                response = "❌ Не удалось определить ваше намерение. Попробуйте еще раз или используйте /help"
+                elif intent == "unclear":
+                    # Намерение неясно: ИИ отвечает свободным текстом, ответ появляется по мере генерации
+                    await stream_reply(bot, message, stream_unclear_reply(message_text, chat_history),
+                                       fallback_text=UNCLEAR_HELP_TEXT)
+                    return
+                else:
+                    # Неизвестное намерение
+                    response = "❌ Не удалось определить ваше намерение. Попробуйте еще раз или используйте /help"
     
-    # Отправляем ответ с HTML разметкой
-    await bot.reply_to(message, response, parse_mode='HTML')
+        # Отправляем ответ с HTML разметкой
+        await bot.reply_to(message, response, parse_mode='HTML')
+    finally:
+        # Намерение не поиск того же сотрудника - заранее начатый поиск не нужен
+        if speculative:
+            speculative.discard()
+
+# Сообщения пользователя обрабатываются по очереди, части заказа - одним сообщением
+message_coalescer = MessageCoalescer(process_message, should_buffer=is_order_part, on_error=reply_with_error)
+register_collector("message_coalescing", message_coalescer.snapshot)
 
 async def main():
     """Основная функция запуска бота"""
     global notification_scheduler
+    metrics_runner = None
     
     logger.info("Запуск Telegram бота...")
     
@@ -564,6 +616,12 @@ async def main():
         bot_info = await bot.get_me()
         logger.info(f"Бот запущен: @{bot_info.username} ({bot_info.first_name})")
         
+        # Эндпоинт метрик (если задан METRICS_PORT)
+        metrics_runner = await start_metrics_server()
+        
+        # Загружаем локальный снимок сотрудников, синхронизация с CRM пойдет в фоне
+        await roster_cache.warm_up()
+        
         # Инициализируем планировщик уведомлений
         notification_scheduler = NotificationScheduler(bot, notification_storage)
         await notification_scheduler.start()
@@ -578,6 +636,11 @@ async def main():
         # Останавливаем планировщик при завершении
         if notification_scheduler:
             await notification_scheduler.stop()
+        # Закрываем пулы соединений CRM и провайдеров ИИ
+        await close_crm_client()
+        await llm_clients.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,132 @@
+"""
+Постепенный вывод ответа в Telegram: сообщение-заглушка редактируется по мере поступления текста
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между редактированиями одного сообщения (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Минимальный прирост текста для промежуточного редактирования
+STREAM_MIN_DELTA = int(os.getenv("STREAM_MIN_DELTA", "20"))
+# Максимальная длина сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Сколько раз повторять итоговое редактирование после 429, прежде чем отправить ответ новым сообщением
+STREAM_FINAL_EDIT_ATTEMPTS = int(os.getenv("STREAM_FINAL_EDIT_ATTEMPTS", "3"))
+# Дольше этого (секунды) ответ пользователю не ждет: отправляется новым сообщением
+STREAM_MAX_RETRY_AFTER = float(os.getenv("STREAM_MAX_RETRY_AFTER", "10"))
+
+
+async def _edit(bot, placeholder: Message, text: str, parse_mode: Optional[str] = None) -> Optional[float]:
+    """
+    Отредактировать сообщение
+
+    Returns:
+        float: Пауза, которую просит Telegram (429), иначе None
+    """
+    try:
+        await bot.edit_message_text(text, placeholder.chat.id, placeholder.message_id, parse_mode=parse_mode)
+    except ApiTelegramException as e:
+        if e.error_code == 429:
+            return float((e.result_json or {}).get("parameters", {}).get("retry_after", 1))
+        if "message is not modified" in str(e.description):
+            return None
+        if parse_mode:
+            # Некорректная разметка - показываем текст без нее (пауза 429 возвращается вызывающему)
+            logger.warning(f"Не удалось отправить HTML, отправляем текстом: {e}")
+            return await _edit(bot, placeholder, text)
+        raise
+    return None
+
+
+async def _edit_final(bot, message: Message, placeholder: Message, text: str, parse_mode: Optional[str]):
+    """
+    Итоговое редактирование: после 429 повторяется через retry_after; если Telegram так и не
+    принял правку - ответ отправляется новым сообщением, чтобы пользователь не остался с "▌"
+    """
+    for attempt in range(STREAM_FINAL_EDIT_ATTEMPTS):
+        retry_after = await _edit(bot, placeholder, text, parse_mode)
+        if retry_after is None:
+            return
+        if retry_after > STREAM_MAX_RETRY_AFTER or attempt == STREAM_FINAL_EDIT_ATTEMPTS - 1:
+            break
+        logger.warning(f"Telegram ограничил редактирование, повтор через {retry_after:g} с")
+        await asyncio.sleep(retry_after)
+
+    logger.warning("Итоговое редактирование не принято, ответ отправляется новым сообщением")
+    try:
+        await bot.reply_to(message, text, parse_mode=parse_mode)
+    except ApiTelegramException as e:
+        if not parse_mode or e.error_code == 429:
+            raise
+        await bot.reply_to(message, text)
+
+
+async def stream_reply(bot, message: Message, chunks: AsyncIterator[str],
+                       placeholder_text: str = "⏳ Думаю...", parse_mode: Optional[str] = "HTML",
+                       fallback_text: Optional[str] = None) -> str:
+    """
+    Отправить заглушку и постепенно заменять ее текстом из потока
+
+    Промежуточные версии отправляются без разметки (незакрытые теги ломают HTML),
+    итоговая - с parse_mode.
+
+    Args:
+        bot: AsyncTeleBot
+        message: Сообщение пользователя, на которое отвечаем
+        chunks: Асинхронный поток фрагментов текста
+        placeholder_text: Текст заглушки
+        parse_mode: Разметка итогового сообщения
+        fallback_text: Текст, если поток ничего не вернул
+
+    Returns:
+        str: Итоговый текст
+    """
+    started = time.monotonic()
+    placeholder = await bot.reply_to(message, placeholder_text)
+
+    text = ""
+    shown = ""
+    next_edit_at = 0.0
+    first_content = None
+    async for chunk in chunks:
+        text += chunk
+        if first_content is None:
+            first_content = time.monotonic() - started
+        now = time.monotonic()
+        if now >= next_edit_at and len(text) - len(shown) >= STREAM_MIN_DELTA and len(text) < TELEGRAM_MESSAGE_LIMIT:
+            retry_after = await _edit(bot, placeholder, text + " ▌")
+            shown = text
+            next_edit_at = now + max(STREAM_EDIT_INTERVAL, retry_after or 0)
+
+    text = text.strip() or fallback_text or "❌ Не удалось получить ответ"
+    # Длинный ответ: первая часть - в заглушке, остальное - новыми сообщениями
+    parts = [text[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)]
+    await _edit_final(bot, message, placeholder, parts[0], parse_mode)
+    for part in parts[1:]:
+        await bot.send_message(message.chat.id, part, parse_mode=parse_mode)
+
+    logger.info(
+        f"Потоковый ответ: первый текст через {first_content or 0:.2f} с, "
+        f"всего {time.monotonic() - started:.2f} с, {len(text)} символов"
+    )
+    return text
+
+
+async def reply_with_placeholder(bot, message: Message, placeholder_text: str, result_coro,
+                                 parse_mode: Optional[str] = "HTML") -> str:
+    """
+    Сразу отправить заглушку, а когда результат готов - заменить ее ответом
+    (для этапов без ИИ, например поиска сотрудника)
+    """
+    async def single_chunk():
+        yield await result_coro
+
+    return await stream_reply(bot, message, single_chunk(), placeholder_text, parse_mode)
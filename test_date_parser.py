@@ -0,0 +1,48 @@
+from datetime import date
+
+from date_parser import expand_year, month_from_name, parse_date
+
+TODAY = date(2024, 6, 15)
+
+
+def test_numeric_formats_day_first():
+    for text in ("05.03.1985", "5/3/1985", "05-03-1985", "5.3.85", "05031985"):
+        assert parse_date(text, today=TODAY) == "1985-03-05"
+
+
+def test_iso_format():
+    assert parse_date("1985-03-05", today=TODAY) == "1985-03-05"
+    assert parse_date("19850305", today=TODAY) == "1985-03-05"
+
+
+def test_russian_month_names():
+    for text in ("5 марта 1985", "5 мар. 1985 г.", "05 Март 1985 года"):
+        assert parse_date(text, today=TODAY) == "1985-03-05"
+    assert parse_date("1 мая 1990", today=TODAY) == "1990-05-01"
+
+
+def test_month_from_name():
+    assert month_from_name("Февраля") == 2
+    assert month_from_name("ма") is None
+    assert month_from_name("понедельник") is None
+
+
+def test_two_digit_year():
+    assert expand_year(5, TODAY) == 2005
+    assert expand_year(30, TODAY) == 1930
+    assert expand_year(1985, TODAY) == 1985
+
+
+def test_future_date_is_rejected():
+    assert parse_date("16.06.2024", today=TODAY) is None
+    assert parse_date("15.06.2024", today=TODAY) == "2024-06-15"
+    assert parse_date("01.01.2030", today=TODAY) is None
+
+
+def test_explicit_max_year_allows_later_dates():
+    assert parse_date("01.01.2030", max_year=2030, today=TODAY) == "2030-01-01"
+
+
+def test_invalid_dates():
+    for text in ("", "31.02.1985", "13.13.1985", "01.01.1899", "завтра", "5 бревна 1985"):
+        assert parse_date(text, today=TODAY) is None
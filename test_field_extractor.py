@@ -0,0 +1,51 @@
+from field_extractor import extract_fields, format_snils, normalize_phone, validate_inn, validate_snils
+
+
+def test_snils_checksum():
+    assert validate_snils("112-233-445 95")
+    assert validate_snils("11223344595")
+    assert not validate_snils("112-233-445 96")
+    assert not validate_snils("112-233-445")
+
+
+def test_small_snils_numbers_are_not_checked():
+    assert validate_snils("001-001-998 00")
+
+
+def test_format_snils():
+    assert format_snils("11223344595") == "112-233-445 95"
+
+
+def test_inn_checksum():
+    assert validate_inn("7707083893")
+    assert validate_inn("500100732259")
+    assert not validate_inn("500100732258")
+    assert not validate_inn("12345")
+
+
+def test_phone_is_normalised_to_e164():
+    for phone in ("+7 916 123-45-67", "8 (916) 123-45-67", "79161234567", "9161234567"):
+        assert normalize_phone(phone) == "+79161234567"
+
+
+def test_non_russian_or_short_phone_is_rejected():
+    assert normalize_phone("+1 916 123-45-67 8") is None
+    assert normalize_phone("123-45-67") is None
+    assert normalize_phone("4951234567") is None
+
+
+def test_extract_fields_from_order():
+    result = extract_fields("Иванов Иван, СНИЛС 11223344595, 8 916 123 45 67, ИНН 500100732259")
+    assert result["fields"] == {
+        "full_name": "Иванов Иван",
+        "snils": "112-233-445 95",
+        "phone": "+79161234567",
+        "inn": "500100732259",
+    }
+    assert result["warnings"] == []
+
+
+def test_bad_snils_checksum_is_kept_with_warning():
+    result = extract_fields("Иванов Иван, СНИЛС 112-233-445 96")
+    assert result["fields"]["snils"] == "112-233-445 96"
+    assert len(result["warnings"]) == 1
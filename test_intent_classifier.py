@@ -0,0 +1,54 @@
+from intent_classifier import INTENT_RULES_THRESHOLD, classify_intent, detect_name, is_only_name, redact_pii
+
+
+def test_full_order_is_decided_by_rules():
+    result = classify_intent("Иванов Иван, монтажник, СНИЛС 112-233-445 95, +7 916 123-45-67")
+    assert result["intent"] == "create_order"
+    assert result["employee_name"] == "Иванов Иван"
+    assert result["confidence"] >= INTENT_RULES_THRESHOLD
+
+
+def test_bare_full_name_is_search():
+    result = classify_intent("Мазитов Ильнар Раисович")
+    assert result["intent"] == "search_info"
+    assert result["confidence"] >= INTENT_RULES_THRESHOLD
+
+
+def test_question_words_are_not_a_name():
+    result = classify_intent("Сколько стоит обучение")
+    assert detect_name("Сколько стоит обучение")["name"] == ""
+    assert result["confidence"] < INTENT_RULES_THRESHOLD
+
+
+def test_data_label_is_not_a_name():
+    result = classify_intent("СНИЛС 123-456-789 01")
+    assert result["employee_name"] == ""
+    assert result["confidence"] < INTENT_RULES_THRESHOLD
+
+
+def test_single_field_with_history_goes_to_llm():
+    history = [{"role": "user", "content": "Иванов Иван, монтажник"}]
+    result = classify_intent("+7 916 123-45-67", history)
+    assert result["intent"] == "create_order"
+    assert result["confidence"] < INTENT_RULES_THRESHOLD
+
+
+def test_inflected_name_goes_to_llm():
+    for text in ("Покажи информацию о Петрове", "Найди Сидорова"):
+        result = classify_intent(text)
+        assert result["intent"] == "search_info"
+        assert result["confidence"] < INTENT_RULES_THRESHOLD
+
+
+def test_greetings_and_places_are_not_names():
+    for text in ("Добрый вечер, коллеги", "Спасибо большое", "Москва Россия"):
+        assert not is_only_name(text)
+        assert classify_intent(text)["intent"] != "search_info"
+
+
+def test_redact_pii_leaves_only_a_template():
+    result = redact_pii("Иванов  Иван, СНИЛС 112-233-445 95, +7 916 123-45-67, ИНН 500100732259, 01.02.1990")
+    assert result["name"] == "Иванов Иван"
+    assert result["text"] == "<ФИО>, СНИЛС <СНИЛС>, <ТЕЛЕФОН>, <ИНН>, <ДАТА>"
+    assert redact_pii("Найди Сидорова")["text"] == redact_pii("Найди Петрову")["text"]
+    assert redact_pii("Сколько стоит обучение") == {"text": "Сколько стоит обучение", "name": ""}
@@ -0,0 +1,41 @@
+import os
+import time
+
+from llm_ledger import CACHED, OK, LLMLedger, rollup
+
+
+def test_rotation_keeps_a_bounded_number_of_files(tmp_path):
+    path = str(tmp_path / "llm_ledger.jsonl")
+    ledger = LLMLedger(path, max_bytes=500, backups=2)
+    for attempt in range(50):
+        ledger.record("CEO диспетчер", "polza", "gpt-4.1", attempt, 0.5, OK)
+    files = ledger.files()
+    assert files[:2] == [path + ".2", path + ".1"]
+    assert not os.path.exists(path + ".3")
+    assert all(os.path.getsize(file) < 500 + 200 for file in files)
+    # Самые старые записи удалены вместе с вытесненным файлом
+    attempts = [record["a"] for record in ledger.read()]
+    assert attempts == sorted(attempts)
+    assert attempts[-1] == 49
+    assert len(attempts) < 50
+
+
+def test_read_skips_files_older_than_since(tmp_path):
+    path = str(tmp_path / "llm_ledger.jsonl")
+    ledger = LLMLedger(path, max_bytes=300, backups=3)
+    for attempt in range(10):
+        ledger.record("CEO диспетчер", "polza", "gpt-4.1", attempt, 0.5, OK)
+    old = time.time() - 3600
+    for file in ledger.files()[:-1]:
+        os.utime(file, (old, old))
+    assert {record["a"] for record in ledger.read(time.time() - 60)} <= {record["a"] for record in ledger.read()}
+    assert len(ledger.read(time.time() - 60)) < len(ledger.read())
+
+
+def test_rollup_latency_quantiles_ignore_cached_answers():
+    records = [{"ts": 0, "task": "t", "m": "", "o": OK, "l": 1.0} for _ in range(10)]
+    records.append({"ts": 0, "task": "t", "m": "", "o": CACHED, "l": 0.0})
+    total = rollup(records)["total"]
+    assert total["calls"] == 11
+    assert 0.5 < total["latency_p50"] <= 1.0
+    assert total["latency_p95"] <= 1.0
@@ -0,0 +1,114 @@
+import asyncio
+
+from message_coalescer import MessageCoalescer
+
+
+def make_coalescer(**kwargs):
+    handled = []
+
+    async def handler(message, text):
+        handled.append((message, text))
+
+    return MessageCoalescer(handler, **kwargs), handled
+
+
+def test_parts_sent_in_a_row_are_joined():
+    async def scenario():
+        coalescer, handled = make_coalescer(window=0.05, max_wait=1)
+        for number, text in enumerate(("Иванов Иван", "монтажник", "СНИЛС 112-233-445 95")):
+            await coalescer.add(1, number, text)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        return coalescer, handled
+
+    coalescer, handled = asyncio.run(scenario())
+    # Ответ идет на последнее сообщение, текст - все части по порядку
+    assert handled == [(2, "Иванов Иван\nмонтажник\nСНИЛС 112-233-445 95")]
+    assert coalescer.snapshot()["coalesced"] == 2
+    assert coalescer.snapshot()["pending_users"] == 0
+
+
+def test_zero_window_processes_at_once():
+    async def scenario():
+        coalescer, handled = make_coalescer(window=0)
+        await coalescer.add(1, "a", "Иванов Иван")
+        await coalescer.add(1, "b", "монтажник")
+        return handled
+
+    assert asyncio.run(scenario()) == [("a", "Иванов Иван"), ("b", "монтажник")]
+
+
+def test_max_wait_limits_the_delay():
+    async def scenario():
+        coalescer, handled = make_coalescer(window=0.05, max_wait=0.1)
+        for number in range(8):
+            await coalescer.add(1, number, str(number))
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+        return handled
+
+    handled = asyncio.run(scenario())
+    assert len(handled) >= 2
+    assert "\n".join(text for _, text in handled) == "\n".join(str(number) for number in range(8))
+
+
+def test_unbuffered_message_flushes_pending_parts_first():
+    async def scenario():
+        coalescer, handled = make_coalescer(window=1, should_buffer=lambda text: text != "/status")
+        await coalescer.add(1, "a", "Иванов Иван")
+        await coalescer.add(1, "b", "/status")
+        return coalescer, handled
+
+    coalescer, handled = asyncio.run(scenario())
+    assert handled == [("a", "Иванов Иван"), ("b", "/status")]
+    assert not coalescer.pending
+
+
+def test_users_are_buffered_separately_and_discard_drops_parts():
+    async def scenario():
+        coalescer, handled = make_coalescer(window=0.05, max_wait=1)
+        await coalescer.add(1, "a", "Иванов Иван")
+        await coalescer.add(2, "b", "Петров Петр")
+        coalescer.discard(1)
+        await asyncio.sleep(0.1)
+        return coalescer, handled
+
+    coalescer, handled = asyncio.run(scenario())
+    assert handled == [("b", "Петров Петр")]
+    assert coalescer.snapshot()["discarded"] == 1
+
+
+def test_handler_error_is_reported_and_lock_released():
+    async def scenario():
+        errors = []
+
+        async def handler(message, text):
+            raise RuntimeError("CRM недоступна")
+
+        async def on_error(message, error):
+            errors.append((message, str(error)))
+
+        coalescer = MessageCoalescer(handler, window=0, on_error=on_error)
+        await coalescer.add(1, "a", "Иванов Иван")
+        return coalescer, errors
+
+    coalescer, errors = asyncio.run(scenario())
+    assert errors == [("a", "CRM недоступна")]
+    assert coalescer.stats["errors"] == 1
+    assert not coalescer.locks
+
+
+def test_messages_of_one_user_are_processed_in_order():
+    async def scenario():
+        order = []
+
+        async def handler(message, text):
+            order.append(("start", message))
+            await asyncio.sleep(0.02 if message == "a" else 0)
+            order.append(("end", message))
+
+        coalescer = MessageCoalescer(handler, window=0)
+        await asyncio.gather(coalescer.add(1, "a", "1"), coalescer.add(1, "b", "2"))
+        return order
+
+    assert asyncio.run(scenario()) == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")]
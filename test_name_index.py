@@ -0,0 +1,53 @@
+from name_index import SCORE_EXACT, SCORE_FUZZY, SCORE_SUBSTRING, SCORE_TOKENS, NameIndex, normalize_name
+
+EMPLOYEES = [
+    {"full_name": "Иванов Иван Иванович"},
+    {"full_name": "Иванова Мария Петровна"},
+    {"full_name": "Семёнов Пётр Ильич"},
+    {"full_name": "Петров Иван Сергеевич"},
+]
+
+
+def names(results):
+    return [employee["full_name"] for employee, _ in results]
+
+
+def test_normalize_name_folds_yo_and_punctuation():
+    assert normalize_name("  Семёнов,  Пётр-Ильич ") == "семенов петр ильич"
+    assert normalize_name(None) == ""
+
+
+def test_exact_match_scores_highest():
+    results = NameIndex(EMPLOYEES).search("иванов иван иванович")
+    assert results[0] == (EMPLOYEES[0], SCORE_EXACT)
+
+
+def test_yo_and_ye_are_the_same_letter():
+    index = NameIndex(EMPLOYEES)
+    assert names(index.search("семенов петр")) == ["Семёнов Пётр Ильич"]
+    assert names(index.search("Семёнов")) == names(index.search("Семенов"))
+
+
+def test_surname_match_outranks_first_name_match():
+    results = NameIndex(EMPLOYEES).search("Иван")
+    assert names(results)[:2] == ["Иванов Иван Иванович", "Петров Иван Сергеевич"]
+    assert results[0][1] > results[1][1] >= SCORE_TOKENS
+
+
+def test_whole_word_outranks_prefix_and_substring():
+    index = NameIndex(EMPLOYEES)
+    assert names(index.search("Иванов")) == ["Иванов Иван Иванович", "Иванова Мария Петровна"]
+    assert {score for _, score in index.search("ванов")} == {SCORE_SUBSTRING}
+
+
+def test_typo_is_found_below_strict_matches():
+    results = NameIndex(EMPLOYEES).search("Ивнов Иван Иванович")
+    assert names(results) == ["Иванов Иван Иванович"]
+    assert results[0][1] <= SCORE_FUZZY
+
+
+def test_min_score_and_limit():
+    index = NameIndex(EMPLOYEES)
+    assert index.search("ванов", min_score=SCORE_SUBSTRING + 1) == []
+    assert len(index.search("Иван", limit=1)) == 1
+    assert index.best("Петров")["full_name"] == "Петров Иван Сергеевич"
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+
+import provider_health
+from provider_health import CLOSED, HALF_OPEN, OPEN, ProviderHealthRegistry
+
+FAST = ("polza", "openai")
+SLOW = ("openrouter", "openai")
+
+
+def fail(registry, key, times=1):
+    for _ in range(times):
+        registry.record_failure(key, 0.1, RuntimeError("boom"))
+
+
+def test_consecutive_failures_open_the_breaker():
+    registry = ProviderHealthRegistry()
+    fail(registry, FAST, provider_health.LLM_HEALTH_CONSECUTIVE_FAILURES - 1)
+    assert registry.get(FAST).state == CLOSED
+    fail(registry, FAST)
+    assert registry.get(FAST).state == OPEN
+    assert registry.order([FAST, SLOW]) == [SLOW]
+
+
+def test_error_rate_opens_the_breaker():
+    registry = ProviderHealthRegistry()
+    registry.record_success(FAST, 0.1)
+    fail(registry, FAST)
+    registry.record_success(FAST, 0.1)
+    fail(registry, FAST, provider_health.LLM_HEALTH_MIN_CALLS - 3)
+    assert registry.get(FAST).consecutive_failures < provider_health.LLM_HEALTH_CONSECUTIVE_FAILURES
+    assert registry.get(FAST).state == OPEN
+
+
+def test_open_breaker_becomes_half_open_with_one_probe():
+    registry = ProviderHealthRegistry()
+    fail(registry, FAST, provider_health.LLM_HEALTH_CONSECUTIVE_FAILURES)
+    health = registry.get(FAST)
+    later = health.opened_at + provider_health.LLM_HEALTH_OPEN_SECONDS
+    assert not health.available(later - 1)
+    assert health.available(later)
+    assert health.state == HALF_OPEN
+
+    health.probe_in_flight = True
+    assert not health.available(later)
+
+
+def test_probe_result_closes_or_reopens_the_breaker():
+    registry = ProviderHealthRegistry()
+    fail(registry, FAST, provider_health.LLM_HEALTH_CONSECUTIVE_FAILURES)
+    health = registry.get(FAST)
+
+    health.state = HALF_OPEN
+    fail(registry, FAST)
+    assert health.state == OPEN
+
+    health.state = HALF_OPEN
+    registry.record_success(FAST, 0.1)
+    assert health.state == CLOSED
+    assert health.error_rate == 0
+
+
+def test_call_records_outcome_and_cancelled_probe_frees_the_slot():
+    async def ok():
+        return "ok"
+
+    async def bad():
+        raise ValueError("bad response")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        registry = ProviderHealthRegistry()
+        assert await registry.call(FAST, ok) == "ok"
+        with pytest.raises(ValueError):
+            await registry.call(SLOW, bad)
+
+        registry.get(FAST).state = HALF_OPEN
+        task = asyncio.ensure_future(registry.call(FAST, hang))
+        await asyncio.sleep(0)
+        assert registry.get(FAST).probe_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return registry
+
+    registry = asyncio.run(scenario())
+    assert registry.get(FAST).calls == 1
+    assert registry.get(FAST).failures == 0
+    assert not registry.get(FAST).probe_in_flight
+    assert registry.get(SLOW).failures == 1
+
+
+def test_faster_provider_goes_first_within_model_type(monkeypatch):
+    monkeypatch.setattr(provider_health, "LLM_ADAPTIVE_ORDER", True)
+    registry = ProviderHealthRegistry()
+    registry.record_success(FAST, 3.0)
+    registry.record_success(SLOW, 1.0)
+    claude = ("polza", "claude")
+    assert registry.order([FAST, SLOW, claude]) == [SLOW, FAST, claude]
+
+
+def test_all_open_falls_back_to_priority_list():
+    registry = ProviderHealthRegistry()
+    for key in (FAST, SLOW):
+        fail(registry, key, provider_health.LLM_HEALTH_CONSECUTIVE_FAILURES)
+        registry.get(key).opened_at = time.monotonic()
+    assert registry.order([FAST, SLOW]) == [FAST, SLOW]
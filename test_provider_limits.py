@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from provider_limits import ProviderBusy, ProviderLimiter, TokenBucket
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    # Запрос больше емкости ждет полную корзину, а не бесконечно
+    assert bucket.wait_time(120, now) == pytest.approx(60.0)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.take(1000)
+    assert bucket.wait_time(1000, bucket.updated_at) == 0
+
+
+def test_requests_are_served_in_fifo_order():
+    async def scenario():
+        limiter = ProviderLimiter("test", max_concurrency=1, max_wait=5)
+        order = []
+
+        async def worker(number):
+            await limiter.acquire(0)
+            order.append(number)
+            await asyncio.sleep(0.01)
+            limiter.release(0)
+
+        await asyncio.gather(*(worker(number) for number in range(5)))
+        return order, limiter.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    assert order == [0, 1, 2, 3, 4]
+    assert snapshot["in_flight"] == 0
+    assert snapshot["queued"] == 0
+    assert snapshot["acquired"] == 5
+    # Первый запрос занимает слот сразу, остальные четыре ждут
+    assert snapshot["max_queued"] == 4
+
+
+def test_request_is_rejected_after_max_wait():
+    async def scenario():
+        limiter = ProviderLimiter("test", max_concurrency=1, max_wait=0.05)
+        await limiter.acquire(0)
+        with pytest.raises(ProviderBusy):
+            await limiter.acquire(0)
+        # Отказавший запрос не остается в очереди и не блокирует следующих
+        assert limiter.rejected == 1
+        assert len(limiter.queue) == 0
+        limiter.release(0)
+        await limiter.acquire(0)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_longer_than_max_wait_is_rejected_at_once():
+    async def scenario():
+        limiter = ProviderLimiter("test", rpm=1, max_wait=1)
+        await limiter.acquire(0)
+        limiter.release(0)
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(ProviderBusy):
+            await limiter.acquire(0)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(scenario()) < 0.5
+
+
+def test_cancelled_head_wakes_the_next_request():
+    async def scenario():
+        limiter = ProviderLimiter("test", max_concurrency=1, max_wait=5)
+        await limiter.acquire(0)
+        head = asyncio.ensure_future(limiter.acquire(0))
+        second = asyncio.ensure_future(limiter.acquire(0))
+        await asyncio.sleep(0.01)
+        head.cancel()
+        limiter.release(0)
+        await asyncio.wait_for(second, timeout=1)
+        return limiter.in_flight
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_pause_delays_new_requests():
+    async def scenario():
+        limiter = ProviderLimiter("test", max_wait=1)
+        limiter.pause(0.1)
+        return await limiter.acquire(0)
+
+    assert asyncio.run(scenario()) >= 0.09
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": 42}
+
+        results = await asyncio.gather(*(flights.do(("people_get", 42), load) for _ in range(5)))
+        return flights, calls, results
+
+    flights, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats()["executions"] == 1
+    assert flights.stats()["shared"] == 4
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_different_keys_and_later_calls_run_separately():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            return len(calls)
+
+        await asyncio.gather(flights.do("a", load), flights.do("b", load))
+        await flights.do("a", load)
+        return calls
+
+    assert len(asyncio.run(scenario())) == 3
+
+
+def test_exception_is_shared_and_not_cached():
+    async def scenario():
+        flights = SingleFlight()
+        attempts = []
+
+        async def load():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            if len(attempts) == 1:
+                raise RuntimeError("CRM недоступна")
+            return "ok"
+
+        results = await asyncio.gather(flights.do("k", load), flights.do("k", load), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        return await flights.do("k", load)
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            return "ok"
+
+        first = asyncio.ensure_future(flights.do("k", load))
+        second = asyncio.ensure_future(flights.do("k", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "ok"
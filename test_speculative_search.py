@@ -0,0 +1,25 @@
+from speculative_search import SpeculativeSearch
+
+
+def speculation(name):
+    # Без запуска поиска: проверяется только сравнение ФИО
+    search = SpeculativeSearch.__new__(SpeculativeSearch)
+    search.employee_name = name
+    return search
+
+
+def test_same_name_matches():
+    assert speculation("Иванов Иван").matches("иванов  иван")
+    assert speculation("Семёнов Пётр").matches("Семенов Петр")
+
+
+def test_inflected_name_matches_nominative():
+    assert speculation("Иванова").matches("Иванов")
+    assert speculation("Петрову").matches("Петров")
+    assert speculation("Петрове").matches("Петров")
+
+
+def test_different_person_does_not_match():
+    assert not speculation("Сидорова").matches("Петров")
+    assert not speculation("Иванов Иван").matches("Иванов Петр")
+    assert not speculation("Иванов").matches("")
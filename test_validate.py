@@ -0,0 +1,59 @@
+import pytest
+
+from validate import ORDER_FIELDS, parse_json_response, validate_order_schema
+
+
+def test_parse_plain_and_fenced_json():
+    assert parse_json_response('{"a": 1}') == {"a": 1}
+    assert parse_json_response('```json\n{"a": 1}\n```') == {"a": 1}
+    assert parse_json_response('["1985-03-05"]') == ["1985-03-05"]
+
+
+def test_parse_json_surrounded_by_text():
+    text = 'Вот результат:\n{"employee": {"full_name": "Иванов Иван"}}\nГотово.'
+    assert parse_json_response(text) == {"employee": {"full_name": "Иванов Иван"}}
+
+
+def test_parse_repairs_common_mistakes():
+    assert parse_json_response('{"a": 1, "b": [1, 2,],}') == {"a": 1, "b": [1, 2]}
+    assert parse_json_response("{'a': 'b'}") == {"a": "b"}
+    assert parse_json_response('{"a": True, "b": None}') == {"a": True, "b": None}
+
+
+def test_parse_gives_up_on_garbage():
+    assert parse_json_response("не удалось разобрать") is None
+    assert parse_json_response('{"a": ') is None
+
+
+def test_parse_passes_through_non_strings():
+    assert parse_json_response({"a": 1}) == {"a": 1}
+
+
+def test_schema_normalises_fields_and_derives_missing():
+    result = validate_order_schema({
+        "employee": {"full_name": " Иванов Иван ", "position": "монтажник", "phone": None, "inn": 500100732259},
+        "missing": ["birth_date"],
+    })
+    assert list(result["employee"]) == ORDER_FIELDS
+    assert result["employee"]["full_name"] == "Иванов Иван"
+    assert result["employee"]["phone"] == ""
+    assert result["employee"]["inn"] == "500100732259"
+    # missing выводится из данных, а не берется из ответа ИИ
+    assert result["missing"] == ["phone", "snils", "birth_date"]
+
+
+def test_schema_accepts_unwrapped_employee():
+    result = validate_order_schema({"full_name": "Иванов Иван"})
+    assert result["employee"]["full_name"] == "Иванов Иван"
+
+
+@pytest.mark.parametrize("data", [
+    ["Иванов Иван"],
+    {"missing": []},
+    {"employee": "Иванов Иван"},
+    {"employee": {"name": "Иванов Иван"}},
+    {"employee": {"full_name": {"last": "Иванов"}}},
+])
+def test_schema_rejects_malformed_answers(data):
+    with pytest.raises(ValueError):
+        validate_order_schema(data)
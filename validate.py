@@ -1,8 +1,68 @@
+import os
+import re
+import json
+import asyncio
+
 from api_settings import DATE_CONVERSION_PRIORITY, ORDER_FORMAT_PRIORITY
 from ai_request import make_api_request_with_fallback
+from date_parser import parse_date
+from field_extractor import extract_fields
+
+# Сколько раз переспрашивать ИИ, если ответ разбора заказа не прошел проверку схемы
+ORDER_EXTRACT_RETRIES = int(os.getenv("ORDER_EXTRACT_RETRIES", "1"))
+
+ORDER_FIELDS = ["full_name", "position", "phone", "snils", "inn", "birth_date"]
+# Обязательные поля заказа и их названия для пользователя (ИНН не обязателен)
+REQUIRED_ORDER_FIELDS = {
+    "full_name": "ФИО",
+    "position": "должность",
+    "phone": "телефон",
+    "snils": "СНИЛС",
+    "birth_date": "дата рождения",
+}
+
+_fence_re = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_trailing_comma_re = re.compile(r",\s*([}\]])")
+
+
+def parse_json_response(text):
+    """
+    Разобрать JSON из ответа ИИ: убирает markdown-блоки и текст вокруг JSON,
+    исправляет частые ошибки (висячие запятые, одинарные кавычки, True/False/None)
+
+    Returns:
+        dict | list: Разобранный JSON или None, если исправить не удалось
+    """
+    if not isinstance(text, str):
+        return text
+    text = _fence_re.sub("", text.strip())
+    candidates = [text]
+    # JSON внутри пояснений: от первой открывающей до последней закрывающей скобки
+    for opening, closing in (("{", "}"), ("[", "]")):
+        start, end = text.find(opening), text.rfind(closing)
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+
+    for candidate in candidates:
+        repaired = _trailing_comma_re.sub(r"\1", candidate)
+        variants = [candidate, repaired]
+        if '"' not in repaired:
+            variants.append(repaired.replace("'", '"'))
+        variants.append(re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", re.sub(r"\bNone\b", "null", repaired))))
+        for variant in variants:
+            try:
+                return json.loads(variant)
+            except json.JSONDecodeError:
+                continue
+    return None
 
 
 async def convert_date(date):
+    # Известные форматы (дд.мм.гггг, ISO, "5 мая 1985" и т.д.) разбираются без ИИ
+    parsed = parse_date(date)
+    if parsed:
+        return parsed
+
     try:
         response, used_client, used_model = await make_api_request_with_fallback(
             priority_list=DATE_CONVERSION_PRIORITY,
@@ -17,7 +77,8 @@ async def convert_date(date):
             ],
 
             temperature=0.1,
-            task_name="Конвертация даты"
+            task_name="Конвертация даты",
+            cache_validator=lambda content: bool(parse_date(content.strip().strip('"').strip("'")))
         )
         
         if not response:
@@ -27,107 +88,195 @@ async def convert_date(date):
         # Убираем кавычки если они есть
         result = response.choices[0].message.content.strip().strip('"').strip("'")
         print(f"📊 Использован: {used_client} / {used_model}")
+        if not parse_date(result):
+            print(f"❌ ИИ вернул некорректную дату '{result}', возвращаем исходную: {date}")
+            return date
         print(f"✅ Дата сконвертирована: {date} → {result}")
-        return result
+        return parse_date(result)
     except Exception as e:
         print(f"Ошибка при конвертации даты: {e}")
         return date
 
 
+def _is_date_array(answers, length):
+    """Ответ ИИ на конвертацию дат - массив нужной длины"""
+    return isinstance(answers, list) and len(answers) == length
+
 
-async def makeOrderformat(order, chat_history=None):
-    messages_with_system = [
-        {"role": "system", "content": """Ты форматируешь заказ для обучения сотрудника.
-
-ВАЖНО: Анализируй ВСЮ историю чата + текущее сообщение!
-Данные могут быть разбросаны по нескольким сообщениям.
-
-ИЗ ВСЕХ СООБЩЕНИЙ извлекай:
-- full_name - ФИО сотрудника (любой формат)
-- position - должность сотрудника (любая профессия)
-- phone - телефон сотрудника (любой формат)
-- snils - СНИЛС сотрудника (XXX-XXX-XXX XX или XXXXXXXXXX)
-- inn - ИНН сотрудника (не обязательно)
-- birth_date - дата рождения (любой формат, конвертируй в yyyy-mm-dd)
-
-ПРАВИЛА:
-1. Объединяй данные из всех сообщений в истории
-2. Если данные есть в разных сообщениях - используй их
-3. Если дата в формате дд.мм.гггг - конвертируй в yyyy-mm-dd
-4. Если каких-то данных нет - оставляй пустую строку ""
-
-Возвращай JSON в формате:
-{
-    "full_name": "string",
-    "position": "string", 
-    "phone": "string",
-    "snils": "string",
-    "inn": "string",
-    "birth_date": "string"
-}"""},
-        {"role": "user", "content": f"Текущее сообщение: {order}"}
-    ]
-    
-    if chat_history:
-        messages_with_system.append({"role": "user", "content": f"История чата: {chat_history}"})
+async def convert_dates(dates):
+    """
+    Конвертировать список дат: известные форматы разбираются локально,
+    остальные уникальные значения - одним запросом к ИИ
 
+    Returns:
+        list: Даты в формате yyyy-mm-dd (нераспознанные возвращаются как есть, пустые - пустыми)
+    """
+    results = [parse_date(date) if date else "" for date in dates]
+    unresolved = list(dict.fromkeys(date for date, result in zip(dates, results) if result is None))
+    if not unresolved:
+        return results
+
+    converted = {}
     response, used_client, used_model = await make_api_request_with_fallback(
-            priority_list=ORDER_FORMAT_PRIORITY,
-            messages=messages_with_system,
-            temperature=0.1,
-            task_name="Форматирование заказа"
-        )
-    if not response:
-        print(f"❌ Не удалось сформировать формат заказа, возвращаем исходный заказ: {order}")
-        return order
-    result = response.choices[0].message.content.strip().strip('"').strip("'")
-    print(f"📊 Использован: {used_client} / {used_model}")
-    print(f"✅ Формат заказа сформирован: {order} → {result}")
+        priority_list=DATE_CONVERSION_PRIORITY,
+        messages=[
+            {"role": "system", "content": """Ты конвертер дат. Получаешь JSON-массив дат в любом формате.
+Возвращаешь только JSON-массив той же длины и в том же порядке: каждая дата в формате yyyy-mm-dd,
+или пустая строка, если дату невозможно определить. Без пояснений и markdown."""},
+            {"role": "user", "content": json.dumps(unresolved, ensure_ascii=False)},
+        ],
+        temperature=0.1,
+        task_name="Конвертация дат",
+        cache_validator=lambda content: _is_date_array(parse_json_response(content), len(unresolved))
+    )
+    if response:
+        answers = parse_json_response(response.choices[0].message.content)
+        if _is_date_array(answers, len(unresolved)):
+            converted = {date: parse_date(str(answer)) for date, answer in zip(unresolved, answers)}
+            print(f"📊 Использован: {used_client} / {used_model}")
+
+    if not converted:
+        # ИИ не вернул корректный массив - конвертируем по одной
+        converted = dict(zip(unresolved, await asyncio.gather(*(convert_date(date) for date in unresolved))))
+
+    print(f"✅ Дат сконвертировано: {len(dates)}, через ИИ: {len(unresolved)}")
+    return [result if result is not None else (converted.get(date) or date)
+            for date, result in zip(dates, results)]
+
+
+FIELD_DESCRIPTIONS = {
+    "full_name": "ФИО (любой формат)",
+    "position": "должность (любая профессия)",
+    "phone": "телефон (любой формат: +7, 8, без пробелов)",
+    "snils": "СНИЛС (XXX-XXX-XXX XX или 11 цифр)",
+    "inn": "ИНН (не обязательно)",
+    "birth_date": "дата рождения, конвертируй в yyyy-mm-dd",
+}
+
+
+def build_extract_prompt(fields):
+    """Промпт разбора заказа только для полей, которые не удалось извлечь локально"""
+    field_lines = "\n".join(f"- {field} - {FIELD_DESCRIPTIONS[field]}" for field in fields)
+    empty = json.dumps({field: "" for field in fields})
+    return f"""Ты разбираешь заказ на обучение сотрудника. Пользователь мог вводить данные частями в нескольких сообщениях - это один сотрудник.
+
+Найди в сообщениях только эти поля:
+{field_lines}
+
+Если поля нет - оставляй пустую строку "", ничего не придумывай.
+Возвращай ТОЛЬКО JSON без пояснений и markdown: {{"employee": {empty}}}"""
+
+
+def validate_order_schema(data):
+    """
+    Проверить и нормализовать ответ разбора заказа
+
+    Returns:
+        dict: {"employee": {...}, "missing": [...]}
+
+    Raises:
+        ValueError: ответ не соответствует схеме
+    """
+    if not isinstance(data, dict):
+        raise ValueError("ожидался JSON-объект")
+    employee = data.get("employee")
+    if employee is None and "full_name" in data:
+        # Ответ без обертки - сами поля сотрудника
+        employee = data
+    if not isinstance(employee, dict):
+        raise ValueError("нет объекта employee")
+    if not any(field in employee for field in ORDER_FIELDS):
+        raise ValueError("в employee нет полей сотрудника")
+
+    normalized = {}
+    for field in ORDER_FIELDS:
+        value = employee.get(field)
+        if isinstance(value, (dict, list)):
+            raise ValueError(f"поле {field} должно быть строкой")
+        normalized[field] = "" if value is None else str(value).strip()
+
+    # Список отсутствующих полей выводится из самих данных - так он всегда согласован с записью
+    missing = [field for field in REQUIRED_ORDER_FIELDS if not normalized[field]]
+    return {"employee": normalized, "missing": missing}
+
+
+async def extractOrder(order, chat_history=None):
+    """
+    Разобрать заказ: СНИЛС, ИНН, телефон, дата, ФИО и должность сначала извлекаются локально,
+    ИИ получает компактный запрос только по оставшимся полям (или не вызывается вовсе)
+
+    Args:
+        order: Текущее сообщение пользователя
+        chat_history: История чата
+
+    Returns:
+        dict: {"success": True, "employee": {...}, "missing": [], "warnings": [...], "message": ...}
+              или {"error": "missing_data", "employee": {...}, "missing": [...], "message": "Отсутствует: ..."}
+              или {"error": "extraction_failed", "message": ...}
+    """
+    local = extract_fields(order, chat_history)
+    # Поля, найденные раньше (в т.ч. из уже отброшенных сообщений), дополняются новыми
+    known = {**getattr(chat_history, "fields", {}), **local["fields"]}
+    unresolved = [field for field in ORDER_FIELDS if field not in known]
+
+    if any(field in REQUIRED_ORDER_FIELDS for field in unresolved):
+        # В ИИ уходят только сообщения пользователя, без служебных ответов бота
+        texts = [entry.get("content", "") for entry in chat_history or []
+                 if isinstance(entry, dict) and entry.get("role") == "user"]
+        texts.append(order)
+        messages = [
+            {"role": "system", "content": build_extract_prompt(unresolved)},
+            {"role": "user", "content": "\n".join(str(text) for text in texts)}
+        ]
+        found = await _extract_with_llm(messages)
+        if found is None:
+            return {"error": "extraction_failed", "message": "не удалось получить корректный ответ ИИ"}
+        employee = {field: found.get(field, "") for field in unresolved}
+        employee.update(known)
+    else:
+        print(f"⚡ Заказ разобран без ИИ: {order}")
+        employee = known
+
+    result = validate_order_schema({"employee": employee})
+    result["warnings"] = local["warnings"]
+    if result["missing"]:
+        names = ", ".join(REQUIRED_ORDER_FIELDS[field] for field in result["missing"])
+        result.update({"error": "missing_data", "message": f"Отсутствует: {names}"})
+    else:
+        result.update({"success": True, "message": "Все данные найдены"})
+    print(f"✅ Заказ разобран: {order} → {result}")
     return result
 
-async def validateOrder(order, chat_history):
-    messages_with_system = [
-        {"role": "system", "content": """Ты контроллер заказа. ВАЖНО: Это диалог с пользователем, который может вводить данные частями!
-
-ПРАВИЛА АНАЛИЗА:
-1. Собери ВСЕ данные из истории чата + текущего сообщения
-2. Это ОДИН заказ, данные могут быть в разных сообщениях
-3. Если в истории есть ФИО, а в текущем сообщении должность - это ОДИН человек!
-
-ПРИМЕР:
-- История: "Иванов Иван Иванович, СНИЛС: 123-456-789 01, 01.01.1990"
-- Текущее: "Менеджер, +7-999-123-45-67"
-- РЕЗУЛЬТАТ: Все данные найдены! (ФИО из истории + должность и телефон из текущего)
-
-ПРИМЕР 2:
-- История: "Егоров Андрей Федорович, СНИЛС: 199-010-000-00, +79631218121, Прораб"
-- Текущее: "16.09.1994"
-- РЕЗУЛЬТАТ: Все данные найдены! (ФИО, СНИЛС, телефон, должность из истории + дата из текущего)
-
-ИЩИ В ВСЕХ СООБЩЕНИЯХ:
-- ФИО (любой формат обязательно)
-- Должность (любая профессия обязательно)
-- Телефон (любой формат: +7, 8, без пробелов обязательно)
-- СНИЛС (XXX-XXX-XXX XX или XXXXXXXXXX обязательно)
-- Дата рождения (любой формат обязательно: 16.09.1994, 16/09/1994, 16-09-1994, 16.09.94 и т.д.)
-- ИНН (не обязательно)
-
-Если ВСЕ найдено - возвращай: {"success": true, "message": "Все данные найдены"}
-Если чего-то нет - возвращай: {"error": "missing_data", "message": "Отсутствует: [что именно]"}"""},
-        {"role": "user", "content": f"Текущее сообщение: {order}"},
-        {"role": "user", "content": f"История чата: {chat_history}"}
-    ]
 
-    response, used_client, used_model = await make_api_request_with_fallback(
+async def _extract_with_llm(messages):
+    """
+    Запрос разбора к ИИ с проверкой схемы; некорректный ответ переспрашивается
+
+    Returns:
+        dict: Найденные поля сотрудника или None
+    """
+    error = "нет ответа от ИИ"
+    for attempt in range(ORDER_EXTRACT_RETRIES + 1):
+        response, used_client, used_model = await make_api_request_with_fallback(
             priority_list=ORDER_FORMAT_PRIORITY,
-            messages=messages_with_system,
-            task_name="Проверка заказа"
+            messages=messages,
+            temperature=0.1,
+            task_name="Разбор заказа"
         )
-    if not response:
-        print(f"❌ Не удалось проверить данные в заказе, возвращаем исходный заказ: {order}")
-        return order
-    result = response.choices[0].message.content.strip().strip('"').strip("'")
-    print(f"📊 Использован: {used_client} / {used_model}")
-    print(f"✅ Данные в заказе проверены: {order} → {result}")
-    return result
+        if not response:
+            break
+        content = response.choices[0].message.content
+        print(f"📊 Использован: {used_client} / {used_model}")
+        try:
+            return validate_order_schema(parse_json_response(content))["employee"]
+        except ValueError as e:
+            error = f"некорректный ответ ИИ ({e})"
+            print(f"⚠️ Разбор заказа: {error}, попытка {attempt + 1}")
+            # Просим исправить ответ, показав ошибку
+            messages = messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"Ответ не соответствует схеме: {e}. Верни только JSON в указанном формате."}
+            ]
 
+    print(f"❌ Не удалось разобрать заказ: {error}")
+    return None